@@ -0,0 +1,59 @@
+# Times applying a large closure feed to a week of hours: checking every
+# day against every closure, versus apply_closures walking the days along
+# the closures merged once per refresh in lib.closures.ClosureIndex.
+#
+#   python -m benchmarks.bench_closures
+import datetime
+import timeit
+
+from lib.closures import Closure, ClosureIndex, apply_closures
+from lib.schedule import compile_schedule, schedule_week
+
+REGULAR_HOURS = {'regular_hours': [
+    {'day': day, 'hours': '10 AM–6 PM'}
+    for day in ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']]}
+
+
+def synthetic_closures(count, current_date):
+    # overlapping closures of a few hours, spread over the years around today
+    closures = []
+    for i in range(count):
+        start = current_date + datetime.timedelta(hours=7 * (i - count // 2))
+        closures.append(Closure(start, start + datetime.timedelta(hours=3 + i % 12)))
+    return closures
+
+
+def apply_every_closure(hours, closures):
+    # the naive approach: every closure is compared with every open day
+    for day in hours:
+        if day['startTime'] is None:
+            continue
+        opens = datetime.datetime.fromisoformat(day['startTime'])
+        closes = datetime.datetime.fromisoformat(day['endTime'])
+        for closure in closures:
+            if closure.start < closes and closure.end > opens:
+                if closure.start <= opens:
+                    opens = max(opens, closure.end)
+                else:
+                    closes = min(closes, closure.start)
+    return hours
+
+
+def main():
+    current_date = datetime.datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
+    schedule = compile_schedule(REGULAR_HOURS)
+    runs = 20
+    for count in [100, 1000, 10000]:
+        closures = sorted(synthetic_closures(count, current_date))
+        index = ClosureIndex(closures)
+        build = timeit.timeit(lambda: ClosureIndex(closures), number=runs) / runs
+        naive = timeit.timeit(lambda: apply_every_closure(schedule_week(schedule, current_date), closures),
+                              number=runs) / runs
+        merged = timeit.timeit(lambda: apply_closures(schedule_week(schedule, current_date), index, current_date),
+                               number=runs) / runs
+        print(f'{count:>6} closures: {naive * 1000:8.3f} ms every closure, '
+              f'{merged * 1000:7.3f} ms merged ({build * 1000:7.3f} ms to index once per refresh)')
+
+
+if __name__ == '__main__':
+    main()
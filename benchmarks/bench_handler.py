@@ -0,0 +1,27 @@
+# Measures per-invocation handler time for /docs/locations and a 404 with
+# configuration and the swagger response loaded once per container, versus
+# reloading both on every invocation as the handler used to.
+#
+#   python -m benchmarks.bench_handler
+import os
+import timeit
+
+import main
+
+
+def run():
+    os.environ['ENVIRONMENT'] = 'qa'
+    docs = {'path': '/docs/locations', 'httpMethod': 'GET'}
+    not_found = {'path': 'spaghetti', 'httpMethod': 'GET'}
+    runs = 50
+    main.logger.disabled = True
+    for (name, event) in [('/docs/locations', docs), ('404', not_found)]:
+        main.handler(event, {})
+        hoisted = timeit.timeit(lambda: main.handler(event, {}), number=runs)
+        reloaded = timeit.timeit(lambda: main.handler(dict(event, reloadConfig=True), {}), number=runs)
+        print(f'{name:>16}: {reloaded / runs * 1000:7.3f} ms reloading, '
+              f'{hoisted / runs * 1000:7.3f} ms loaded once')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,44 @@
+# Times the hours computation for a large fields=hours request where every
+# code shares the SASB parent location: recomputing per code versus the
+# per-(parent, date, revision) memo in lib.location_api.
+#
+#   python -m benchmarks.bench_hours
+import json
+import timeit
+
+import lib.location_api
+from lib.location_api import get_location_data, ingest_location
+
+
+def main():
+    with open('test/data/drupal_responses/ma.json') as drupal_response:
+        attributes = json.load(drupal_response)['data'][0]['attributes']
+    lib.location_api.CACHE.set('ma', ingest_location(attributes))
+    codes = [f'ma{i}' for i in range(200)]
+    runs = 20
+
+    def recompute():
+        # the previous behaviour: hours are built again for every code
+        for code in codes:
+            lib.location_api.HOURS_CACHE['hours'] = {}
+            get_location_data(code, ['hours'])
+
+    def cold_memo():
+        # first request of the day: one computation shared by every code
+        lib.location_api.HOURS_CACHE['hours'] = {}
+        for code in codes:
+            get_location_data(code, ['hours'])
+
+    def warm_memo():
+        for code in codes:
+            get_location_data(code, ['hours'])
+
+    print(f'{len(codes)} codes per request')
+    for (name, run) in [('recompute per code', recompute), ('memo, cold', cold_memo),
+                        ('memo, warm', warm_memo)]:
+        print(f'{name:>18}: {timeit.timeit(run, number=runs) / runs * 1000:7.3f} ms/request')
+
+
+if __name__ == '__main__':
+    lib.location_api.logger.disabled = True
+    main()
@@ -0,0 +1,36 @@
+# Reports the memory held for by_sierra_location.json before and after it
+# is reduced to the code -> label lookup table kept in lib.nypl_core.CACHE.
+#
+#   python -m benchmarks.bench_nypl_core_memory
+import json
+import tracemalloc
+
+from benchmarks.bench_snapshot import synthetic_nypl_core
+from lib.nypl_core import reduce_nypl_core_objects
+
+
+def retained(build):
+    tracemalloc.start()
+    data = build()
+    (size, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (data, size)
+
+
+def reduced(body):
+    full = json.loads(body)
+    # only the reduced table outlives the parsed file
+    return reduce_nypl_core_objects('by_sierra_location.json', full.items())
+
+
+def main():
+    body = json.dumps(synthetic_nypl_core())
+    (full, full_size) = retained(lambda: json.loads(body))
+    (_, reduced_size) = retained(lambda: reduced(body))
+    print(f'{len(full)} locations')
+    print(f'full parsed file:    {full_size / 1024:8.0f} KiB')
+    print(f'reduced label table: {reduced_size / 1024:8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
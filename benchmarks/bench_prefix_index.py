@@ -0,0 +1,51 @@
+# Compares resolving Sierra codes against the S3 locations mapping with the
+# original per-code regex scan and with the precompiled PrefixIndex.
+#
+#   python -m benchmarks.bench_prefix_index
+import random
+import re
+import string
+import timeit
+
+from lib.prefix_index import PrefixIndex
+
+
+def synthetic_mapping(size=600):
+    random.seed(0)
+    mapping = {}
+    while len(mapping) < size:
+        prefix = ''.join(random.choices(string.ascii_lowercase,
+                                        k=random.randint(2, 4)))
+        mapping[prefix + '*'] = f'https://www.nypl.org/locations/{prefix}'
+    return mapping
+
+
+def regex_scan(mapping, location_code):
+    url = None
+    for s3_code, s3_url in mapping.items():
+        regex = r'^(' + s3_code[0:-1] + ')+'
+        if re.match(regex, location_code) is not None:
+            url = s3_url
+    return url
+
+
+def main():
+    mapping = synthetic_mapping()
+    codes = [pattern[0:-1] + '99' for pattern in list(mapping)[:50]]
+    index = PrefixIndex(mapping)
+
+    runs = 20
+    scan = timeit.timeit(
+        lambda: [regex_scan(mapping, code) for code in codes], number=runs)
+    build = timeit.timeit(lambda: PrefixIndex(mapping), number=runs)
+    lookup = timeit.timeit(
+        lambda: [index.match(code) for code in codes], number=runs)
+
+    print(f'{len(mapping)} patterns, {len(codes)} codes per request')
+    print(f'regex scan:   {scan / runs * 1000:8.3f} ms/request')
+    print(f'index build:  {build / runs * 1000:8.3f} ms/S3 refresh')
+    print(f'index lookup: {lookup / runs * 1000:8.3f} ms/request')
+
+
+if __name__ == '__main__':
+    main()
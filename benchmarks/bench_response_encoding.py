@@ -0,0 +1,56 @@
+# Compares payload bytes and serialization time for a 100-code
+# fields=hours,location,url response: json.dumps with default separators, as
+# create_response used to, versus the compact encoder in
+# lib.response_encoding, and that body gzip (and brotli, when installed)
+# compressed and base64 encoded as the handler sends it.
+#
+#   python -m benchmarks.bench_response_encoding
+import json
+import timeit
+
+import lib.location_api
+from lib.location_api import get_location_data, ingest_location
+from lib.response_encoding import brotli_module, dumps, encode_response
+
+
+def synthetic_response(count=100):
+    with open('test/data/drupal_responses/ma.json') as drupal_response:
+        attributes = json.load(drupal_response)['data'][0]['attributes']
+    lib.location_api.CACHE.set('ma', ingest_location(attributes), notify=False)
+    locations = {}
+    for i in range(count):
+        code = f'ma{i:02}'
+        data = get_location_data(code, ['location', 'hours'])
+        locations[code] = [{'code': code, 'label': f'Schwarzman Building - Room {i}',
+                            'url': 'https://www.nypl.org/locations/schwarzman', **data}]
+    return locations
+
+
+def main():
+    body = synthetic_response()
+    runs = 200
+    try:
+        import orjson  # noqa: F401
+        encoder = 'orjson'
+    except ImportError:
+        encoder = 'json, compact'
+
+    def response(serialized):
+        return {'statusCode': 200, 'body': serialized, 'isBase64Encoded': False,
+                'headers': {'Content-type': 'application/json'}}
+
+    cases = [('json.dumps default', lambda: json.dumps(body), None),
+             (encoder, lambda: dumps(body), None),
+             (f'{encoder} + gzip', lambda: dumps(body), 'gzip')]
+    if brotli_module() is not None:
+        cases.append((f'{encoder} + br', lambda: dumps(body), 'br'))
+    print(f'{len(body)} codes per response')
+    for (name, serialize, encoding) in cases:
+        payload = encode_response(response(serialize()), encoding)['body']
+        seconds = timeit.timeit(lambda: encode_response(response(serialize()), encoding), number=runs)
+        print(f'{name:>20}: {len(payload):8d} bytes, {seconds / runs * 1000:7.3f} ms/response')
+
+
+if __name__ == '__main__':
+    lib.location_api.logger.disabled = True
+    main()
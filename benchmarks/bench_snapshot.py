@@ -0,0 +1,68 @@
+# Measures the nypl-core part of a cold start: fetching and parsing
+# by_sierra_location.json from a mocked upstream with a simulated round
+# trip versus loading the /tmp snapshot written by an earlier container.
+#
+#   python -m benchmarks.bench_snapshot
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests_mock
+
+import lib.nypl_core
+from lib.snapshot import write_snapshot
+
+
+def synthetic_nypl_core(size=2500):
+    return {f'loc{i:04}': {
+        'code': f'loc{i:04}',
+        'label': f'Location {i}',
+        'locationsApiSlug': f'location-{i}',
+        'collectionTypes': ['Research', 'Branch'],
+        'deliveryLocationTypes': ['Research'],
+        'recapLocation': {'code': 'rc2ma', 'label': 'Offsite'},
+        'sierraDeliveryLocations': [{'code': 'mal', 'label': 'SASB'}] * 3
+    } for i in range(size)}
+
+
+LATENCY = 0.15
+
+
+def cold_start():
+    lib.nypl_core.CACHE.clear()
+    start = time.perf_counter()
+    lib.nypl_core.sierra_location_by_code('loc0001')
+    elapsed = time.perf_counter() - start
+    # let any background revalidation finish before the next run
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join()
+    return elapsed
+
+
+def main():
+    payload = synthetic_nypl_core()
+    body = json.dumps(payload)
+    os.environ['NYPL_CORE_OBJECTS_BASE_URL'] = 'https://example.com/'
+    runs = 10
+    with requests_mock.Mocker() as mock, tempfile.TemporaryDirectory() as snapshot_dir:
+        def respond(request, context):
+            time.sleep(LATENCY)
+            return body
+        mock.get('https://example.com/by_sierra_location.json', text=respond)
+        network = sum(cold_start() for _ in range(runs)) / runs
+
+        os.environ['SNAPSHOT_DIR'] = snapshot_dir
+        write_snapshot(lib.nypl_core.snapshot_name('by_sierra_location.json'), payload)
+        snapshot = sum(cold_start() for _ in range(runs)) / runs
+        del os.environ['SNAPSHOT_DIR']
+
+    print(f'nypl-core payload: {len(body) / 1024:.0f} KiB, {len(payload)} locations')
+    print(f'fetch + parse:  {network * 1000:8.3f} ms ({LATENCY * 1000:.0f} ms simulated round trip)')
+    print(f'snapshot load:  {snapshot * 1000:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Compares peak RSS when building the nypl-core label table from a 10x
+# sized synthetic by_sierra_location.json, either by parsing the whole
+# body at once (the old response.json() path) or by streaming it through
+# lib.json_stream. Each mode runs in its own process so ru_maxrss is not
+# shared between them.
+#
+#   python -m benchmarks.bench_streaming_parse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_snapshot import synthetic_nypl_core
+from lib.json_stream import iter_object_items
+from lib.nypl_core import STREAM_CHUNK_SIZE, reduce_nypl_core_objects
+
+
+def peak_rss_kib():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(mode, path):
+    baseline = peak_rss_kib()
+    start = time.perf_counter()
+    with open(path, 'rb') as body:
+        if mode == 'whole':
+            labels = reduce_nypl_core_objects(
+                'by_sierra_location.json', json.loads(body.read().decode()).items())
+        else:
+            chunks = iter(lambda: body.read(STREAM_CHUNK_SIZE), b'')
+            labels = reduce_nypl_core_objects('by_sierra_location.json', iter_object_items(chunks))
+    elapsed = time.perf_counter() - start
+    print(f'{mode:>9}: {len(labels)} labels, peak RSS +{(peak_rss_kib() - baseline) / 1024:6.1f} MiB, '
+          f'{elapsed * 1000:7.1f} ms')
+
+
+def main():
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as payload:
+        json.dump(synthetic_nypl_core(size=25000), payload)
+    try:
+        print(f'payload: {os.path.getsize(payload.name) / 1024 / 1024:.1f} MiB')
+        for mode in ['whole', 'streaming']:
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_streaming_parse', mode, payload.name],
+                           check=True)
+    finally:
+        os.unlink(payload.name)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        run(sys.argv[1], sys.argv[2])
+    else:
+        main()
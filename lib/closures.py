@@ -0,0 +1,123 @@
+import bisect
+import datetime
+import itertools
+
+from typing import NamedTuple
+
+from lib.schedule import INTEGER_DAYS
+
+
+class Closure(NamedTuple):
+    # timezone aware; a closure covers start up to but excluding end
+    start: datetime.datetime
+    end: datetime.datetime
+
+
+class ClosureIndex:
+    """
+    Closures sorted by start time, without duplicates or empty intervals,
+    for bisect lookup of the closures overlapping a window. max_ends[i] is
+    the latest end among closures[:i + 1]. It never decreases, so the
+    closures that all ended before a window can be skipped by bisecting it.
+
+    `merged` holds the same closures with overlapping and adjacent ones
+    merged, computed once when the feed is refreshed, for apply_closures.
+    """
+
+    def __init__(self, closures):
+        self.closures = sorted({closure for closure in closures if closure.end > closure.start})
+        self.starts = [closure.start for closure in self.closures]
+        self.max_ends = list(itertools.accumulate((closure.end for closure in self.closures), max))
+        self.merged = merge_closures(self.closures)
+        self.merged_ends = [closure.end for closure in self.merged]
+
+    def between(self, start, end):
+        # closures starting before the window ends...
+        stop = bisect.bisect_left(self.starts, end)
+        # ...less the leading ones that had all ended when it started
+        first = bisect.bisect_right(self.max_ends, start, 0, stop)
+        return [closure for closure in self.closures[first:stop] if closure.end > start]
+
+    def __len__(self):
+        return len(self.closures)
+
+
+def merge_closures(closures):
+    """
+    Merge closures sorted by start into the fewest non-overlapping ones,
+    still sorted by start, in one pass.
+    """
+    merged = []
+    for closure in closures:
+        if merged and closure.start <= merged[-1].end:
+            if closure.end > merged[-1].end:
+                merged[-1] = Closure(merged[-1].start, closure.end)
+        else:
+            merged.append(closure)
+    return merged
+
+
+def apply_closures(hours, index: ClosureIndex, current_date: datetime.datetime):
+    """
+    Apply closures to a week of hours from schedule_week, in place, and
+    return them. A day whose opening hours a closure covers entirely is
+    closed. A closure covering the opening time delays it, and one starting
+    after opening, whether it runs past closing or not, closes the day at
+    its start. nextBusinessDay then moves to the first day after
+    current_date that is still open.
+
+    The days are walked in time order alongside the merged closures, so
+    this is linear in the days plus the closures overlapping them.
+    """
+    days = sorted(
+        ((datetime.datetime.fromisoformat(day['startTime']), datetime.datetime.fromisoformat(day['endTime']), day)
+         for day in hours if day.get('startTime') is not None),
+        key=lambda open_day: open_day[0])
+    closures = index.merged
+    position = bisect.bisect_right(index.merged_ends, days[0][0]) if days else 0
+    for (opens, closes, day) in days:
+        # closures are disjoint, so one that ended by this opening is done
+        while position < len(closures) and closures[position].end <= opens:
+            position += 1
+        following = position
+        while following < len(closures) and closures[following].start < closes:
+            closure = closures[following]
+            if closure.start <= opens:
+                opens = closure.end.astimezone(opens.tzinfo)
+            else:
+                closes = closure.start.astimezone(closes.tzinfo)
+                break
+            following += 1
+        if opens >= closes:
+            day['startTime'] = None
+            day['endTime'] = None
+        else:
+            day['startTime'] = opens.isoformat()
+            day['endTime'] = closes.isoformat()
+
+    next_business_day = None
+    current_weekday = current_date.weekday()
+    for day in hours:
+        day.pop('nextBusinessDay', None)
+        offset = (INTEGER_DAYS[day['day'].upper()] - current_weekday) % 7
+        if offset > 0 and day['startTime'] is not None and \
+                (next_business_day is None or offset < next_business_day[0]):
+            next_business_day = (offset, day)
+    if next_business_day is not None:
+        next_business_day[1]['nextBusinessDay'] = True
+    return hours
+
+
+def local_midnight(date: datetime.date):
+    return datetime.datetime(date.year, date.month, date.day).astimezone()
+
+
+def closure_from_applies(item):
+    # a closure in the {"applies": {"start": ..., "end": ...}} form Refinery used
+    applies = item['applies']
+    return Closure(datetime.datetime.fromisoformat(applies['start']),
+                   datetime.datetime.fromisoformat(applies['end']))
+
+
+def closure_applies(closure: Closure):
+    return {'applies': {'start': closure.start.isoformat(), 'end': closure.end.isoformat()}}
@@ -0,0 +1,64 @@
+import threading
+import time
+
+
+class FailureBackoff:
+    """
+    Remembers the last error of each key for `seconds`. Until it expires,
+    check() and call() raise that error again without calling upstream, so
+    an outage costs one upstream call per key however many requests, or
+    codes of one request, need it.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def _recent_failure(self, key):
+        with self._lock:
+            failure = self._failures.get(key)
+        if failure is not None and time.time() - failure[0] < self.seconds:
+            return failure[1]
+        return None
+
+    def check(self, key):
+        """Raise the error key failed with, if it failed within the backoff"""
+        error = self._recent_failure(key)
+        if error is not None:
+            raise error.with_traceback(None)
+
+    def record(self, keys, error):
+        """Remember error for every key, and return it to be raised"""
+        failed_at = time.time()
+        with self._lock:
+            for key in keys:
+                self._failures[key] = (failed_at, error)
+        return error
+
+    def forget(self, keys):
+        with self._lock:
+            for key in keys:
+                self._failures.pop(key, None)
+
+    def call(self, key, loader):
+        """Return loader(key), recording its error or forgetting the last one"""
+        self.check(key)
+        try:
+            value = loader(key)
+        except Exception as e:
+            self.record([key], e)
+            raise
+        self.forget([key])
+        return value
+
+    def in_backoff(self, key):
+        return self._recent_failure(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._failures.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._failures
@@ -0,0 +1,121 @@
+import os
+import random
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+import lib.metrics
+from lib.logger import GlobalLogger
+
+
+GlobalLogger.initialize_logger(__name__)
+logger = GlobalLogger.logger
+
+# (connect, read) timeouts in seconds per upstream, overridable with e.g.
+# DRUPAL_TIMEOUT=2,4. Retries are bounded by REQUEST_DEADLINE below.
+UPSTREAM_TIMEOUTS = {
+    'drupal': (3.05, 5),
+    'nypl_core': (3.05, 5),
+    'rc_alerts': (3.05, 3)
+}
+DEFAULT_TIMEOUT = (3.05, 5)
+
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.1
+# seconds one get may spend across all its attempts, so retries never push
+# an invocation past the 10s Lambda timeout. A retry is only made when at
+# least MIN_ATTEMPT_TIME is left after its backoff.
+REQUEST_DEADLINE = 6
+MIN_ATTEMPT_TIME = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+POOL_SIZE = 10
+
+# one keep-alive session per host, shared by every thread in the container
+SESSIONS = {}
+_LOCK = threading.Lock()
+
+# requests is only imported once an upstream is actually called, keeping it
+# off the cold start of invocations that never leave the container. Its
+# exceptions are available as attributes of this module, e.g.
+# lib.http_client.RequestException, for use in except clauses.
+LAZY_EXCEPTIONS = ['ConnectionError', 'JSONDecodeError', 'ReadTimeout', 'RequestException', 'Timeout']
+
+
+def __getattr__(name):
+    if name in LAZY_EXCEPTIONS:
+        import requests.exceptions
+        return getattr(requests.exceptions, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def session_for(url):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    host = urlsplit(url).netloc
+    with _LOCK:
+        session = SESSIONS.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            SESSIONS[host] = session
+        return session
+
+
+def upstream_timeout(upstream):
+    configured = os.environ.get(f'{upstream.upper()}_TIMEOUT')
+    if configured:
+        (connect, read) = configured.split(',')
+        return (float(connect), float(read))
+    return UPSTREAM_TIMEOUTS.get(upstream, DEFAULT_TIMEOUT)
+
+
+def get(url, upstream, params=None, stream=False):
+    """
+    GET url through the pooled session for its host. Connection errors,
+    connect timeouts and retryable statuses are retried up to MAX_RETRIES
+    times with full-jitter exponential backoff, within REQUEST_DEADLINE
+    seconds overall; each attempt's latency is recorded in the
+    `http.{upstream}` histogram. Read timeouts are not retried: the
+    upstream is up but slow, and another attempt would only wait as long
+    again. With stream=True the body is left unread for the caller to
+    iterate.
+    """
+    session = session_for(url)
+    timeout = upstream_timeout(upstream)
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    for attempt in range(MAX_RETRIES + 1):
+        # no attempt may outlast the deadline
+        remaining = max(deadline - time.monotonic(), MIN_ATTEMPT_TIME)
+        attempt_timeout = tuple(min(seconds, remaining) for seconds in timeout)
+        backoff = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+        start = time.perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=attempt_timeout, stream=stream)
+        except __getattr__('ReadTimeout'):
+            lib.metrics.record_latency(f'http.{upstream}', time.perf_counter() - start)
+            lib.metrics.increment(f'http.{upstream}.errors')
+            raise
+        except (__getattr__('ConnectionError'), __getattr__('Timeout')) as e:
+            lib.metrics.record_latency(f'http.{upstream}', time.perf_counter() - start)
+            lib.metrics.increment(f'http.{upstream}.errors')
+            if attempt == MAX_RETRIES or not time_for_retry(deadline, backoff):
+                raise
+            logger.warning(f'Retrying {upstream} request after {type(e).__name__}')
+        else:
+            lib.metrics.record_latency(f'http.{upstream}', time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES or \
+                    not time_for_retry(deadline, backoff):
+                return response
+            lib.metrics.increment(f'http.{upstream}.errors')
+            logger.warning(f'Retrying {upstream} request after {response.status_code} response')
+        lib.metrics.increment(f'http.{upstream}.retries')
+        time.sleep(backoff)
+
+
+def time_for_retry(deadline, backoff):
+    return deadline - time.monotonic() - backoff >= MIN_ATTEMPT_TIME
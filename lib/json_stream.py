@@ -0,0 +1,107 @@
+import codecs
+import json
+import re
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# characters that can continue a number, e.g. 1 -> 1.5 -> 1.5e3
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+def iter_object_items(chunks):
+    """
+    Incrementally parse a JSON document whose top level is an object,
+    yielding its (key, value) pairs as they are read from chunks, an
+    iterable of bytes (UTF-8) or str. Only the pair being parsed and the
+    unread part of the current chunk are held in memory, never the whole
+    document. Raises ValueError if the document is not a valid JSON object,
+    including when anything but whitespace follows it.
+    """
+    reader = _ChunkReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+        reader.expect_end()
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError('Expected an object key', reader.buffer, reader.pos)
+        reader.expect(':')
+        yield (key, reader.value())
+        char = reader.next_char()
+        if char == '}':
+            reader.expect_end()
+            return
+        if char != ',':
+            raise json.JSONDecodeError("Expected ',' or '}'", reader.buffer, reader.pos - 1)
+
+
+class _ChunkReader:
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def read(self):
+        # append the next chunk, dropping everything already consumed
+        if self.exhausted:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            text = self.decoder.decode(b'', final=True)
+        elif isinstance(chunk, str):
+            text = chunk
+        else:
+            text = self.decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.read():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.buffer):
+            raise json.JSONDecodeError('Unexpected end of document', self.buffer, self.pos)
+        return self.buffer[self.pos]
+
+    def next_char(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, expected):
+        if self.next_char() != expected:
+            raise json.JSONDecodeError(f"Expected '{expected}'", self.buffer, self.pos - 1)
+
+    def expect_end(self):
+        self.skip_whitespace()
+        if self.pos < len(self.buffer):
+            raise json.JSONDecodeError('Extra data', self.buffer, self.pos)
+
+    def value(self):
+        self.skip_whitespace()
+        while True:
+            try:
+                (value, end) = _DECODER.raw_decode(self.buffer, self.pos)
+                # a number may be cut off mid-chunk, e.g. 1. of 1.5 or 12e
+                # of 12e3, so it is only accepted once a character that
+                # cannot continue it follows, or nothing is left to read
+                if self.exhausted or (end < len(self.buffer) and not (
+                        self.buffer[end] in _NUMBER_CHARS and self.buffer[self.pos] in _NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self.read()
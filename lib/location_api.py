@@ -1,48 +1,214 @@
-import requests
 import os
 import datetime
+import time
 
-from dateutil.parser import parse
-from functools import cache
-from requests.exceptions import JSONDecodeError, RequestException
+from concurrent.futures import ThreadPoolExecutor
 
+import lib.http_client
+import lib.metrics
 from lib.logger import GlobalLogger
 from lib.errors import RefineryApiError
+from lib.failure_backoff import FailureBackoff
+from lib.shared_cache import SharedCache
+from lib.schedule import ScheduleError, compile_schedule, schedule_week
+from lib.single_flight import SingleFlight
+from lib.snapshot import persist_cache, restore_cache
+from lib.ttl_cache import TTLCache
 
 
 GlobalLogger.initialize_logger(__name__)
 logger = GlobalLogger.logger
 
-INTEGER_DAYS = {
-    "MONDAY": 0,
-    "TUESDAY": 1,
-    "WEDNESDAY": 2,
-    "THURSDAY": 3,
-    "FRIDAY": 4,
-    "SATURDAY": 5,
-    "SUNDAY": 6
-}
+DEFAULT_DRUPAL_MAX_CONCURRENCY = 8
+# JSON:API pages hold at most 50 nodes, so larger batches are split
+DEFAULT_DRUPAL_BATCH_SIZE = 50
+DEFAULT_DRUPAL_PRELOAD_INTERVAL = 3600
+# Drupal data is refreshed an hour after it was fetched, and served stale
+# for up to a day when Drupal cannot be reached
+DRUPAL_CACHE_TTL = 3600
+DRUPAL_CACHE_STALE_TTL = 86400
+DRUPAL_CACHE_MAXSIZE = 512
+# codes whose Drupal request failed are not requested again for this long
+DRUPAL_FAILURE_BACKOFF = 30
+
+# sparse fieldset: the only node attributes this service reads
+DRUPAL_FIELDS = 'field_ts_location_code,field_as_address,location_hours,changed'
+
+# the last failed Drupal request by code, for single and batched queries
+FAILURES = FailureBackoff(DRUPAL_FAILURE_BACKOFF)
+# ingested Drupal locations by location code. None is stored for codes
+# Drupal has no node for so they are not requested again until they expire.
+# With SHARED_CACHE_BACKEND set, other containers' fetches are used as well.
+CACHE = TTLCache('drupal', DRUPAL_CACHE_TTL, maxsize=DRUPAL_CACHE_MAXSIZE,
+                 stale_ttl=DRUPAL_CACHE_STALE_TTL,
+                 on_update=lambda cache: persist_cache('drupal', cache),
+                 shared=SharedCache('drupal', DRUPAL_CACHE_TTL),
+                 backoff=FAILURES)
+# coalesces concurrent batch queries and catalog preloads
+FLIGHTS = SingleFlight()
+# when DRUPAL_PRELOAD is enabled CACHE holds the whole library catalog,
+# loaded at this time.time()
+PRELOAD = {'loaded_at': None}
+# a failed catalog refresh is not attempted again within the backoff, while
+# the previous catalog keeps serving lookups
+PRELOAD_FAILURES = FailureBackoff(DRUPAL_FAILURE_BACKOFF)
 
 
-@cache
 def get_location_by_code(code):
+    restore_cache('drupal', CACHE)
+    return CACHE.get(code, fetch_location_by_code)
+
+
+def fetch_location_by_code(code):
     try:
-        response = requests.get(
+        response = lib.http_client.get(
             f"{os.environ['DRUPAL_API_BASE_URL']}?filter[field_ts_location_code]={code}"
+            f"&fields[node--library]={DRUPAL_FIELDS}",
+            'drupal'
         )
         response.raise_for_status()
         response = response.json()
-        if not response.get('data') or not isinstance(response.get('data'), list):
-            return None
-        return response.get('data')[0].get('attributes', None)
-    except RequestException as e:
+    except lib.http_client.RequestException as e:
         raise RefineryApiError(
             f'Failed to retrieve Drupal API location data \
             for {code}: {e}')
-    except (JSONDecodeError, KeyError) as e:
+    except (lib.http_client.JSONDecodeError, KeyError) as e:
+        raise RefineryApiError(
+            f'Failed to parse Drupal API response: \
+                {type(e)} {e}')
+    if not response.get('data') or not isinstance(response.get('data'), list):
+        return None
+    return ingest_location(response.get('data')[0].get('attributes', None))
+
+
+# fetch the nodes for several location codes with a single JSON:API `IN`
+# query and store each of them in the per-code cache
+def get_locations_by_codes(codes):
+    params = {
+        'filter[code][condition][path]': 'field_ts_location_code',
+        'filter[code][condition][operator]': 'IN',
+        'filter[code][condition][value][]': codes,
+        'fields[node--library]': DRUPAL_FIELDS,
+        'page[limit]': len(codes)
+    }
+    try:
+        response = lib.http_client.get(os.environ['DRUPAL_API_BASE_URL'], 'drupal', params=params)
+        response.raise_for_status()
+        nodes = response.json().get('data') or []
+    except lib.http_client.RequestException as e:
+        raise FAILURES.record(codes, RefineryApiError(
+            f'Failed to retrieve Drupal API location data \
+            for {codes}: {e}'))
+    except (lib.http_client.JSONDecodeError, KeyError) as e:
+        raise FAILURES.record(codes, RefineryApiError(
+            f'Failed to parse Drupal API response: \
+                {type(e)} {e}'))
+    FAILURES.forget(codes)
+    locations = dict.fromkeys(codes)
+    for node in nodes:
+        attributes = node.get('attributes') or {}
+        code = attributes.get('field_ts_location_code')
+        # keep the first node per code, as get_location_by_code does
+        if code in locations and locations[code] is None:
+            locations[code] = ingest_location(attributes)
+    CACHE.update(locations, share=True)
+    return locations
+
+
+# keep only what the service reads from a Drupal node and compile its hours
+# into a WeeklySchedule, so hours that cannot be parsed are reported once
+# here instead of failing every request for the location
+def ingest_location(attributes):
+    if attributes is None:
+        return None
+    location = {
+        'field_ts_location_code': attributes.get('field_ts_location_code'),
+        'changed': attributes.get('changed'),
+        'field_as_address': attributes.get('field_as_address') or {}
+    }
+    try:
+        location['schedule'] = compile_schedule(attributes.get('location_hours') or {})
+    except ScheduleError as e:
+        logger.error(f"Ignoring hours for location {location['field_ts_location_code']}: {e.message}")
+        location['schedule'] = None
+    return location
+
+
+def preload_enabled():
+    return os.environ.get('DRUPAL_PRELOAD', 'false').lower() == 'true'
+
+
+# page through the whole /jsonapi/node/library collection and replace the
+# cache with every node, indexed by location code
+def preload_locations():
+    start = time.time()
+    url = os.environ['DRUPAL_API_BASE_URL']
+    params = {
+        'fields[node--library]': DRUPAL_FIELDS,
+        'page[limit]': DEFAULT_DRUPAL_BATCH_SIZE
+    }
+    catalog = {}
+    pages = 0
+    try:
+        while url:
+            response = lib.http_client.get(url, 'drupal', params=params)
+            response.raise_for_status()
+            response = response.json()
+            for node in response.get('data') or []:
+                attributes = node.get('attributes') or {}
+                code = attributes.get('field_ts_location_code')
+                if code not in catalog:
+                    catalog[code] = ingest_location(attributes)
+            pages += 1
+            # the next link already carries the query parameters
+            params = None
+            url = ((response.get('links') or {}).get('next') or {}).get('href')
+    except lib.http_client.RequestException as e:
+        raise RefineryApiError(
+            f'Failed to preload Drupal API library catalog: {e}')
+    except (lib.http_client.JSONDecodeError, KeyError, AttributeError) as e:
         raise RefineryApiError(
             f'Failed to parse Drupal API response: \
                 {type(e)} {e}')
+    catalog.pop(None, None)
+    PRELOAD['loaded_at'] = time.time()
+    CACHE.clear()
+    CACHE.update(catalog, fetched_at=PRELOAD['loaded_at'], share=True)
+    duration = PRELOAD['loaded_at'] - start
+    lib.metrics.record_timing('drupal.preload', duration)
+    logger.info('Preloaded %d Drupal locations from %d pages in %.3fs', len(catalog), pages, duration)
+    return catalog
+
+
+# returns True when lookups should be served from the preloaded catalog,
+# (re)loading it first if it is missing or older than the refresh interval
+def check_preload():
+    if not preload_enabled():
+        return False
+    if preload_expired():
+        try:
+            PRELOAD_FAILURES.call('catalog', lambda key: FLIGHTS.do('preload', refresh_preload))
+        except RefineryApiError:
+            # keep serving the previous catalog until a refresh succeeds
+            if PRELOAD['loaded_at'] is None:
+                raise
+    return True
+
+
+def preload_expired():
+    interval = int(os.environ.get('DRUPAL_PRELOAD_INTERVAL', DEFAULT_DRUPAL_PRELOAD_INTERVAL))
+    loaded_at = PRELOAD['loaded_at']
+    return loaded_at is None or time.time() - loaded_at > interval
+
+
+def refresh_preload():
+    # a caller that just missed the previous flight finds the catalog fresh
+    if preload_expired():
+        try:
+            preload_locations()
+        except RefineryApiError as e:
+            logger.error('Failed to refresh Drupal catalog: %s', e.message)
+            raise
 
 
 def parse_address(address_data):
@@ -54,63 +220,81 @@ def parse_address(address_data):
     }
 
 
-def datetime_from_hours_string(base_date: datetime, hours_string: str):
-    # given a base date, turn a string like 10 AM into a datetime
-    hour_and_time_of_day = hours_string.split(' ')
-    hour_and_minute = hour_and_time_of_day[0].split(':')
-    hour = int(hour_and_minute[0])
-    minute = 0
-    if len(hour_and_minute) > 1:
-        minute = int(hour_and_minute[1])
-    time_of_day = hour_and_time_of_day[1]
-    if time_of_day.lower() == 'pm' and hour != 12:
-        hour += 12
-    if time_of_day.lower() == 'am' and hour == 12:
-        hour = 0
-    return base_date.replace(hour=hour, minute=minute).isoformat()
-
-
-def parse_hours(current_date: datetime, date):
-    # parse hours in the form
-    # {
-    #  "day": "Tuesday",
-    #  "date": "8/26",
-    #  "hours": "10 AM–8 PM"
-    # },
-    # to the expected return format
-    # {
-    #   "day": "Tuesday",
-    #   "startTime": "2025-08-26T10:00:00+00:00",
-    #   "endTime": "2025-08-26T20:00:00+00:00",
-    #   "today": true
-    # },
-
-    # get a datetime for this weekday based off today's weekday
-    weekday = date.get('day')
-    current_weekday = current_date.weekday()
-    weekday_index = INTEGER_DAYS.get(weekday.upper())
-    if weekday_index >= current_weekday:
-        weekday_offset = weekday_index - current_date.weekday()
-    else:
-        weekday_offset = 7 - current_weekday + weekday_index
-
-    base_date = current_date + datetime.timedelta(days=weekday_offset)
-
-    hours = {
-        'day': weekday
-    }
+def parent_location_code(code):
+    # some codes require a parent location to fetch hours and address data, e.g. anything starting with 'ma' is SASB
+    if code.startswith('ma') or code == 'rc':
+        return 'ma'
+    elif code.startswith('sc'):
+        return 'sc'
+    elif code.startswith('pa'):
+        return 'lpa'
+    return code
+
+
+# warm the Drupal cache for every distinct parent location of the given
+# codes that is not cached yet. The codes are fetched in batched queries,
+# and the batches run concurrently so a multi-code request waits on the
+# slowest single call rather than the sum of all of them.
+def prefetch_location_data(codes):
+    if check_preload():
+        return
+    restore_cache('drupal', CACHE)
+    # codes that failed recently are left to fail fast in get_location_data
+    parent_codes = [code for code in dict.fromkeys(parent_location_code(code) for code in codes)
+                    if code not in CACHE and not FAILURES.in_backoff(code)]
+    # codes another container fetched recently are read from the shared tier
+    parent_codes = CACHE.load_shared(parent_codes)
+    leased = CACHE.shared.acquire_many(parent_codes)
+    try:
+        if leased:
+            fetch_in_batches(leased)
+    finally:
+        CACHE.shared.release_many(leased)
+    # those it is fetching right now are waited for together, once, and
+    # whatever it has not stored by then is fetched here in one go
+    waiting = [code for code in parent_codes if code not in leased]
+    if waiting:
+        remaining = CACHE.wait_shared(waiting)
+        if remaining:
+            fetch_in_batches(remaining)
+
+
+# query Drupal for codes in parallel batches of up to DRUPAL_BATCH_SIZE and
+# return the errors of the batches that failed
+def fetch_in_batches(parent_codes):
+    batch_size = int(os.environ.get('DRUPAL_BATCH_SIZE', DEFAULT_DRUPAL_BATCH_SIZE))
+    batches = [parent_codes[i:i + batch_size] for i in range(0, len(parent_codes), batch_size)]
+    max_workers = min(
+        int(os.environ.get('DRUPAL_MAX_CONCURRENCY', DEFAULT_DRUPAL_MAX_CONCURRENCY)),
+        len(batches))
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        return [error for error in executor.map(prefetch_batch, batches) if error is not None]
+
+
+# a failed batch is logged and returned rather than raised: its codes are
+# recorded in FAILURES and reported one by one when their data is read
+def prefetch_batch(batch):
+    try:
+        FLIGHTS.do(('batch',) + tuple(batch), get_locations_by_codes, batch)
+    except RefineryApiError as e:
+        logger.error(f'Failed to prefetch Drupal locations {batch}: {e.message}')
+        return e
+
 
-    # get start and close times from the "10 AM-8 PM" hours string
-    if date.get('hours').lower() == 'closed':
-        hours['startTime'] = None
-        hours['endTime'] = None
-    else:
-        start_and_end = date.get('hours').split('–')
-        hours['startTime'] = datetime_from_hours_string(base_date, start_and_end[0])
-        hours['endTime'] = datetime_from_hours_string(base_date, start_and_end[1])
-    if weekday_offset == 0:
-        hours['today'] = True
-    return hours
+# fetch the Drupal data of every cached location again, whatever its age,
+# or the whole library catalog when nothing is cached yet. Returns the
+# number of locations refreshed.
+def refresh_locations():
+    if preload_enabled():
+        return len(FLIGHTS.do('preload', preload_locations))
+    restore_cache('drupal', CACHE)
+    codes = list(CACHE)
+    if not codes:
+        return len(preload_locations())
+    errors = fetch_in_batches(codes)
+    if errors:
+        raise errors[0]
+    return len(codes)
 
 
 # given an array of fields and a location
@@ -119,55 +303,66 @@ def parse_hours(current_date: datetime, date):
 def get_location_data(code, fields):
     data = {}
 
-    # some codes require a parent location to fetch hours and address data, e.g. anything starting with 'ma' is SASB
-    location_code = code
-    if code.startswith('ma') or code == 'rc':
-        location_code = 'ma'
-    elif code.startswith('sc'):
-        location_code = 'sc'
-    elif code.startswith('pa'):
-        location_code = 'lpa'
-    logger.info(f'Getting {fields} data for location {location_code} for location code {code}')
+    location_code = parent_location_code(code)
+    logger.info('Getting %s data for location %s for location code %s', fields, location_code, code)
 
-    location_data = check_cache_and_or_fetch_data(location_code)
+    with lib.metrics.span('drupal'):
+        location_data = check_cache_and_or_fetch_data(location_code)
     if location_data is None:
         return None
     if 'location' in fields:
-        data['location'] = parse_address(location_data.get('field_as_address', {}))
+        data['location'] = parse_address(location_data.get('field_as_address') or {})
     if 'hours' in fields:
-        location_hours = location_data.get('location_hours')
-        # If upcoming_hours exists, use that, otherwise use regular_hours
-        upcoming_hours = (
-                location_hours.get('upcoming_hours')
-                if location_hours.get('upcoming_hours')
-                else location_hours.get('regular_hours')
-        )
-        data['hours'] = []
-        current_date = datetime.datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_index = 0
-        for index in range(len(upcoming_hours)):
-            date = upcoming_hours[index]
-            parsed_hours = parse_hours(current_date, date)
-            data['hours'].append(parsed_hours)
-            if parsed_hours.get('today'):
-                today_index = index
-        # determine the next business day
-        for offset in range(1, 7):
-            relative_offset = (today_index + offset) % 7
-            if data['hours'][relative_offset].get('startTime'):
-                data['hours'][relative_offset]['nextBusinessDay'] = True
-                break
+        with lib.metrics.span('hours'):
+            data['hours'] = get_location_hours(location_code, location_data)
 
     return data
 
 
+# computed hours by (parent location code, Drupal changed timestamp), for
+# the local date in HOURS_CACHE['date'] only
+HOURS_CACHE = {'date': None, 'hours': {}}
+
+
+# return the hours for a parent location, computing them at most once per
+# local day and Drupal revision. Every code sharing that parent, in this
+# request or later warm invocations, gets its own copy of the result.
+def get_location_hours(location_code, location_data):
+    current_date = datetime.datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
+    if HOURS_CACHE['date'] != current_date:
+        # the date rolled over, so every computed week is out of date
+        HOURS_CACHE['hours'] = {}
+        HOURS_CACHE['date'] = current_date
+    key = (location_code, location_data.get('changed'))
+    hours = HOURS_CACHE['hours'].get(key)
+    if hours is None:
+        if location_data.get('schedule') is None:
+            return None
+        hours = schedule_week(location_data.get('schedule'), current_date)
+        HOURS_CACHE['hours'][key] = hours
+    return [dict(day) for day in hours]
+
+
+# time.time() at which the Drupal data cached for these codes is next
+# refreshed, or 0 when some of it is not cached at all
+def drupal_expires_at(codes):
+    if preload_enabled():
+        interval = int(os.environ.get('DRUPAL_PRELOAD_INTERVAL', DEFAULT_DRUPAL_PRELOAD_INTERVAL))
+        return 0 if PRELOAD['loaded_at'] is None else PRELOAD['loaded_at'] + interval
+    fetched = [CACHE.fetched_at(parent_location_code(code)) for code in codes]
+    if not fetched or None in fetched:
+        return 0
+    return min(fetched) + DRUPAL_CACHE_TTL
+
+
+# computed hours start from today, so they go out of date at local midnight
+def hours_expires_at():
+    today = datetime.datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today + datetime.timedelta(days=1)).timestamp()
+
+
 def check_cache_and_or_fetch_data(code):
-    location_data = get_location_by_code(code)
-    if not location_data:
-        return None
-    delta = datetime.datetime.now(tz=datetime.timezone.utc) - parse(location_data.get('changed'))
-    if delta.seconds > 3600:
-        get_location_by_code.cache_clear()
-        logger.info('Refreshing Drupal API data for location: ' + code)
-        location_data = get_location_by_code(code)
-    return location_data
+    if check_preload():
+        # the catalog holds every library node, so a missing code has none
+        return CACHE.peek(code)
+    return get_location_by_code(code)
@@ -1,71 +1,243 @@
-import re
 import os
+import datetime
 import time
 
 from functools import cache
-from nypl_py_utils.classes.s3_client import S3Client
 
+import lib.metrics
 import lib.nypl_core
+import lib.rc_alerts
+from lib.closures import apply_closures, local_midnight
 from lib.logger import GlobalLogger
-from lib.errors import MissingEnvVar
-from lib.location_api import get_location_data
+from lib.errors import MissingEnvVar, ParamError
+from lib.failure_backoff import FailureBackoff
+from lib.json_stream import iter_object_items
+from lib.prefix_index import PrefixIndex
+from lib.rc_alerts import RCAlerts, is_recap_code
+from lib.shared_cache import SharedCache
+from lib.snapshot import persist_cache, restore_cache
+from lib.location_api import (drupal_expires_at, get_location_data,
+                              hours_expires_at, prefetch_location_data)
+from lib.ttl_cache import TTLCache
+
+
+# the upstream sources each requested field needs. Every result has a label,
+# from nypl-core, which is always consulted, and a code, which needs the S3
+# mapping, so every field needs S3. A label-only request still skips Drupal.
+FIELD_SOURCES = {
+    'label': {'s3'},
+    'url': {'s3'},
+    'location': {'s3', 'drupal'},
+    'hours': {'s3', 'drupal'},
+    # only read for rc and the other ReCAP codes, whose hours the ReCAP
+    # closures also apply to
+    'closures': {'s3', 'rc_alerts'},
+    # documented in place of location before it existed, and never returned
+    # anything of its own. Still accepted so those clients keep working.
+    'address': {'s3'}
+}
+
+S3_CACHE_TTL = 3600
+# nypl-core files never expire, but no response is cached for longer
+MAX_RESPONSE_AGE = 86400
+# if S3 cannot be reached the previous mapping keeps being served
+S3_CACHE_STALE_TTL = 86400
+
+S3_FAILURE_BACKOFF = 30
+S3_FAILURES = FailureBackoff(S3_FAILURE_BACKOFF)
+
+# holds a single 'locations' entry: the parsed mapping and its S3 ETag
+S3_CACHE = TTLCache('s3', S3_CACHE_TTL, maxsize=1, stale_ttl=S3_CACHE_STALE_TTL,
+                    on_update=lambda cache: persist_cache('s3', cache),
+                    shared=SharedCache('s3', S3_CACHE_TTL), backoff=S3_FAILURES)
 
 
 @cache
-def fetch_s3():
+def s3_client():
+    # boto3 is only imported once S3 is actually needed
+    from nypl_py_utils.classes.s3_client import S3Client
+    return S3Client(os.environ.get('S3_BUCKET'), os.environ.get('S3_LOCATIONS_FILE')).s3_client
+
+
+# conditionally fetch the S3 locations mapping. When the object's ETag
+# matches the cached copy S3 answers 304 without a body, and the cached
+# entry is returned as is so nothing is transferred or re-parsed.
+def fetch_s3(key='locations'):
+    from botocore.exceptions import ClientError
+    from nypl_py_utils.classes.s3_client import S3ClientError
+
     bucket = os.environ.get('S3_BUCKET')
     resource = os.environ.get('S3_LOCATIONS_FILE')
     if bucket is None:
         raise MissingEnvVar('S3_BUCKET')
     if resource is None:
         raise MissingEnvVar('S3_LOCATIONS_FILE')
-    s3_client = S3Client(bucket, resource)
-    return {'data': s3_client.fetch_cache(), 'updated_at': time.time()}
+    cached = S3_CACHE.peek(key)
+    params = {'Bucket': bucket, 'Key': resource}
+    if cached is not None and cached.get('etag'):
+        params['IfNoneMatch'] = cached.get('etag')
+    try:
+        response = s3_client().get_object(**params)
+    except ClientError as e:
+        if cached is not None and \
+                e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+            GlobalLogger.logger.info('%s is unchanged in S3 bucket %s', resource, bucket)
+            return cached
+        raise S3ClientError(
+            f'Error retrieving {resource} from S3 bucket {bucket}: {e}') from None
+    GlobalLogger.logger.info('Fetched %s from S3 bucket %s', resource, bucket)
+    try:
+        # build the mapping as the body streams in rather than reading it whole
+        data = dict(iter_object_items(response['Body'].iter_chunks()))
+    except ValueError as e:
+        raise S3ClientError(f'Failed to parse {resource} from S3 bucket {bucket}: {e}') from None
+    return {'data': data, 'etag': response.get('ETag')}
 
 
+# returns the S3 locations mapping. Once the cached mapping is over an hour
+# old it keeps being served while a conditional refresh runs in the
+# background, so no request waits on S3 after the first one.
 def check_cache_or_fetch_s3():
-    s3_data = fetch_s3()
-    updated_at = s3_data.get('updated_at')
-    s3_cache_invalidated = time.time() - updated_at > 3600
-    if s3_data.get('data') is None or s3_cache_invalidated:
-        fetch_s3.cache_clear()
-        s3_data = fetch_s3()
-    return s3_data.get('data')
+    restore_cache('s3', S3_CACHE)
+    return S3_CACHE.get('locations', fetch_s3).get('data')
+
+
+# revalidate the S3 mapping now, whatever its age, and return it
+def refresh_s3():
+    restore_cache('s3', S3_CACHE)
+    S3_CACHE.update({'locations': fetch_s3()}, share=True)
+    return S3_CACHE.peek('locations').get('data')
+
+
+# the prefix index is rebuilt only when the S3 mapping itself is replaced,
+# i.e. once per S3 refresh rather than once per requested code
+PREFIX_INDEX = {'mapping': None, 'index': None}
+
+
+def location_prefix_index():
+    mapping = check_cache_or_fetch_s3()
+    if PREFIX_INDEX['mapping'] is not mapping:
+        PREFIX_INDEX['index'] = PrefixIndex(mapping)
+        PREFIX_INDEX['mapping'] = mapping
+    return PREFIX_INDEX['index']
+
+
+def validate_fields(fields):
+    unknown_fields = [field for field in fields if field not in FIELD_SOURCES]
+    if unknown_fields:
+        raise ParamError(f"Unknown fields: {','.join(unknown_fields)}")
+
+
+def sources_for(fields):
+    return set().union(*(FIELD_SOURCES[field] for field in fields))
+
+
+# codes whose result is missing data because an upstream source failed
+def failed_codes(location_dict):
+    return [code for code, results in location_dict.items()
+            if any(result.get('errors') for result in results)]
+
+
+def source_error(source, location_code, error):
+    message = getattr(error, 'message', None) or str(error)
+    GlobalLogger.logger.error(
+        'Failed to read %s data for location code %s: %s', source, location_code, message)
+    return {'source': source, 'message': message}
+
+
+# time.time() at which a response for these codes and fields may change:
+# the earliest refresh of the S3 mapping, the Drupal data and ReCAP closures
+# it used and, for hours and closures, the end of today. nypl-core files
+# never expire, so no response is good for longer than MAX_RESPONSE_AGE.
+def expires_at(location_codes, fields):
+    expiries = [time.time() + MAX_RESPONSE_AGE]
+    if 's3' in sources_for(fields):
+        expiries.append((S3_CACHE.fetched_at('locations') or 0) + S3_CACHE_TTL)
+    if 'drupal' in sources_for(fields):
+        expiries.append(drupal_expires_at(location_codes))
+    if 'hours' in fields:
+        expiries.append(hours_expires_at())
+    if ('closures' in fields or 'hours' in fields) and any(is_recap_code(code) for code in location_codes):
+        # the closures window moves at midnight too
+        expiries.append((lib.rc_alerts.CACHE.fetched_at('closures') or 0) + lib.rc_alerts.RC_ALERTS_CACHE_TTL)
+        expiries.append(hours_expires_at())
+    return min(expiries)
 
 
 def fetch_locations(location_codes, fields):
-    location_dict = {}
-    for code in location_codes:
-        location_dict[code] = build_location_info(code, fields)
-    return location_dict
+    # each distinct code is resolved once, however often it was requested
+    return resolve_locations(dict.fromkeys(location_codes, fields))
+
+
+# resolve codes that each have their own fields in one pass: the Drupal data
+# of every code that needs it is prefetched together, and the nypl-core and
+# S3 data is shared by all of them
+def resolve_locations(selections):
+    validate_fields(list(dict.fromkeys(
+        field for fields in selections.values() for field in fields)))
+    drupal_codes = [code for (code, fields) in selections.items()
+                    if 'drupal' in sources_for(fields)]
+    if drupal_codes:
+        try:
+            with lib.metrics.span('drupal'):
+                prefetch_location_data(drupal_codes)
+        except Exception as e:
+            # each code reports the failure under its own errors when its
+            # Drupal data is read in build_location_info
+            GlobalLogger.logger.error('Failed to prefetch Drupal data for %s: %s', drupal_codes, e)
+    return {code: build_location_info(code, fields)
+            for (code, fields) in selections.items()}
 
 
 # returns s3 location code, location url, and location label for a
-# given sierra location code
+# given sierra location code. A source that fails only costs the fields it
+# provides: they are left empty and the failure is listed under 'errors'
+# next to whatever the other sources returned.
 def build_location_info(location_code, fields):
     GlobalLogger.logger.info(
-        f'Accessing NYPL-core for location code: {location_code}')
-    if location_code != 'rc':
-        nypl_core_location_data = (lib.nypl_core
-                                      .sierra_location_by_code(location_code))
-    else:
-        nypl_core_location_data = {'label': 'ReCAP'}
+        'Accessing NYPL-core for location code: %s', location_code)
+    errors = []
+    try:
+        with lib.metrics.span('nypl_core'):
+            if location_code != 'rc':
+                nypl_core_location_data = (lib.nypl_core
+                                              .sierra_location_by_code(location_code))
+            else:
+                nypl_core_location_data = {'label': 'ReCAP'}
+    except Exception as e:
+        errors.append(source_error('nypl_core', location_code, e))
+        nypl_core_location_data = {}
 
     if nypl_core_location_data is None:
         GlobalLogger.logger.error(
-            f'No nypl core data returned for location code: {location_code}')
+            'No nypl core data returned for location code: %s', location_code)
         return []
     label = nypl_core_location_data.get('label')
-    url = None
     code = None
-    for s3_code, s3_url in check_cache_or_fetch_s3().items():
-        # turn xxx* into ^(xxx)+
-        regex = r'^(' + s3_code[0:-1] + ')+'
-        if re.match(regex, location_code) is not None:
-            # TODO: remove dependency on code property in DFE
-            code = location_code
-            url = s3_url
-    location_data = get_location_data(location_code, fields)
+    url = None
+    try:
+        if 's3' in sources_for(fields):
+            # longest matching xxx* prefix in the S3 mapping wins
+            with lib.metrics.span('s3'):
+                url = location_prefix_index().match(location_code)
+    except Exception as e:
+        errors.append(source_error('s3', location_code, e))
+    if url is not None:
+        # TODO: remove dependency on code property in DFE
+        code = location_code
+    location_data = None
+    if 'drupal' in sources_for(fields):
+        try:
+            location_data = get_location_data(location_code, fields)
+        except Exception as e:
+            errors.append(source_error('drupal', location_code, e))
+    closure_index = None
+    if is_recap_code(location_code) and ('closures' in fields or 'hours' in fields):
+        try:
+            with lib.metrics.span('rc_alerts'):
+                closure_index = RCAlerts.get_alerts()
+        except Exception as e:
+            errors.append(source_error('rc_alerts', location_code, e))
     # original implementation of this code returned an array of multiple codes
     # which the front end would then filter through. We now only return one,
     # correct location, but it has to be in an array due to original contract.
@@ -75,5 +247,13 @@ def build_location_info(location_code, fields):
     if 'location' in fields and location_data is not None:
         location_info['location'] = location_data.get('location')
     if 'hours' in fields and location_data is not None:
-        location_info['hours'] = location_data.get('hours')
+        hours = location_data.get('hours')
+        if hours is not None and closure_index is not None:
+            with lib.metrics.span('hours'):
+                hours = apply_closures(hours, closure_index, local_midnight(datetime.date.today()))
+        location_info['hours'] = hours
+    if 'closures' in fields and closure_index is not None:
+        location_info['closures'] = RCAlerts.current_closures(closure_index)
+    if errors:
+        location_info['errors'] = errors
     return [location_info]
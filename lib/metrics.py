@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# In-process counters and timings, shared by every module in the container.
+# Values accumulate across warm invocations until reset() is called.
+_LOCK = threading.Lock()
+COUNTERS = {}
+TIMINGS = {}
+
+# the invocation being served, between start_request and end_request: its
+# stage durations in milliseconds, the counters incremented meanwhile and
+# the milliseconds of each upstream call by name. A container serves one
+# invocation at a time, so one slot is enough.
+REQUEST = {'started': None, 'spans': {}, 'counters': {}, 'latencies': {}}
+
+# embedded metric format accepts at most 100 values per metric in a record
+MAX_METRIC_VALUES = 100
+
+
+def increment(name, value=1):
+    with _LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+        if REQUEST['started'] is not None:
+            REQUEST['counters'][name] = REQUEST['counters'].get(name, 0) + value
+
+
+def record_timing(name, seconds):
+    with _LOCK:
+        timing = TIMINGS.setdefault(
+            name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+        timing['last'] = seconds
+
+
+# time one call to an upstream. Every call of the current invocation is
+# reported on its own, so CloudWatch can compute percentiles across them.
+def record_latency(name, seconds):
+    record_timing(name, seconds)
+    with _LOCK:
+        if REQUEST['started'] is not None:
+            latencies = REQUEST['latencies'].setdefault(name, [])
+            if len(latencies) < MAX_METRIC_VALUES:
+                latencies.append(round(seconds * 1000, 3))
+
+
+def snapshot():
+    with _LOCK:
+        return {
+            'counters': dict(COUNTERS),
+            'timings': {name: dict(timing) for name, timing in TIMINGS.items()}
+        }
+
+
+def reset():
+    with _LOCK:
+        COUNTERS.clear()
+        TIMINGS.clear()
+        REQUEST.update({'started': None, 'spans': {}, 'counters': {}, 'latencies': {}})
+
+
+def start_request():
+    with _LOCK:
+        REQUEST.update({'started': time.perf_counter(), 'spans': {}, 'counters': {}, 'latencies': {}})
+
+
+# time a stage of the current invocation. A stage entered more than once,
+# e.g. once per location code, adds up.
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        milliseconds = (time.perf_counter() - start) * 1000
+        with _LOCK:
+            if REQUEST['started'] is not None:
+                REQUEST['spans'][name] = REQUEST['spans'].get(name, 0.0) + milliseconds
+
+
+def end_request(**properties):
+    """
+    Close the current invocation and write it to stdout as one CloudWatch
+    embedded metric format record: its total and per-stage milliseconds,
+    the milliseconds of each upstream call, as a list per upstream, and its
+    counters become metrics of METRICS_NAMESPACE, with `properties` (e.g.
+    the route and status code) alongside. Returns the record.
+    """
+    with _LOCK:
+        if REQUEST['started'] is None:
+            return None
+        total = (time.perf_counter() - REQUEST['started']) * 1000
+        spans = REQUEST['spans']
+        counters = REQUEST['counters']
+        latencies = REQUEST['latencies']
+        REQUEST.update({'started': None, 'spans': {}, 'counters': {}, 'latencies': {}})
+    record_timing('request', total / 1000)
+    metrics = {'total': round(total, 3), **{name: round(value, 3) for (name, value) in spans.items()},
+               **latencies}
+    definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics] + \
+        [{'Name': name, 'Unit': 'Count'} for name in counters]
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': os.environ.get('METRICS_NAMESPACE', 'LocationsService'),
+                'Dimensions': [['Route']] if 'Route' in properties else [[]],
+                'Metrics': definitions
+            }]
+        },
+        **properties,
+        **metrics,
+        **counters
+    }
+    # CloudWatch only extracts metrics from log lines that are pure JSON
+    sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+    sys.stdout.flush()
+    return record
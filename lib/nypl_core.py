@@ -1,41 +1,121 @@
-import requests
-from requests.exceptions import JSONDecodeError, RequestException
 import os
+import sys
+import threading
 
+import lib.http_client
+from lib.failure_backoff import FailureBackoff
+from lib.json_stream import iter_object_items
+from lib.logger import GlobalLogger
+from lib.single_flight import SingleFlight
+from lib.snapshot import read_snapshot, write_snapshot
 
+
+# nypl-core files by name, reduced by reduce_nypl_core_objects. They are
+# loaded once per container and never expire.
 CACHE = {}
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# concurrent first lookups share one download per file
+FLIGHTS = SingleFlight()
+
+# a file that failed to load is not requested again for this long
+NYPL_CORE_FAILURE_BACKOFF = 30
+FAILURES = FailureBackoff(NYPL_CORE_FAILURE_BACKOFF)
+
 
 def sierra_location_by_code(location_code):
     """
     Return hash of Sierra location by location code
     """
-    return nypl_core_objects('by_sierra_location.json').get(location_code)
+    labels = nypl_core_objects('by_sierra_location.json')
+    if location_code not in labels:
+        return None
+    return {'label': labels[location_code]}
+
+
+def reduce_nypl_core_objects(name, items):
+    """
+    Keep only what the service returns from the (key, value) pairs of a
+    nypl-core file. For by_sierra_location.json that is a flat code -> label
+    map, with labels interned since many locations share one.
+    """
+    if name != 'by_sierra_location.json':
+        return dict(items)
+    labels = {}
+    for code, location in items:
+        label = location.get('label') if isinstance(location, dict) else None
+        labels[sys.intern(code)] = sys.intern(label) if isinstance(label, str) else None
+    return labels
 
 
 def nypl_core_objects(name):
+    if not CACHE.get(name) is None:
+        return CACHE[name]
+    return FLIGHTS.do(name, load_nypl_core_objects, name)
+
+
+def load_nypl_core_objects(name):
     if not CACHE.get(name) is None:
         return CACHE[name]
 
+    # a snapshot left by an earlier container serves this one straight
+    # away while the file is fetched again in the background
+    snapshot = read_snapshot(snapshot_name(name))
+    if snapshot is not None:
+        CACHE[name] = snapshot[0]
+        threading.Thread(target=revalidate_nypl_core_objects, args=(name,),
+                         daemon=True).start()
+        return snapshot[0]
+
+    CACHE[name] = FAILURES.call(name, fetch_nypl_core_objects)
+    write_snapshot(snapshot_name(name), CACHE[name])
+    return CACHE[name]
+
+
+# stream the file and reduce it entry by entry as it is parsed, so neither
+# the raw body nor the full object graph is ever held in memory
+def fetch_nypl_core_objects(name):
     base_url = os.environ.get('NYPL_CORE_OBJECTS_BASE_URL')
     url = f'{base_url}{name}'
     try:
-        response = requests.get(url)
+        response = lib.http_client.get(url, 'nypl_core', stream=True)
         response.raise_for_status()
-    except RequestException as e:
+    except lib.http_client.RequestException as e:
         raise NyplCoreObjectsError(
             'Failed to retrieve nypl-core-objects file from {url}: \
 {errorType} {errorMessage}'
             .format(url=url, errorType=type(e), errorMessage=e)) from None
 
     try:
-        CACHE[name] = response.json()
-        return CACHE[name]
-    except (JSONDecodeError, KeyError) as e:
+        return reduce_nypl_core_objects(
+            name, iter_object_items(response.iter_content(STREAM_CHUNK_SIZE)))
+    except (lib.http_client.RequestException, ValueError, KeyError) as e:
         raise NyplCoreObjectsError(
             'Failed to parse nypl-core-objects file: \
 {errorType} {errorMessage}'
             .format(errorType=type(e), errorMessage=e)) from None
+    finally:
+        response.close()
+
+
+def refresh_nypl_core_objects(name):
+    objects = fetch_nypl_core_objects(name)
+    CACHE[name] = objects
+    write_snapshot(snapshot_name(name), objects)
+    return objects
+
+
+def revalidate_nypl_core_objects(name):
+    try:
+        refresh_nypl_core_objects(name)
+    except NyplCoreObjectsError as e:
+        GlobalLogger.logger.warning(
+            f'Serving {name} from snapshot, refresh failed: {e.message}')
+
+
+def snapshot_name(name):
+    return 'nypl-core-' + name.replace('.json', '')
 
 
 class NyplCoreObjectsError(Exception):
@@ -0,0 +1,43 @@
+class PrefixIndex:
+    """
+    Trie over the `xxx*` patterns in the S3 locations mapping. Resolving a
+    Sierra location code walks one node per character of the code, so a
+    lookup costs O(len(code)) no matter how many patterns the mapping holds.
+
+    Precedence: the longest matching prefix wins, so `mal*` beats `ma*` for
+    `mal92`. A bare `*` pattern matches every code.
+    """
+
+    _VALUE = object()
+
+    def __init__(self, mapping=None):
+        self._root = {}
+        self.size = 0
+        for pattern, value in (mapping or {}).items():
+            self.add(pattern, value)
+
+    def add(self, pattern, value):
+        # turn xxx* into the literal prefix xxx
+        prefix = pattern[0:-1] if pattern.endswith('*') else pattern
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if PrefixIndex._VALUE not in node:
+            self.size += 1
+        node[PrefixIndex._VALUE] = value
+
+    def match(self, code):
+        """
+        Return the value for the longest pattern prefixing code, or None
+        """
+        node = self._root
+        match = node.get(PrefixIndex._VALUE)
+        for char in code:
+            node = node.get(char)
+            if node is None:
+                break
+            match = node.get(PrefixIndex._VALUE, match)
+        return match
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,59 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.metrics
+import lib.nypl_core
+from lib.location_api import refresh_locations
+from lib.location_lookup import refresh_s3
+from lib.logger import GlobalLogger
+from lib.rc_alerts import RCAlerts
+from lib.snapshot import flush_snapshots
+
+
+GlobalLogger.initialize_logger(__name__)
+logger = GlobalLogger.logger
+
+
+def refresh_nypl_core():
+    return lib.nypl_core.refresh_nypl_core_objects('by_sierra_location.json')
+
+
+# each source's refresh, returning what it loaded (or how many locations)
+SOURCES = {
+    'nypl_core': refresh_nypl_core,
+    's3': refresh_s3,
+    'drupal': refresh_locations,
+    'rc_alerts': RCAlerts.refresh_alerts
+}
+
+
+def refresh_source(source):
+    start = time.perf_counter()
+    try:
+        loaded = SOURCES[source]()
+    except Exception as e:
+        message = getattr(e, 'message', None) or str(e)
+        logger.error(f'Failed to pre-warm {source}: {message}')
+        report = {'error': message}
+    else:
+        report = {'size': loaded if isinstance(loaded, int) else len(loaded)}
+    duration = time.perf_counter() - start
+    lib.metrics.record_timing(f'prewarm.{source}', duration)
+    report['seconds'] = round(duration, 3)
+    return report
+
+
+def prewarm():
+    """
+    Refresh every upstream cache in parallel, whatever the age of what is
+    cached, so requests after an idle hour or a deploy find them warm.
+    Returns {source: {'size', 'seconds'}}, with 'error' in place of 'size'
+    for a source that could not be refreshed.
+    """
+    with ThreadPoolExecutor(max_workers=len(SOURCES)) as executor:
+        reports = dict(zip(SOURCES, executor.map(refresh_source, SOURCES)))
+    # the refreshed caches are snapshotted now rather than after the interval
+    flush_snapshots()
+    logger.info(f'Pre-warmed caches: {reports}')
+    return reports
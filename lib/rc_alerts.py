@@ -1,27 +1,92 @@
-import requests
+import csv
+import datetime
+import io
 import os
 
+import lib.http_client
+from lib.closures import (Closure, ClosureIndex, closure_applies,
+                          local_midnight)
+from lib.failure_backoff import FailureBackoff
+from lib.logger import GlobalLogger
+from lib.ttl_cache import TTLCache
+
+
+RC_ALERTS_CACHE_TTL = 3600
+# if the feed cannot be reached the previous closures keep being served
+RC_ALERTS_CACHE_STALE_TTL = 86400
+# closures are returned for the week the hours cover, starting today
+CLOSURES_WINDOW_DAYS = 7
+# a failed feed request is not attempted again for this long
+RC_ALERTS_FAILURE_BACKOFF = 30
+FAILURES = FailureBackoff(RC_ALERTS_FAILURE_BACKOFF)
+
+# holds a single 'closures' entry: the ClosureIndex of the feed
+CACHE = TTLCache('rc_alerts', RC_ALERTS_CACHE_TTL, maxsize=1,
+                 stale_ttl=RC_ALERTS_CACHE_STALE_TTL, backoff=FAILURES)
+
+
+def is_recap_code(location_code):
+    return location_code.startswith('rc')
+
 
 class RCAlerts:
+    """
+    ReCAP closures, read from the start_date,end_date CSV at RC_ALERTS_URL.
+    Every row closes ReCAP for whole days, from the start of start_date to
+    the end of end_date, local time.
+    """
 
     @classmethod
     def get_alerts(cls):
+        return CACHE.get('closures', cls.fetch_alerts)
+
+    @classmethod
+    def refresh_alerts(cls):
+        index = cls.fetch_alerts()
+        CACHE.set('closures', index)
+        return index
+
+    @classmethod
+    def fetch_alerts(cls, key='closures'):
         rc_alerts_url = os.environ['RC_ALERTS_URL']
-        resp = requests.get(rc_alerts_url)
-        return [cls.date_to_datetime(line.split(','))
-                for line in resp.text.split('\n')[1:]]
+        try:
+            resp = lib.http_client.get(rc_alerts_url, 'rc_alerts')
+            resp.raise_for_status()
+        except lib.http_client.RequestException as e:
+            raise RCAlertsError(
+                f'Failed to retrieve ReCAP closures from {rc_alerts_url}: {e}') from None
+        return ClosureIndex(cls.parse_alerts(resp.text))
+
+    @classmethod
+    def parse_alerts(cls, text):
+        closures = []
+        for row in csv.DictReader(io.StringIO(text)):
+            try:
+                closures.append(cls.closure_from_row(row))
+            except (AttributeError, TypeError, ValueError):
+                GlobalLogger.logger.warning(f'Ignoring malformed ReCAP closure: {row}')
+        return closures
+
+    @classmethod
+    def closure_from_row(cls, row):
+        start = datetime.date.fromisoformat(row.get('start_date').strip())
+        end = datetime.date.fromisoformat(row.get('end_date').strip())
+        return Closure(local_midnight(start), local_midnight(end + datetime.timedelta(days=1)))
 
     @classmethod
-    def date_to_datetime(cls, date):
-        if len(date) != 2:
-            return {}
-        (start, end) = date
-        # TODO: this should really be either 4 or 5 depending on the date,
-        # but in this case it doesn't matter
-        # as long as ReCAP closures are full days
-        offset = '-05:00'
-        return {'applies':
-                {
-                    'start': f'{start}T00:00:00{offset}',
-                    'end': f'{end}T23:59:58{offset}'}
-                }
+    def closures_between(cls, start, end, index=None):
+        if index is None:
+            index = cls.get_alerts()
+        return [closure_applies(closure) for closure in index.between(start, end)]
+
+    @classmethod
+    def current_closures(cls, index=None):
+        today = datetime.date.today()
+        return cls.closures_between(
+            local_midnight(today), local_midnight(today + datetime.timedelta(days=CLOSURES_WINDOW_DAYS)),
+            index)
+
+
+class RCAlertsError(Exception):
+    def __init__(self, message=None):
+        self.message = message
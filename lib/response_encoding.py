@@ -0,0 +1,111 @@
+import base64
+import gzip
+import json
+import os
+
+from functools import cache
+
+
+# compressing a smaller body saves less than the base64 and header overhead
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+@cache
+def json_encoder():
+    """
+    Return a function serializing a response body to compact JSON. orjson
+    is used when it is installed, json with compact separators otherwise.
+    Both leave non-ASCII characters unescaped, so the two produce the same
+    text for the bodies this service returns.
+    """
+    try:
+        import orjson
+    except ImportError:
+        return lambda body: json.dumps(body, separators=(',', ':'), ensure_ascii=False)
+    return lambda body: orjson.dumps(body).decode()
+
+
+def dumps(body):
+    return json_encoder()(body)
+
+
+@cache
+def brotli_module():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+# compressed bodies are sent base64 encoded, which API Gateway only decodes
+# when binaryMediaTypes covers them, so compression is opt-in
+def compression_enabled():
+    return os.environ.get('RESPONSE_COMPRESSION', 'false').lower() == 'true'
+
+
+def available_encodings():
+    # in order of preference
+    return ['br', 'gzip'] if brotli_module() is not None else ['gzip']
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Return the content coding to answer an Accept-Encoding header with, or
+    None for the identity encoding. The coding with the highest q-value
+    wins, brotli over gzip when they tie, and q=0 refuses a coding. Always
+    None unless RESPONSE_COMPRESSION is enabled.
+    """
+    if not accept_encoding or not compression_enabled():
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        (coding, _, params) = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            (name, _, value) = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best = (None, 0.0)
+    for coding in available_encodings():
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best[1]:
+            best = (coding, weight)
+    return best[0]
+
+
+# the coding a response body is actually sent with: small bodies go out as is
+def applied_encoding(body, encoding):
+    if encoding is None or len(body) < MIN_COMPRESS_SIZE:
+        return None
+    return encoding
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli_module().compress(data, quality=BROTLI_QUALITY)
+    # a fixed mtime keeps the output, and so the ETag, stable
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_response(response, encoding):
+    """
+    Return a copy of a Lambda proxy response with its body compressed in
+    the given coding and base64 encoded, as API Gateway expects binary
+    bodies. The response passed in is never modified, so cached responses
+    can be encoded for each request.
+    """
+    headers = dict(response['headers'], Vary='Accept-Encoding')
+    encoding = applied_encoding(response['body'], encoding)
+    if encoding is None or response.get('isBase64Encoded'):
+        return dict(response, headers=headers)
+    headers['Content-Encoding'] = encoding
+    body = compress(response['body'].encode(), encoding)
+    return dict(response, body=base64.b64encode(body).decode('ascii'),
+                isBase64Encoded=True, headers=headers)
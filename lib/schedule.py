@@ -0,0 +1,115 @@
+import datetime
+
+from typing import NamedTuple, Optional, Tuple
+
+
+INTEGER_DAYS = {
+    "MONDAY": 0,
+    "TUESDAY": 1,
+    "WEDNESDAY": 2,
+    "THURSDAY": 3,
+    "FRIDAY": 4,
+    "SATURDAY": 5,
+    "SUNDAY": 6
+}
+
+
+class ScheduledDay(NamedTuple):
+    day: str
+    weekday: int
+    # minutes after midnight, both None when the location is closed
+    opens: Optional[int]
+    closes: Optional[int]
+
+
+class WeeklySchedule(NamedTuple):
+    """
+    A location's week of hours, compiled once from Drupal's location_hours.
+    `days` keeps Drupal's order; `next_open[i]` is the index of the first
+    open day after days[i], wrapping around the week, or None if the
+    location is closed all week.
+
+    Both are plain tuples so a schedule survives a JSON round trip (in
+    snapshots) as nested lists, which every function here also accepts.
+    """
+    days: Tuple[ScheduledDay, ...]
+    next_open: Tuple[Optional[int], ...]
+
+
+class ScheduleError(Exception):
+    def __init__(self, message=None):
+        self.message = message
+
+
+def minutes_from_hours_string(hours_string: str):
+    # turn a string like 10 AM or 6:30 PM into minutes after midnight
+    hour_and_time_of_day = hours_string.strip().split(' ')
+    hour_and_minute = hour_and_time_of_day[0].split(':')
+    hour = int(hour_and_minute[0])
+    minute = 0
+    if len(hour_and_minute) > 1:
+        minute = int(hour_and_minute[1])
+    time_of_day = hour_and_time_of_day[1]
+    if time_of_day.lower() == 'pm' and hour != 12:
+        hour += 12
+    if time_of_day.lower() == 'am' and hour == 12:
+        hour = 0
+    return hour * 60 + minute
+
+
+def compile_schedule(location_hours):
+    """
+    Compile Drupal location_hours into a WeeklySchedule, preferring
+    upcoming_hours over regular_hours. Raises ScheduleError when the hours
+    cannot be parsed.
+    """
+    try:
+        entries = (location_hours.get('upcoming_hours')
+                   or location_hours.get('regular_hours'))
+        days = []
+        for entry in entries:
+            hours = entry.get('hours')
+            if hours.lower() == 'closed':
+                (opens, closes) = (None, None)
+            else:
+                (start, end) = hours.split('–')
+                (opens, closes) = (minutes_from_hours_string(start), minutes_from_hours_string(end))
+            days.append(ScheduledDay(entry.get('day'), INTEGER_DAYS[entry.get('day').upper()], opens, closes))
+    except (AttributeError, TypeError, KeyError, ValueError, IndexError) as e:
+        raise ScheduleError(f'Unable to parse location hours: {type(e).__name__} {e}') from None
+
+    next_open = []
+    for index in range(len(days)):
+        next_open.append(next(
+            ((index + offset) % len(days) for offset in range(1, 7)
+             if days[(index + offset) % len(days)].opens is not None),
+            None))
+    return WeeklySchedule(tuple(days), tuple(next_open))
+
+
+def schedule_week(schedule, current_date: datetime.datetime):
+    """
+    Attach the dates of the week starting at current_date (local midnight)
+    to a compiled schedule, in the service's hours response format.
+    """
+    (days, next_open) = schedule
+    current_weekday = current_date.weekday()
+    hours = []
+    today_index = 0
+    for index, (day, weekday, opens, closes) in enumerate(days):
+        weekday_offset = (weekday - current_weekday) % 7
+        hours_for_day = {'day': day}
+        if opens is None:
+            hours_for_day['startTime'] = None
+            hours_for_day['endTime'] = None
+        else:
+            base_date = current_date + datetime.timedelta(days=weekday_offset)
+            hours_for_day['startTime'] = base_date.replace(hour=opens // 60, minute=opens % 60).isoformat()
+            hours_for_day['endTime'] = base_date.replace(hour=closes // 60, minute=closes % 60).isoformat()
+        if weekday_offset == 0:
+            hours_for_day['today'] = True
+            today_index = index
+        hours.append(hours_for_day)
+    if hours and next_open[today_index] is not None:
+        hours[next_open[today_index]]['nextBusinessDay'] = True
+    return hours
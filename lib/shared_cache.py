@@ -0,0 +1,308 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import lib.metrics
+from lib.logger import GlobalLogger
+
+
+GlobalLogger.initialize_logger(__name__)
+logger = GlobalLogger.logger
+
+# bump when the layout of any shared value changes so that entries written
+# by an older deploy are ignored instead of misread
+SHARED_CACHE_VERSION = 1
+
+DEFAULT_SHARED_CACHE_PATH = '/tmp/locations-service/shared-cache.sqlite'
+
+# SQLite's default limit on parameters per statement is 999
+SQLITE_BATCH_SIZE = 500
+
+# a container fetching a key holds a lease on it for at most LEASE_TTL
+# seconds. Containers missing the same key meanwhile wait up to LEASE_WAIT
+# seconds for the result, polling every LEASE_POLL seconds, and only then
+# fetch it themselves.
+LEASE_TTL = 10
+LEASE_WAIT = 3
+LEASE_POLL = 0.05
+
+
+class MemoryBackend:
+    """
+    Reference backend, holding entries in this process only. Values are
+    stored as JSON so they come back exactly as from any other backend.
+
+    A backend maps string keys to (value, fetched_at) and forgets entries
+    once their TTL has passed. get_many returns only the keys it holds.
+    acquire_many takes a lease on each key no one else holds one on, and
+    returns those keys; release_many gives leases up.
+    """
+
+    def __init__(self, path=None):
+        self._entries = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] > now:
+                    found[key] = (json.loads(entry[0]), entry[1])
+        return found
+
+    def set_many(self, entries, ttl):
+        rows = {key: (json.dumps(value, separators=(',', ':')), fetched_at, fetched_at + ttl)
+                for (key, (value, fetched_at)) in entries.items()}
+        with self._lock:
+            self._entries.update(rows)
+
+    def acquire_many(self, keys, ttl):
+        now = time.time()
+        acquired = []
+        with self._lock:
+            for key in keys:
+                if self._leases.get(key, 0) <= now:
+                    self._leases[key] = now + ttl
+                    acquired.append(key)
+        return acquired
+
+    def release_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._leases.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._leases.clear()
+
+
+class SQLiteBackend:
+    """
+    Backend keeping entries in a SQLite file, which every process that can
+    reach the file shares, e.g. containers mounting the same volume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                         check_same_thread=False)
+            # readers do not block the writer, nor the writer the readers
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                               'fetched_at REAL NOT NULL, expires_at REAL NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, keys):
+        keys = list(keys)
+        now = time.time()
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[i:i + SQLITE_BATCH_SIZE]
+                rows += self.connection().execute(
+                    f"SELECT key, value, fetched_at FROM entries WHERE key IN ({','.join('?' * len(batch))}) "
+                    'AND expires_at > ?', batch + [now]).fetchall()
+        return {key: (json.loads(value), fetched_at) for (key, value, fetched_at) in rows}
+
+    def set_many(self, entries, ttl):
+        rows = [(key, json.dumps(value, separators=(',', ':')), fetched_at, fetched_at + ttl)
+                for (key, (value, fetched_at)) in entries.items()]
+        with self._lock:
+            connection = self.connection()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', rows)
+                connection.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+
+    def acquire_many(self, keys, ttl):
+        now = time.time()
+        acquired = []
+        with self._lock:
+            connection = self.connection()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute('DELETE FROM leases WHERE expires_at <= ?', (now,))
+                for key in keys:
+                    if connection.execute('INSERT OR IGNORE INTO leases VALUES (?, ?)',
+                                          (key, now + ttl)).rowcount:
+                        acquired.append(key)
+        return acquired
+
+    def release_many(self, keys):
+        with self._lock:
+            connection = self.connection()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.executemany('DELETE FROM leases WHERE key = ?', [(key,) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self.connection().execute('DELETE FROM entries')
+            self.connection().execute('DELETE FROM leases')
+
+
+# backend factories by SHARED_CACHE_BACKEND name, each called with
+# SHARED_CACHE_PATH. Another backend is plugged in by adding it here.
+BACKEND_FACTORIES = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend
+}
+
+# backends created in this container, by (name, path)
+BACKENDS = {}
+_LOCK = threading.Lock()
+
+
+# the shared tier is only used when SHARED_CACHE_BACKEND is set
+def shared_backend():
+    name = os.environ.get('SHARED_CACHE_BACKEND')
+    if not name:
+        return None
+    path = os.environ.get('SHARED_CACHE_PATH', DEFAULT_SHARED_CACHE_PATH)
+    with _LOCK:
+        if (name, path) not in BACKENDS:
+            if name not in BACKEND_FACTORIES:
+                logger.error(f'Unknown SHARED_CACHE_BACKEND {name}, not using a shared cache')
+                BACKENDS[(name, path)] = None
+            else:
+                BACKENDS[(name, path)] = BACKEND_FACTORIES[name](path)
+        return BACKENDS[(name, path)]
+
+
+class SharedCache:
+    """
+    One namespace of the shared tier, sitting under a TTLCache: entries a
+    container fetched from upstream are stored with their fetch time and
+    served to every other container until `ttl` has passed. Keys carry
+    SHARED_CACHE_VERSION and the namespace.
+
+    Values must be JSON serializable. A failing backend is logged and
+    treated as a miss, so it never fails a lookup.
+    """
+
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def shared_key(self, key):
+        return f'v{SHARED_CACHE_VERSION}:{self.namespace}:{key}'
+
+    def get(self, key):
+        """Return (value, fetched_at) for key, or None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        backend = shared_backend()
+        if backend is None or not keys:
+            return {}
+        shared_keys = {self.shared_key(key): key for key in keys}
+        try:
+            entries = backend.get_many(list(shared_keys))
+        except (sqlite3.Error, OSError, ValueError) as e:
+            self._count('errors')
+            logger.warning(f'Unable to read {self.namespace} entries from the shared cache: {e}')
+            return {}
+        lib.metrics.increment(f'{self.namespace}.shared_cache.hits', len(entries))
+        lib.metrics.increment(f'{self.namespace}.shared_cache.misses', len(shared_keys) - len(entries))
+        return {shared_keys[shared_key]: entry for (shared_key, entry) in entries.items()}
+
+    def load(self, key, loader, started_at):
+        """
+        Return (value, fetched_at) for key: from the shared tier if it was
+        fetched within the TTL of started_at, otherwise from loader(key),
+        storing the result. While another container holds the lease on key
+        its result is waited for instead of fetching key a second time.
+        """
+        entry = self.get(key)
+        if entry is not None and started_at - entry[1] <= self.ttl:
+            return entry
+        leased = bool(self.acquire_many([key]))
+        if not leased:
+            entry = self.wait_many([key], started_at).get(key)
+            if entry is not None:
+                return entry
+        try:
+            value = loader(key)
+            self.set(key, value, started_at)
+        finally:
+            # a lease that timed out waiting is still another container's
+            if leased:
+                self.release_many([key])
+        return (value, started_at)
+
+    def wait_many(self, keys, started_at):
+        """
+        Wait up to LEASE_WAIT in all for keys other containers are fetching
+        and return (value, fetched_at) by key for those stored meanwhile,
+        fetched within the TTL of started_at. Every poll reads all the keys
+        still missing at once.
+        """
+        found = {}
+        pending = list(keys)
+        deadline = time.time() + LEASE_WAIT
+        while pending and time.time() < deadline:
+            time.sleep(LEASE_POLL)
+            for (key, entry) in self.get_many(pending).items():
+                if started_at - entry[1] <= self.ttl:
+                    found[key] = entry
+            pending = [key for key in pending if key not in found]
+        return found
+
+    def acquire_many(self, keys):
+        """
+        Take the fetch lease on each key no other container holds it on and
+        return those keys; every key when there is no shared tier
+        """
+        backend = shared_backend()
+        if backend is None or not keys:
+            return list(keys)
+        shared_keys = {self.shared_key(key): key for key in keys}
+        try:
+            acquired = backend.acquire_many(list(shared_keys), LEASE_TTL)
+        except (sqlite3.Error, OSError) as e:
+            self._count('errors')
+            logger.warning(f'Unable to lease {self.namespace} entries in the shared cache: {e}')
+            return list(keys)
+        return [shared_keys[shared_key] for shared_key in acquired]
+
+    def release_many(self, keys):
+        backend = shared_backend()
+        if backend is None or not keys:
+            return
+        try:
+            backend.release_many([self.shared_key(key) for key in keys])
+        except (sqlite3.Error, OSError) as e:
+            self._count('errors')
+            logger.warning(f'Unable to release {self.namespace} leases in the shared cache: {e}')
+
+    def set(self, key, value, fetched_at=None):
+        self.set_many({key: value}, fetched_at)
+
+    def set_many(self, values, fetched_at=None):
+        backend = shared_backend()
+        if backend is None or not values:
+            return
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        try:
+            backend.set_many({self.shared_key(key): (value, fetched_at) for (key, value) in values.items()},
+                             self.ttl)
+        except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+            self._count('errors')
+            logger.warning(f'Unable to write {self.namespace} entries to the shared cache: {e}')
+
+    def _count(self, counter):
+        lib.metrics.increment(f'{self.namespace}.shared_cache.{counter}')
@@ -0,0 +1,140 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from lib.logger import GlobalLogger
+
+
+GlobalLogger.initialize_logger(__name__)
+logger = GlobalLogger.logger
+
+# bump when the layout of any snapshot payload changes so that snapshots
+# written by an older deploy are ignored instead of misread
+SNAPSHOT_VERSION = 3
+
+# least seconds between two writes of one cache's snapshot. The updates
+# made meanwhile are written together once it has passed.
+SNAPSHOT_WRITE_INTERVAL = 5
+
+# names of the caches already restored in this container
+RESTORED = set()
+# time.time() of the last write, and the timer of the pending write, by name
+LAST_WRITTEN = {}
+PENDING = {}
+_LOCK = threading.Lock()
+
+
+# Snapshots are only written when SNAPSHOT_DIR is set, e.g. to the Lambda
+# /tmp volume, which survives between invocations of a reused sandbox.
+def snapshot_dir():
+    return os.environ.get('SNAPSHOT_DIR')
+
+
+def snapshot_path(name):
+    return os.path.join(snapshot_dir(), f'{name}.snapshot')
+
+
+# a snapshot is a one line JSON header followed by the compact JSON payload,
+# so the header can be checked without parsing the payload
+def write_snapshot(name, data):
+    if not snapshot_dir():
+        return False
+    header = {'version': SNAPSHOT_VERSION, 'name': name, 'written_at': time.time()}
+    tmp_path = None
+    try:
+        os.makedirs(snapshot_dir(), exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=snapshot_dir(), prefix=f'.{name}.')
+        with os.fdopen(fd, 'w') as snapshot_file:
+            snapshot_file.write(json.dumps(header))
+            snapshot_file.write('\n')
+            json.dump(data, snapshot_file, separators=(',', ':'))
+        # readers only ever see a complete snapshot
+        os.replace(tmp_path, snapshot_path(name))
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f'Unable to write {name} snapshot: {e}')
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+# returns (data, written_at) or None when there is no usable snapshot
+def read_snapshot(name):
+    if not snapshot_dir():
+        return None
+    try:
+        with open(snapshot_path(name)) as snapshot_file:
+            header = json.loads(snapshot_file.readline())
+            if header.get('version') != SNAPSHOT_VERSION or header.get('name') != name:
+                logger.info(f'Ignoring outdated {name} snapshot')
+                return None
+            return (json.load(snapshot_file), header.get('written_at'))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f'Unable to read {name} snapshot: {e}')
+        return None
+
+
+# write every entry of a TTLCache along with the time it was fetched, at
+# most once per SNAPSHOT_WRITE_INTERVAL: a cache updated once per fetched
+# code is rewritten once for the lot instead of once per code. Returns
+# whether the snapshot was written now rather than deferred.
+def persist_cache(name, cache):
+    if not snapshot_dir():
+        return False
+    with _LOCK:
+        if name in PENDING:
+            return False
+        delay = LAST_WRITTEN.get(name, 0) + SNAPSHOT_WRITE_INTERVAL - time.time()
+        if delay > 0:
+            timer = threading.Timer(delay, flush_cache, (name, cache))
+            timer.daemon = True
+            PENDING[name] = timer
+            timer.start()
+            return False
+        LAST_WRITTEN[name] = time.time()
+    return write_cache(name, cache)
+
+
+def flush_cache(name, cache):
+    with _LOCK:
+        PENDING.pop(name, None)
+        LAST_WRITTEN[name] = time.time()
+    return write_cache(name, cache)
+
+
+# write the deferred snapshots now instead of when their interval ends
+def flush_snapshots():
+    with _LOCK:
+        pending = list(PENDING.values())
+    for timer in pending:
+        timer.cancel()
+        flush_cache(*timer.args)
+
+
+def write_cache(name, cache):
+    return write_snapshot(name, [[key, value, fetched_at] for (key, value, fetched_at) in cache.items()])
+
+
+# fill an empty TTLCache from its snapshot, once per container. Entries
+# keep their original fetch times, so anything past its TTL is served stale
+# and revalidated in the background by the cache itself.
+def restore_cache(name, cache):
+    with _LOCK:
+        if name in RESTORED:
+            return False
+        RESTORED.add(name)
+    snapshot = read_snapshot(name)
+    if snapshot is None:
+        return False
+    for (key, value, fetched_at) in snapshot[0]:
+        if key not in cache:
+            cache.set(key, value, fetched_at=fetched_at, notify=False)
+    logger.info(f'Restored {len(snapshot[0])} {name} entries from snapshot')
+    return True
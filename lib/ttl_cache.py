@@ -0,0 +1,235 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+import lib.metrics
+from lib.logger import GlobalLogger
+from lib.single_flight import SingleFlight
+
+
+GlobalLogger.initialize_logger(__name__)
+logger = GlobalLogger.logger
+
+
+class TTLCache:
+    """
+    Bounded, thread-safe cache with a TTL per key measured from the time the
+    value was fetched.
+
+    Values older than `ttl` are still served (stale-while-revalidate) while a
+    single background refresh runs for that key. Values older than
+    `stale_ttl` are refreshed synchronously, but if that refresh fails the
+    last good value is served rather than raising. The least recently used
+    key is evicted once `maxsize` keys are held. None is a valid cached
+    value, used for lookups that found nothing.
+
+    Concurrent misses for one key share a single loader call.
+
+    `on_update`, if given, is called with the cache after values are stored.
+
+    `shared`, if given, is a lib.shared_cache.SharedCache consulted before
+    the loader, so one container's fetch serves every other container, and
+    given what the loader fetched.
+
+    `backoff`, if given, is a lib.failure_backoff.FailureBackoff the loader
+    runs through: a key whose fetch failed raises that error again, without
+    calling the loader, until its backoff has passed.
+    """
+
+    def __init__(self, name, ttl, maxsize=512, stale_ttl=86400, on_update=None, shared=None,
+                 backoff=None):
+        self.name = name
+        self.on_update = on_update
+        self.shared = shared
+        self.backoff = backoff
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.errors = 0
+        self._entries = OrderedDict()
+        self._refreshing = {}
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, calling loader(key) to fetch it
+        when it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self._count('misses')
+            return self._flights.do(key, self._load, key, loader)
+
+        (value, fetched_at) = entry
+        age = time.time() - fetched_at
+        if age <= self.ttl:
+            self._count('hits')
+            return value
+        self._count('stale')
+        if age > self.stale_ttl:
+            try:
+                return self._flights.do(key, self._load, key, loader)
+            except Exception as e:
+                self._count('errors')
+                logger.warning(f'Serving stale {self.name} data for {key}: {e}')
+                return value
+        self._refresh_in_background(key, loader)
+        return value
+
+    def peek(self, key, default=None):
+        """Return the cached value for key regardless of its age"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return default if entry is None else entry[0]
+
+    def is_fresh(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and time.time() - entry[1] <= self.ttl
+
+    def fetched_at(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value, fetched_at=None, notify=True):
+        with self._lock:
+            self._set(key, value, fetched_at)
+        if notify and self.on_update is not None:
+            self.on_update(self)
+
+    def update(self, values, fetched_at=None, notify=True, share=False):
+        """
+        Store several values at once. share=True also stores them in the
+        shared tier, for values just fetched from upstream.
+        """
+        with self._lock:
+            for key, value in values.items():
+                self._set(key, value, fetched_at)
+        if share and self.shared is not None:
+            self.shared.set_many(values, fetched_at)
+        if notify and self.on_update is not None:
+            self.on_update(self)
+
+    def load_shared(self, keys):
+        """
+        Fill keys this cache is missing from the shared tier and return the
+        keys that are still missing
+        """
+        if self.shared is None:
+            return list(keys)
+        entries = self.shared.get_many([key for key in keys if key not in self])
+        with self._lock:
+            for (key, (value, fetched_at)) in entries.items():
+                self._set(key, value, fetched_at)
+        return [key for key in keys if key not in self]
+
+    def wait_shared(self, keys):
+        """
+        Wait once for keys other containers hold the fetch leases on, fill
+        those they store in time and return the keys that are still missing
+        """
+        if self.shared is None:
+            return list(keys)
+        entries = self.shared.wait_many(keys, time.time())
+        with self._lock:
+            for (key, (value, fetched_at)) in entries.items():
+                self._set(key, value, fetched_at)
+        return [key for key in keys if key not in self]
+
+    def items(self):
+        """Return (key, value, fetched_at) for every entry"""
+        with self._lock:
+            return [(key, value, fetched_at)
+                    for (key, (value, fetched_at)) in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def join(self, timeout=None):
+        """Wait for any background refreshes in progress to finish"""
+        with self._lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stale': self.stale,
+                'errors': self.errors, 'size': len(self)}
+
+    def _load(self, key, loader):
+        # another caller may have stored the value since this one checked
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[1] <= self.ttl:
+            return entry[0]
+        (value, fetched_at) = self._fetch(key, loader, time.time())
+        self.set(key, value, fetched_at=fetched_at)
+        return value
+
+    # returns (value, fetched_at), going through the shared tier if any
+    def _fetch(self, key, loader, started_at):
+        if self.backoff is not None:
+            # checked first, so a failing key never waits on a shared lease
+            self.backoff.check(key)
+            (backoff, upstream) = (self.backoff, loader)
+
+            def loader(key):
+                return backoff.call(key, upstream)
+        if self.shared is not None:
+            return self.shared.load(key, loader, started_at)
+        return (loader(key), started_at)
+
+    def _set(self, key, value, fetched_at):
+        self._entries[key] = (value, time.time() if fetched_at is None else fetched_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        lib.metrics.increment(f'{self.name}.cache.{counter}')
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            # the refreshed value is aged from when its fetch started
+            thread = threading.Thread(target=self._refresh, args=(key, loader, time.time()),
+                                      daemon=True)
+            self._refreshing[key] = thread
+        thread.start()
+
+    def _refresh(self, key, loader, started_at):
+        try:
+            (value, fetched_at) = self._fetch(key, loader, started_at)
+            self.set(key, value, fetched_at=fetched_at)
+        except Exception as e:
+            # keep serving the last good value until the next attempt
+            self._count('errors')
+            logger.warning(f'Failed to refresh {self.name} data for {key}: {e}')
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
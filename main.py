@@ -1,56 +1,181 @@
 import os
+import base64
+import hashlib
 import json
 import re
+import time
 
-from nypl_py_utils.functions.config_helper import load_env_file
-
+import lib.metrics
 from lib.logger import GlobalLogger
 from lib.errors import ParamError
-from lib.location_lookup import fetch_locations
+from lib.location_lookup import (expires_at, failed_codes, fetch_locations,
+                                 resolve_locations, validate_fields)
+from lib.prewarm import prewarm
+from lib.response_encoding import (applied_encoding, dumps, encode_response,
+                                   negotiate_encoding)
 
 
 GlobalLogger.initialize_logger(__name__)
 logger = GlobalLogger.logger
 
+# state loaded once per container, see load_config and load_swagger_docs
+STARTUP = {'environment': None, 'swagger_response': None}
+
+MAX_BATCH_CODES = 5000
+
+# the routes the handler serves. Anything else is labelled 'unmatched' in
+# the request metrics, whose Route dimension only ever takes these values.
+BATCH_ROUTE = 'POST /locations/batch'
+DOCS_ROUTE = 'GET /docs/locations'
+LOCATIONS_ROUTE = 'GET /locations'
+UNMATCHED_ROUTE = 'unmatched'
+
 
 def handler(event, context):
-    load_env_file(os.environ['ENVIRONMENT'], 'config/{}.yaml')
+    # a warm-up ping only keeps the container alive
+    if event.get('warmup'):
+        return create_response(200, 'Warm')
+    if event.get('source') == 'aws.events':
+        return prewarm_handler(event, context)
+    # every request is timed by stage and logged as one metrics record
+    lib.metrics.start_request()
+    route = route_for(event)
+    response = respond(event, route)
+    lib.metrics.end_request(Route=route, StatusCode=response['statusCode'])
+    return response
+
+
+def route_for(event):
     method = event.get('httpMethod')
-    if method != 'GET':
-        return create_response(501, 'LocationsService only implements GET \
-            endpoints')
+    path = event.get('path') or ''
+    if method == 'POST' and re.match(r'\S+/locations/batch$', path):
+        return BATCH_ROUTE
+    if method == 'GET' and path == '/docs/locations':
+        return DOCS_ROUTE
+    if method == 'GET' and re.match(r'\S+/locations', path):
+        return LOCATIONS_ROUTE
+    return UNMATCHED_ROUTE
+
+
+def respond(event, route):
+    load_config(reload=bool(event.get('reloadConfig')))
     path = event.get('path')
-    if path == '/docs/locations':
-        return load_swagger_docs()
-    elif re.match(r'\S+/locations', path) is None:
+    if route == BATCH_ROUTE:
+        return batch_response(event)
+    if event.get('httpMethod') != 'GET':
+        return create_response(501, 'LocationsService only implements GET \
+            endpoints and POST /locations/batch')
+    encoding = negotiate_encoding(request_header(event, 'Accept-Encoding'))
+    if route == DOCS_ROUTE:
+        return encode_response(load_swagger_docs(), encoding)
+    elif route == UNMATCHED_ROUTE:
         return create_response(404, f"Path {path} not found")
     else:
+        params = event.get('queryStringParameters')
         try:
-            params = event.get('queryStringParameters')
-            (location_codes, fields) = parse_params(params)
+            with lib.metrics.span('parse'):
+                (location_codes, fields) = parse_params(params)
             locations_data = fetch_locations(
                 location_codes, fields)
-            return create_response(200, locations_data)
-        except ParamError:
-            return create_response(400,
-                                   'No location codes provided')
+        except ParamError as e:
+            return create_response(400, e.message)
         except Exception as e:
             logger.error(f'Received error in fetch_locations_and_respond. \
-Message: {e}', e)
+Message: {e}')
             return create_response(500,
-                                   f'Failed to fetch locations \
-{location_codes} by code')
+                                   f"Failed to fetch locations \
+{(params or {}).get('location_codes')} by code")
+        headers = partial_headers(locations_data)
+        if not headers:
+            max_age = max(0, int(expires_at(location_codes, fields) - time.time()))
+            headers['Cache-Control'] = f'public, max-age={max_age}'
+        with lib.metrics.span('serialize'):
+            return conditional_response(
+                event, create_response(200, locations_data, headers), encoding)
+
+
+# entry point for the scheduled EventBridge rule in template.yaml, which
+# refreshes every cache before traffic needs it. Returns the per-source
+# timings and sizes from lib.prewarm.prewarm.
+def prewarm_handler(event, context):
+    load_config(reload=bool(event.get('reloadConfig')))
+    return prewarm()
+
+
+# POST /locations/batch resolves every code of the body in one pass and
+# answers with the same code-keyed results as GET /locations
+def batch_response(event):
+    try:
+        with lib.metrics.span('parse'):
+            selections = parse_batch_body(event)
+        locations_data = resolve_locations(selections)
+    except ParamError as e:
+        return create_response(400, e.message)
+    except Exception as e:
+        logger.error(f'Received error in batch_response. Message: {e}')
+        return create_response(500, 'Failed to fetch locations batch')
+    headers = {'Cache-Control': 'no-store', **partial_headers(locations_data)}
+    with lib.metrics.span('serialize'):
+        return encode_response(
+            create_response(200, locations_data, headers),
+            negotiate_encoding(request_header(event, 'Accept-Encoding')))
+
+
+# codes that failed are answered alongside the ones that did not, so the
+# client only needs to retry the codes listed in X-Failed-Location-Codes
+def partial_headers(locations_data):
+    failed = failed_codes(locations_data)
+    if not failed:
+        return {}
+    return {
+        'X-Partial-Response': 'true',
+        'X-Failed-Location-Codes': ','.join(failed),
+        # a partial response must not stand in for the full one
+        'Cache-Control': 'no-store'
+    }
 
 
-def create_response(status_code=200, body=None):
+def create_response(status_code=200, body=None, headers=None):
     return {
         'statusCode': status_code,
-        'body': json.dumps(body),
+        'body': dumps(body),
         'isBase64Encoded': False,
-        'headers': {'Content-type': 'application/json'}
+        'headers': {'Content-type': 'application/json', **(headers or {})}
     }
 
 
+# tag the response with a strong ETag of its body, and answer 304 without
+# a body when the client already holds that representation. Each content
+# coding is a representation of its own, so it gets a tag of its own.
+def conditional_response(event, response, encoding=None):
+    encoding = applied_encoding(response['body'], encoding)
+    digest = hashlib.blake2b(response['body'].encode(), digest_size=16).hexdigest()
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    response['headers']['ETag'] = etag
+    response['headers']['Vary'] = 'Accept-Encoding'
+    if_none_match = request_header(event, 'If-None-Match')
+    if if_none_match is not None:
+        # If-None-Match uses the weak comparison, so W/ tags match as well
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if '*' in tags or etag in tags:
+            return {
+                'statusCode': 304,
+                'body': '',
+                'isBase64Encoded': False,
+                'headers': {name: response['headers'][name] for name in ('ETag', 'Cache-Control', 'Vary')
+                            if name in response['headers']}
+            }
+    return encode_response(response, encoding)
+
+
+def request_header(event, name):
+    name = name.lower()
+    for header, value in (event.get('headers') or {}).items():
+        if header.lower() == name:
+            return value
+    return None
+
+
 def parse_params(params):
     try:
         fields = params.get('fields')
@@ -62,21 +187,98 @@ def parse_params(params):
             fields = fields.split(',')
         location_codes = params.get('location_codes')
         location_codes = location_codes.split(',')
-        return (location_codes, fields)
     except Exception:
         raise ParamError
+    # reject fields no resolver knows before any upstream is called
+    validate_fields(fields)
+    return (location_codes, fields)
 
 
-def load_swagger_docs():
+# parse a batch body of the form
+# {
+#   "fields": ["url"],
+#   "locations": {"mab": ["hours", "location"], "sco": null}
+# }
+# into {code: fields}. "locations" may also be a plain list of codes, and
+# codes without fields of their own get "fields", which defaults to url.
+def parse_batch_body(event):
+    body = event.get('body')
     try:
-        with open('./swagger.json') as swagger_file:
-            swagger_json = json.load(swagger_file)
-            return create_response(200, swagger_json)
-    except json.JSONDecodeError as e:
-        logger.error('Failed to parse Swagger documentation')
-        logger.debug(e.message)
-        create_response(500, 'Unable to load Swagger docs from JSON')
-    except IOError as e:
-        logger.error('Unable to load swagger documentation from file')
-        logger.debug(e.message)
-        create_response(500, 'Unable to load Swagger docs from JSON')
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        request = json.loads(body)
+    except (TypeError, ValueError) as e:
+        raise ParamError(f'Invalid JSON body: {e}')
+    if not isinstance(request, dict):
+        raise ParamError('Batch body must be a JSON object')
+    default_fields = parse_fields(request.get('fields')) or ['url']
+    locations = request.get('locations')
+    if isinstance(locations, list):
+        # entries become dict keys, so they are checked before anything
+        # unhashable, e.g. a nested list, is used as one
+        for code in locations:
+            check_location_code(code)
+        locations = dict.fromkeys(locations)
+    if not isinstance(locations, dict) or not locations:
+        raise ParamError
+    if len(locations) > MAX_BATCH_CODES:
+        raise ParamError(f'At most {MAX_BATCH_CODES} location codes per batch')
+    selections = {}
+    for (code, fields) in locations.items():
+        check_location_code(code)
+        selections[code] = parse_fields(fields) or default_fields
+    validate_fields(list(dict.fromkeys(
+        field for fields in selections.values() for field in fields)))
+    return selections
+
+
+def check_location_code(code):
+    if not isinstance(code, str) or not code:
+        raise ParamError(f'Invalid location code: {json.dumps(code)}')
+
+
+# fields may be given as a comma separated string or a list of strings
+def parse_fields(fields):
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise ParamError(f'Invalid fields: {json.dumps(fields)}')
+    return fields
+
+
+# load the environment's config file into os.environ once per container.
+# Invoking the function with {"reloadConfig": true} forces a reload, and
+# with it a reload of the swagger docs.
+def load_config(reload=False):
+    environment = os.environ['ENVIRONMENT']
+    if STARTUP['environment'] == environment and not reload:
+        return
+    load_env_file(environment, 'config/{}.yaml')
+    STARTUP['environment'] = environment
+    STARTUP['swagger_response'] = None
+
+
+def load_env_file(run_type, file_string):
+    # imported here since the config helper pulls in boto3 for KMS
+    from nypl_py_utils.functions.config_helper import load_env_file
+    load_env_file(run_type, file_string)
+
+
+def load_swagger_docs():
+    # the docs response is serialized once and reused by later invocations
+    if STARTUP['swagger_response'] is None:
+        try:
+            with open('./swagger.json') as swagger_file:
+                swagger_json = json.load(swagger_file)
+                STARTUP['swagger_response'] = create_response(200, swagger_json)
+        except json.JSONDecodeError as e:
+            logger.error('Failed to parse Swagger documentation')
+            logger.debug(e)
+            return create_response(500, 'Unable to load Swagger docs from JSON')
+        except IOError as e:
+            logger.error('Unable to load swagger documentation from file')
+            logger.debug(e)
+            return create_response(500, 'Unable to load Swagger docs from JSON')
+    return dict(STARTUP['swagger_response'])
@@ -49,3 +49,25 @@ resource "aws_lambda_function" "lambda_instance" {
     }
   }
 }
+
+# Pre-warm every cache on a schedule, inside the hour the caches keep data
+# fresh for. Scheduled events carry "source": "aws.events", which
+# main.handler routes to main.prewarm_handler.
+resource "aws_cloudwatch_event_rule" "prewarm_schedule" {
+  name                = "LocationsService-${var.environment}-prewarm"
+  description         = "Refresh the nypl-core, S3, Drupal and ReCAP closure caches"
+  schedule_expression = "rate(50 minutes)"
+}
+
+resource "aws_cloudwatch_event_target" "prewarm_target" {
+  rule = aws_cloudwatch_event_rule.prewarm_schedule.name
+  arn  = aws_lambda_function.lambda_instance.arn
+}
+
+resource "aws_lambda_permission" "allow_prewarm_schedule" {
+  statement_id  = "AllowExecutionFromPrewarmSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.lambda_instance.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.prewarm_schedule.arn
+}
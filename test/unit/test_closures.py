@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from lib.closures import (Closure, ClosureIndex, apply_closures,
+                          closure_applies, closure_from_applies,
+                          merge_closures)
+from lib.schedule import compile_schedule, schedule_week
+from test.data.refinery_responses.closures import (
+    delayed_opening, early_closure, extended_closure_into_late_opening,
+    extended_closure_long, extended_closure_overlapping, extended_closure_short,
+    temp_closure_overlapping)
+
+REGULAR_HOURS = {'regular_hours': [
+    {'day': 'Monday', 'hours': '10 AM–6 PM'},
+    {'day': 'Tuesday', 'hours': '10 AM–8 PM'},
+    {'day': 'Wednesday', 'hours': '10 AM–8 PM'},
+    {'day': 'Thursday', 'hours': '10 AM–6 PM'},
+    {'day': 'Friday', 'hours': '10 AM–6 PM'},
+    {'day': 'Saturday', 'hours': '10 AM–6 PM'},
+    {'day': 'Sunday', 'hours': 'Closed'}
+]}
+
+
+def closures(*fixtures):
+    return [closure_from_applies(item) for fixture in fixtures for item in fixture]
+
+
+def at(timestamp):
+    return datetime.fromisoformat(timestamp + '-05:00')
+
+
+# the week from Tuesday 2000-01-04, with closures applied, as
+# {day: (startTime, endTime)} with times of day only
+def week_with(*fixtures):
+    current_date = datetime(2000, 1, 4).astimezone()
+    hours = apply_closures(schedule_week(compile_schedule(REGULAR_HOURS), current_date),
+                           ClosureIndex(closures(*fixtures)), current_date)
+    week = {day['day']: tuple(time and time[11:16] for time in (day['startTime'], day['endTime']))
+            for day in hours}
+    next_business_day = [day['day'] for day in hours if day.get('nextBusinessDay')]
+    return (week, next_business_day)
+
+
+REGULAR_WEEK = {'Monday': ('10:00', '18:00'), 'Tuesday': ('10:00', '20:00'),
+                'Wednesday': ('10:00', '20:00'), 'Thursday': ('10:00', '18:00'),
+                'Friday': ('10:00', '18:00'), 'Saturday': ('10:00', '18:00'),
+                'Sunday': (None, None)}
+
+
+class TestClosures:
+
+    def test_closure_applies_round_trip(self):
+        for item in extended_closure_overlapping:
+            assert closure_applies(closure_from_applies(item)) == item
+
+    def test_index_sorted_and_deduplicated(self):
+        index = ClosureIndex(closures(temp_closure_overlapping, extended_closure_short,
+                                      extended_closure_short, extended_closure_long))
+        assert len(index) == 4
+        assert index.starts == sorted(index.starts)
+        # empty intervals are dropped
+        assert len(ClosureIndex([Closure(at('2000-01-05T10:00:00'), at('2000-01-05T10:00:00'))])) == 0
+
+    def test_between(self):
+        index = ClosureIndex(closures(extended_closure_short, temp_closure_overlapping))
+        (overnight, hour, short) = index.closures
+        assert index.between(at('2000-01-05T00:00:00'), at('2000-01-06T00:00:00')) == [overnight, hour, short]
+        assert index.between(at('2000-01-05T12:00:00'), at('2000-01-05T15:00:00')) == [overnight]
+        # the window end is exclusive, as is each closure's
+        assert index.between(at('2000-01-05T14:00:00'), at('2000-01-05T18:00:00')) == []
+        assert index.between(at('2000-01-06T00:00:00'), at('2000-01-08T00:00:00')) == [short]
+        assert index.between(at('2000-01-08T00:00:00'), at('2000-01-09T00:00:00')) == []
+        assert index.between(at('1999-12-01T00:00:00'), at('1999-12-02T00:00:00')) == []
+
+    def test_between_long_closure(self):
+        # a long closure that started first still covers later windows
+        index = ClosureIndex(closures(extended_closure_long, extended_closure_short))
+        assert index.between(at('2010-01-01T00:00:00'), at('2010-01-02T00:00:00')) == \
+            closures(extended_closure_long)
+
+    def test_merge_closures(self):
+        merged = merge_closures(ClosureIndex(closures(extended_closure_overlapping)).closures)
+        assert merged == [Closure(at('2000-01-05T18:00:00'), at('2024-01-07T10:00:00'))]
+        merged = merge_closures(ClosureIndex(closures(temp_closure_overlapping, early_closure)).closures)
+        assert merged == [Closure(at('2000-01-04T20:00:00'), at('2000-01-05T14:00:00')),
+                          Closure(at('2000-01-06T14:00:00'), at('2000-01-07T10:00:00'))]
+        # adjacent closures become one
+        assert merge_closures([Closure(at('2000-01-05T10:00:00'), at('2000-01-05T12:00:00')),
+                               Closure(at('2000-01-05T12:00:00'), at('2000-01-05T13:00:00'))]) == \
+            [Closure(at('2000-01-05T10:00:00'), at('2000-01-05T13:00:00'))]
+
+    def test_apply_no_closures(self):
+        assert week_with() == (REGULAR_WEEK, ['Wednesday'])
+
+    def test_apply_closures(self):
+        # closes early Wednesday, closed Thursday, reopens as usual Friday
+        assert week_with(extended_closure_short) == (
+            dict(REGULAR_WEEK, Wednesday=('10:00', '18:00'), Thursday=(None, None)), ['Wednesday'])
+        # the hour-long closure inside the overnight one changes nothing more
+        assert week_with(temp_closure_overlapping) == (
+            dict(REGULAR_WEEK, Wednesday=('14:00', '20:00')), ['Wednesday'])
+        assert week_with(extended_closure_into_late_opening) == (
+            dict(REGULAR_WEEK, Wednesday=('10:00', '18:00'), Thursday=(None, None),
+                 Friday=('12:00', '18:00')), ['Wednesday'])
+        assert week_with(early_closure) == (dict(REGULAR_WEEK, Thursday=('10:00', '14:00')), ['Wednesday'])
+        assert week_with(delayed_opening) == (dict(REGULAR_WEEK, Friday=('12:00', '18:00')), ['Wednesday'])
+
+    def test_apply_midday_closure(self):
+        midday = [{'applies': {'start': '2000-01-05T12:00:00-05:00', 'end': '2000-01-05T13:00:00-05:00'}}]
+        assert week_with(midday) == (dict(REGULAR_WEEK, Wednesday=('10:00', '12:00')), ['Wednesday'])
+
+    def test_apply_closures_moves_next_business_day(self):
+        wednesday = [{'applies': {'start': '2000-01-05T00:00:00-05:00', 'end': '2000-01-06T00:00:00-05:00'}}]
+        assert week_with(wednesday) == (dict(REGULAR_WEEK, Wednesday=(None, None)), ['Thursday'])
+        # closed from Wednesday evening on
+        assert week_with(extended_closure_overlapping) == (
+            dict(dict.fromkeys(REGULAR_WEEK, (None, None)), Tuesday=('10:00', '20:00'),
+                 Wednesday=('10:00', '18:00')), ['Wednesday'])
+        # closed all week, so there is no next business day
+        assert week_with(extended_closure_long) == (dict.fromkeys(REGULAR_WEEK, (None, None)), [])
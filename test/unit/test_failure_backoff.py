@@ -0,0 +1,39 @@
+import pytest
+from freezegun import freeze_time
+
+from lib.failure_backoff import FailureBackoff
+
+
+class TestFailureBackoff:
+
+    def test_call_remembers_failure(self):
+        backoff = FailureBackoff(30)
+        calls = []
+
+        def fail(key):
+            calls.append(key)
+            raise ValueError(f'{key} is down')
+        with freeze_time('2000-01-01 00:00:00') as frozen_time:
+            for _ in range(3):
+                with pytest.raises(ValueError, match='ma is down'):
+                    backoff.call('ma', fail)
+            assert calls == ['ma']
+            assert backoff.in_backoff('ma')
+            assert not backoff.in_backoff('sc')
+            frozen_time.tick(30)
+            assert not backoff.in_backoff('ma')
+            assert backoff.call('ma', lambda key: key.upper()) == 'MA'
+        assert 'ma' not in backoff
+
+    def test_record_and_forget_many(self):
+        backoff = FailureBackoff(30)
+        error = backoff.record(['ma', 'sc'], ValueError('batch failed'))
+        for key in ['ma', 'sc']:
+            with pytest.raises(ValueError) as raised:
+                backoff.check(key)
+            assert raised.value is error
+        backoff.forget(['ma'])
+        backoff.check('ma')
+        assert backoff.in_backoff('sc')
+        backoff.clear()
+        assert 'sc' not in backoff
@@ -20,9 +20,12 @@ class TestHelpers:
         for key, value in cls.ENV_VARS.items():
             os.environ[key] = value
 
+    # set by config/{environment}.yaml, never wanted in unit tests
+    CONFIG_VARS = ['SNAPSHOT_DIR']
+
     @classmethod
     def clear_env_vars(cls):
-        for key in cls.ENV_VARS.keys():
+        for key in list(cls.ENV_VARS.keys()) + cls.CONFIG_VARS:
             if key in os.environ:
                 del os.environ[key]
 
@@ -0,0 +1,82 @@
+import os
+import pytest
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from unittest.mock import patch
+
+import lib.http_client
+import lib.metrics
+from lib.http_client import get, session_for, upstream_timeout
+from test.unit.test_helpers import TestHelpers
+
+
+class TestHttpClient:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.tear_down()
+
+    def setup_method(self):
+        lib.metrics.reset()
+
+    def test_session_per_host(self):
+        drupal = session_for('https://drupalapi.net/jsonapi/node/library')
+        assert session_for('https://drupalapi.net/?page[offset]=50') is drupal
+        assert session_for('https://example.com/by_sierra_location.json') is not drupal
+
+    def test_upstream_timeout(self):
+        assert upstream_timeout('drupal') == lib.http_client.UPSTREAM_TIMEOUTS['drupal']
+        os.environ['DRUPAL_TIMEOUT'] = '1,2.5'
+        try:
+            assert upstream_timeout('drupal') == (1.0, 2.5)
+        finally:
+            del os.environ['DRUPAL_TIMEOUT']
+
+    @patch('lib.http_client.time.sleep')
+    def test_get_retries_retryable_status(self, mock_sleep, requests_mock):
+        requests_mock.get('https://drupalapi.net/', [
+            {'status_code': 503}, {'status_code': 200, 'json': {'data': []}}])
+        response = get('https://drupalapi.net/', 'drupal')
+        assert response.json() == {'data': []}
+        assert requests_mock.call_count == 2
+        assert mock_sleep.call_count == 1
+        metrics = lib.metrics.snapshot()
+        assert metrics['counters']['http.drupal.retries'] == 1
+        assert metrics['timings']['http.drupal']['count'] == 2
+
+    @patch('lib.http_client.time.sleep')
+    def test_get_does_not_retry_client_errors(self, mock_sleep, requests_mock):
+        requests_mock.get('https://drupalapi.net/', status_code=404)
+        assert get('https://drupalapi.net/', 'drupal').status_code == 404
+        assert requests_mock.call_count == 1
+
+    @patch('lib.http_client.time.sleep')
+    def test_get_gives_up_after_max_retries(self, mock_sleep, requests_mock):
+        requests_mock.get('https://drupalapi.net/', exc=ConnectionError)
+        with pytest.raises(ConnectionError):
+            get('https://drupalapi.net/', 'drupal')
+        assert requests_mock.call_count == lib.http_client.MAX_RETRIES + 1
+        assert lib.metrics.snapshot()['counters']['http.drupal.errors'] == \
+            lib.http_client.MAX_RETRIES + 1
+
+    @patch('lib.http_client.time.sleep')
+    def test_get_does_not_retry_read_timeouts(self, mock_sleep, requests_mock):
+        requests_mock.get('https://drupalapi.net/', exc=ReadTimeout)
+        with pytest.raises(ReadTimeout):
+            get('https://drupalapi.net/', 'drupal')
+        assert requests_mock.call_count == 1
+        requests_mock.get('https://drupalapi.net/', [{'exc': ConnectTimeout}, {'status_code': 200}])
+        assert get('https://drupalapi.net/', 'drupal').status_code == 200
+
+    @patch('lib.http_client.time.sleep')
+    def test_get_retries_within_deadline(self, mock_sleep, requests_mock):
+        requests_mock.get('https://drupalapi.net/', status_code=503)
+        with patch('lib.http_client.time.monotonic', side_effect=[0, 0, 1, 4.4, 5.6]):
+            assert get('https://drupalapi.net/', 'drupal').status_code == 503
+        # the second attempt only had what was left of the deadline, and no
+        # time was left for a third
+        assert requests_mock.call_count == 2
+        assert requests_mock.request_history[0].timeout == lib.http_client.UPSTREAM_TIMEOUTS['drupal']
+        assert requests_mock.request_history[1].timeout == pytest.approx((1.6, 1.6))
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+# modules that must only be imported once an invocation needs them
+HEAVY_MODULES = ['boto3', 'botocore', 'requests', 'urllib3', 'dateutil',
+                 'nypl_py_utils.classes', 'nypl_py_utils.functions.config_helper']
+
+# cumulative import time budget for main, in milliseconds
+IMPORT_TIME_BUDGET_MS = 150
+
+
+class TestImportTime:
+
+    def import_times(self):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import main'],
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+            capture_output=True, text=True, check=True)
+        times = {}
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            columns = line.split('|')
+            if len(columns) == 3 and columns[1].strip().isdigit():
+                times[columns[2].strip()] = int(columns[1])
+        return times
+
+    def test_import_time_budget(self):
+        # the first run may compile bytecode, so measure the second
+        self.import_times()
+        times = self.import_times()
+        heavy = [module for module in times
+                 if any(module == heavy or module.startswith(heavy + '.') for heavy in HEAVY_MODULES)]
+        assert heavy == []
+        assert times['main'] / 1000 < IMPORT_TIME_BUDGET_MS
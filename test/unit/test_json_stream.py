@@ -0,0 +1,53 @@
+import json
+import pytest
+
+from lib.json_stream import iter_object_items
+
+document = {
+    'mal': {'label': 'Schwarzman Building - Main Reading Room 315',
+            'codes': [1, 22, 333]},
+    'pam': {'label': 'Performing Arts – Music', 'note': 'say "hi"'},
+    'count': 123456789,
+    'ratio': 1.5,
+    'scale': 12e3,
+    'offset': -0.25E-2,
+    'empty': {},
+    'missing': None
+}
+
+
+class TestJsonStream:
+
+    def chunked(self, body, size):
+        return [body[i:i + size] for i in range(0, len(body), size)]
+
+    def test_iter_object_items(self):
+        body = json.dumps(document, ensure_ascii=False, indent=2).encode()
+        # chunk boundaries may split tokens, numbers and multi-byte characters
+        for size in [1, 2, 3, 7, 64, len(body)]:
+            assert dict(iter_object_items(self.chunked(body, size))) == document
+
+    def test_iter_object_items_numbers_split_at_chunk_end(self):
+        for chunks in [[b'{"a":1.', b'5}'], [b'{"a":12e', b'3}'], [b'{"a":1', b'2.5e-', b'1}']]:
+            assert dict(iter_object_items(chunks)) == json.loads(b''.join(chunks))
+
+    def test_iter_object_items_str_chunks(self):
+        body = json.dumps(document)
+        assert list(iter_object_items(self.chunked(body, 5))) == list(document.items())
+
+    def test_iter_object_items_is_lazy(self):
+        def chunks():
+            yield b'{"mal": "SASB",'
+            raise AssertionError('read past the first pair')
+        items = iter_object_items(chunks())
+        assert next(items) == ('mal', 'SASB')
+
+    def test_empty_object(self):
+        assert list(iter_object_items([b' {', b' } '])) == []
+
+    @pytest.mark.parametrize('body', [
+        b'', b'[1, 2]', b'{"mal": 1', b'{"mal" 1}', b'{1: 2}', b'{"a": 1 "b": 2}',
+        b'{"a": 1}garbage', b'{} {}', b'{"a": 1}\n ,'])
+    def test_invalid_documents(self, body):
+        with pytest.raises(ValueError):
+            list(iter_object_items(self.chunked(body, 3)))
@@ -2,8 +2,16 @@ from datetime import datetime, timedelta
 import json
 import os
 from freezegun import freeze_time
+import pytest
 
-from lib.location_api import parse_hours, parse_address, get_location_data
+import lib.location_api
+import lib.metrics
+import lib.shared_cache
+from lib.errors import RefineryApiError
+from lib.location_api import (parse_address, get_location_data,
+                              get_location_by_code, prefetch_location_data,
+                              get_location_hours, ingest_location)
+from unittest.mock import patch
 from test.unit.test_helpers import TestHelpers
 
 
@@ -22,69 +30,17 @@ class TestLocationApi:
         TestHelpers.clear_env_vars()
         TestHelpers.tear_down()
 
+    def setup_method(self):
+        lib.location_api.CACHE.clear()
+        lib.location_api.HOURS_CACHE['hours'] = {}
+        lib.location_api.FAILURES.clear()
+        lib.location_api.PRELOAD_FAILURES.clear()
+
     def fetch_data_success(code):
         with open(f'test/data/drupal_responses/{code}.json',
                   'r') as file:
             return json.load(file)
 
-    def test_parse_hours(self):
-        monday = {
-            "day": "Monday",
-            "hours": "10 AM–6 PM"
-        }
-        current_date = datetime(2000, 1, 1).astimezone()  # this is a saturday
-        parsed = parse_hours(current_date, monday)
-        assert parsed['day'] == 'Monday'
-        assert parsed['startTime'] == '2000-01-03T10:00:00-05:00'
-        assert parsed['endTime'] == '2000-01-03T18:00:00-05:00'
-
-    def test_parse_hours_with_minutes(self):
-        monday = {
-            "day": "Monday",
-            "hours": "10:23 AM–6:17 PM"
-        }
-        current_date = datetime(2000, 1, 1).astimezone()  # this is a saturday
-        parsed = parse_hours(current_date, monday)
-        assert parsed['day'] == 'Monday'
-        assert parsed['startTime'] == '2000-01-03T10:23:00-05:00'
-        assert parsed['endTime'] == '2000-01-03T18:17:00-05:00'
-
-    def test_parse_hours_today(self):
-        day = {
-            "day": "Saturday",
-            "hours": "10 AM–6 PM"
-        }
-        current_date = datetime(2000, 1, 1).astimezone()  # this is a saturday
-        parsed = parse_hours(current_date, day)
-        assert parsed['day'] == 'Saturday'
-        assert parsed['startTime'] == '2000-01-01T10:00:00-05:00'
-        assert parsed['endTime'] == '2000-01-01T18:00:00-05:00'
-        assert parsed['today']
-
-    def test_parse_hours_midnight(self):
-        day = {
-            "day": "Saturday",
-            "hours": "12 AM–12 PM"
-        }
-        current_date = datetime(2000, 1, 1).astimezone()  # this is a saturday
-        parsed = parse_hours(current_date, day)
-        assert parsed['day'] == 'Saturday'
-        assert parsed['startTime'] == '2000-01-01T00:00:00-05:00'
-        assert parsed['endTime'] == '2000-01-01T12:00:00-05:00'
-        assert parsed['today']
-
-    def test_parse_hours_noon(self):
-        day = {
-            "day": "Saturday",
-            "hours": "12 PM–8 PM"
-        }
-        current_date = datetime(2000, 1, 1).astimezone()  # this is a saturday
-        parsed = parse_hours(current_date, day)
-        assert parsed['day'] == 'Saturday'
-        assert parsed['startTime'] == '2000-01-01T12:00:00-05:00'
-        assert parsed['endTime'] == '2000-01-01T20:00:00-05:00'
-        assert parsed['today']
-
     def test_parse_address(self):
         address_data = {
             "langcode": "en",
@@ -132,3 +88,205 @@ class TestLocationApi:
                 correct_next_business_day = True
         assert correct_today
         assert correct_next_business_day
+
+    def drupal_nodes(*codes):
+        node = TestLocationApi.fetch_data_success('ma')['data'][0]
+        nodes = []
+        for code in codes:
+            attributes = dict(node['attributes'], field_ts_location_code=code)
+            nodes.append(dict(node, attributes=attributes))
+        return {'data': nodes}
+
+    def test_prefetch_location_data(self, requests_mock):
+        lib.location_api.CACHE.clear()
+        batch = requests_mock.get(
+            os.environ['DRUPAL_API_BASE_URL'] + '?filter[code][condition][operator]=IN',
+            json=TestLocationApi.drupal_nodes('ma', 'sc'))
+        prefetch_location_data(['mab', 'mal', 'ma', 'rc', 'sc', 'scf', 'xx'])
+        # codes sharing a parent location are requested once, in one query
+        assert batch.call_count == 1
+        assert batch.last_request.qs['filter[code][condition][value][]'] == \
+            ['ma', 'sc', 'xx']
+        assert 'location_hours' in batch.last_request.qs['fields[node--library]'][0]
+        # the batch response fills the per-code cache, including misses
+        assert get_location_by_code('sc')['field_ts_location_code'] == 'sc'
+        assert get_location_by_code('xx') is None
+        prefetch_location_data(['mab', 'sco'])
+        assert batch.call_count == 1
+        lib.location_api.CACHE.clear()
+
+    def test_prefetch_failure_backs_off(self, requests_mock):
+        batch = requests_mock.get(
+            os.environ['DRUPAL_API_BASE_URL'] + '?filter[code][condition][operator]=IN',
+            status_code=403)
+        single = requests_mock.get(
+            os.environ['DRUPAL_API_BASE_URL'] + '?filter[field_ts_location_code]=sc',
+            json=TestLocationApi.drupal_nodes('sc'))
+        with freeze_time('2024-01-01 12:00:00') as frozen_time:
+            # a failed batch is not raised, and its codes fail fast afterwards
+            prefetch_location_data(['mab', 'sco'])
+            prefetch_location_data(['mab', 'sco'])
+            assert batch.call_count == 1
+            with pytest.raises(RefineryApiError) as error:
+                get_location_data('sco', ['location'])
+            assert 'sc' in error.value.message
+            assert single.call_count == 0
+            frozen_time.tick(lib.location_api.DRUPAL_FAILURE_BACKOFF)
+            assert get_location_data('sco', ['location']) is not None
+            assert single.call_count == 1
+            assert 'sc' not in lib.location_api.FAILURES
+
+    def test_hours_expires_at(self):
+        with freeze_time('2024-01-01 23:30:00'):
+            assert lib.location_api.hours_expires_at() == \
+                datetime(2024, 1, 2).astimezone().timestamp()
+
+    def test_prefetch_from_shared_cache(self, requests_mock):
+        os.environ['SHARED_CACHE_BACKEND'] = 'memory'
+        try:
+            batch = requests_mock.get(
+                os.environ['DRUPAL_API_BASE_URL'] + '?filter[code][condition][operator]=IN',
+                json=TestLocationApi.drupal_nodes('ma', 'sc'))
+            prefetch_location_data(['mab', 'sco'])
+            assert batch.call_count == 1
+            # a new container finds what the first one fetched
+            lib.location_api.CACHE.clear()
+            prefetch_location_data(['mab', 'sco'])
+            assert batch.call_count == 1
+            assert get_location_data('sco', ['location'])['location'] is not None
+        finally:
+            del os.environ['SHARED_CACHE_BACKEND']
+            lib.shared_cache.BACKENDS.clear()
+
+    def test_refresh_locations(self, requests_mock):
+        batch = requests_mock.get(
+            os.environ['DRUPAL_API_BASE_URL'] + '?filter[code][condition][operator]=IN',
+            json=TestLocationApi.drupal_nodes('ma', 'sc'))
+        catalog = requests_mock.get(os.environ['DRUPAL_API_BASE_URL'] + '?page[limit]=50',
+                                    json=TestLocationApi.drupal_nodes('ma', 'sc', 'lpa'))
+        # nothing cached yet, so the whole catalog is loaded
+        assert lib.location_api.refresh_locations() == 3
+        assert catalog.call_count == 1
+        # fresh entries are fetched again all the same
+        lib.location_api.CACHE.clear()
+        lib.location_api.CACHE.update({'ma': None, 'sc': None})
+        assert lib.location_api.refresh_locations() == 2
+        assert batch.call_count == 1
+        assert get_location_by_code('sc')['field_ts_location_code'] == 'sc'
+        lib.location_api.PRELOAD['loaded_at'] = None
+
+    def test_prefetch_waits_once_for_leased_codes(self, requests_mock):
+        os.environ['SHARED_CACHE_BACKEND'] = 'memory'
+        lib.location_api.CACHE.clear()
+        try:
+            batch = requests_mock.get(
+                os.environ['DRUPAL_API_BASE_URL'] + '?filter[code][condition][operator]=IN',
+                json=TestLocationApi.drupal_nodes('lpa'))
+            # another container is fetching all three, and stores two of them
+            holder = lib.shared_cache.SharedCache('drupal', lib.location_api.DRUPAL_CACHE_TTL)
+            assert holder.acquire_many(['ma', 'sc', 'lpa']) == ['ma', 'sc', 'lpa']
+
+            def sleep(seconds):
+                holder.set_many({'ma': None, 'sc': None})
+            with patch('lib.shared_cache.LEASE_WAIT', 0.2), \
+                    patch('lib.shared_cache.time.sleep', side_effect=sleep) as mock_sleep:
+                prefetch_location_data(['mab', 'sco', 'pat'])
+                waits = mock_sleep.call_count
+                # what was not stored in time is fetched in a single batch
+                assert batch.call_count == 1
+                assert batch.last_request.qs['filter[code][condition][value][]'] == ['lpa']
+                for code in ['mab', 'sco', 'pat']:
+                    get_location_data(code, ['location'])
+                # and no lookup waits on the leases again
+                assert mock_sleep.call_count == waits
+                assert batch.call_count == 1
+        finally:
+            del os.environ['SHARED_CACHE_BACKEND']
+            lib.shared_cache.BACKENDS.clear()
+            lib.location_api.CACHE.clear()
+
+    def test_preload_locations(self, requests_mock):
+        lib.location_api.CACHE.clear()
+        lib.metrics.reset()
+        os.environ['DRUPAL_PRELOAD'] = 'true'
+        first_page = TestLocationApi.drupal_nodes('ma', 'sc')
+        first_page['links'] = {'next': {'href': 'https://drupalapi.net/?page[offset]=2'}}
+        first = requests_mock.get(os.environ['DRUPAL_API_BASE_URL'] + '?page[limit]=50',
+                                  json=first_page)
+        second = requests_mock.get(os.environ['DRUPAL_API_BASE_URL'] + '?page[offset]=2',
+                                   json=TestLocationApi.drupal_nodes('lpa'))
+        try:
+            get_location_data('pat', ['location'])
+            get_location_data('mab', ['location'])
+            prefetch_location_data(['sc', 'xx'])
+            assert get_location_data('xx', ['location']) is None
+            # the catalog is paged through once and serves every lookup
+            assert first.call_count == 1
+            assert second.call_count == 1
+            assert sorted(lib.location_api.CACHE) == ['lpa', 'ma', 'sc']
+            assert lib.metrics.snapshot()['timings']['drupal.preload']['count'] == 1
+        finally:
+            del os.environ['DRUPAL_PRELOAD']
+            lib.location_api.PRELOAD['loaded_at'] = None
+            lib.location_api.CACHE.clear()
+
+    @patch('lib.http_client.time.sleep')
+    def test_failed_preload_refresh_backs_off(self, mock_sleep, monkeypatch, requests_mock):
+        monkeypatch.setenv('DRUPAL_PRELOAD', 'true')
+        catalog = requests_mock.get(os.environ['DRUPAL_API_BASE_URL'] + '?page[limit]=50',
+                                    json=TestLocationApi.drupal_nodes('ma', 'sc', 'lpa'))
+        try:
+            with freeze_time('2024-01-01 12:00:00') as frozen_time:
+                prefetch_location_data(['mab'])
+                frozen_time.tick(lib.location_api.DEFAULT_DRUPAL_PRELOAD_INTERVAL + 1)
+                catalog = requests_mock.get(os.environ['DRUPAL_API_BASE_URL'] + '?page[limit]=50',
+                                            status_code=503)
+                for code in ['mab', 'sco', 'pat', 'maf']:
+                    prefetch_location_data([code])
+                    assert get_location_data(code, ['location']) is not None
+                # one failed refresh, with its retries, while the old catalog serves
+                assert catalog.call_count == lib.http_client.MAX_RETRIES + 1
+                frozen_time.tick(lib.location_api.DRUPAL_FAILURE_BACKOFF)
+                prefetch_location_data(['mab'])
+                assert catalog.call_count == 2 * (lib.http_client.MAX_RETRIES + 1)
+        finally:
+            lib.location_api.PRELOAD['loaded_at'] = None
+
+    def test_get_location_hours_memoized(self):
+        location_data = ingest_location(
+            TestLocationApi.fetch_data_success('ma')['data'][0]['attributes'])
+        with patch('lib.location_api.schedule_week',
+                   wraps=lib.location_api.schedule_week) as mock_build_hours:
+            with freeze_time(datetime(2000, 1, 1, 9)):
+                hours = get_location_hours('ma', location_data)
+                assert get_location_hours('ma', location_data) == hours
+                assert mock_build_hours.call_count == 1
+                # callers get their own copy
+                hours[0]['day'] = 'Someday'
+                assert get_location_hours('ma', location_data)[0]['day'] != 'Someday'
+                # a new Drupal revision is computed again
+                get_location_hours('ma', dict(location_data, changed='2025-08-23T00:00:00+00:00'))
+                assert mock_build_hours.call_count == 2
+            with freeze_time(datetime(2000, 1, 2, 9)):
+                # and so is every location once the date rolls over
+                rolled_over = get_location_hours('ma', location_data)
+                assert mock_build_hours.call_count == 3
+                assert rolled_over != hours
+
+    def test_ingest_location(self):
+        attributes = TestLocationApi.fetch_data_success('ma')['data'][0]['attributes']
+        location = ingest_location(attributes)
+        assert sorted(location) == ['changed', 'field_as_address', 'field_ts_location_code', 'schedule']
+        assert location['schedule'].days[0] == ('Monday', 0, None, None)
+        assert location['schedule'].days[1] == ('Tuesday', 1, 600, 1200)
+
+    @freeze_time(datetime(2000, 1, 1))
+    def test_get_location_data_unparseable_hours(self, requests_mock):
+        drupal_data = TestLocationApi.fetch_data_success('ma')
+        drupal_data['data'][0]['attributes']['location_hours']['upcoming_hours'][1]['hours'] = 'Noon to 6'
+        requests_mock.get(os.environ['DRUPAL_API_BASE_URL'] + '?filter[field_ts_location_code]=ma',
+                          json=drupal_data)
+        # the address is still served when the hours cannot be parsed
+        location_data = get_location_data('ma', ['hours', 'location'])
+        assert location_data['hours'] is None
+        assert location_data['location']['city'] == 'New York'
@@ -1,4 +1,24 @@
-from lib.location_lookup import build_location_info, fetch_locations
+import io
+from datetime import datetime
+import json
+import os
+import time
+
+import boto3
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from freezegun import freeze_time
+
+import pytest
+
+import lib.location_api
+import lib.location_lookup
+from lib.errors import ParamError, RefineryApiError
+from lib.closures import ClosureIndex, closure_from_applies
+from lib.rc_alerts import RCAlertsError
+from lib.location_lookup import (build_location_info, fetch_locations,
+                                 check_cache_or_fetch_s3, expires_at,
+                                 failed_codes, resolve_locations)
 from test.unit.test_helpers import TestHelpers
 
 from unittest.mock import patch
@@ -14,6 +34,9 @@ location_data = {
     'location': 'a location'
 }
 
+closures = [{'applies': {'start': '2023-12-18T00:00:00-05:00',
+                         'end': '2023-12-21T00:00:00-05:00'}}]
+
 
 class TestLocationLogic:
     @classmethod
@@ -40,13 +63,14 @@ class TestLocationLogic:
         assert build_location_info('xma99', ['location']) \
             == [{'code': None, 'label': 'label', 'location': 'a location'}]
 
+    @patch('lib.location_lookup.prefetch_location_data')
     @patch('lib.location_lookup.get_location_data', return_value=location_data)
     @patch('lib.location_lookup.check_cache_or_fetch_s3',
            return_value=s3_locations)
     @patch('lib.nypl_core.sierra_location_by_code',
            return_value={})
     def test_fetch_locations_no_label(self, MockNyplCore, MockS3,
-                                      MockRefinery):
+                                      MockRefinery, MockPrefetch):
         fields = ['location', 'hours', 'url']
         location_codes = ['mab', 'sco', 'myq']
         assert fetch_locations(location_codes, fields) == \
@@ -74,12 +98,14 @@ class TestLocationLogic:
                 }]
         }
 
+    @patch('lib.location_lookup.prefetch_location_data')
     @patch('lib.location_lookup.get_location_data', return_value=location_data)
     @patch('lib.location_lookup.check_cache_or_fetch_s3',
            return_value=s3_locations)
     @patch('lib.nypl_core.sierra_location_by_code',
            return_value={'label': 'label'})
-    def test_fetch_locations(self, MockNyplCore, MockS3, MockRefinery):
+    def test_fetch_locations(self, MockNyplCore, MockS3, MockRefinery,
+                             MockPrefetch):
         fields = ['location', 'hours', 'url']
         location_codes = ['mab', 'sco', 'myq']
         assert fetch_locations(location_codes, fields) == \
@@ -106,14 +132,16 @@ class TestLocationLogic:
                     'label': 'label'
                 }]
         }
+        MockPrefetch.assert_called_once_with(location_codes)
 
+    @patch('lib.location_lookup.prefetch_location_data')
     @patch('lib.location_lookup.get_location_data', return_value=location_data)
     @patch('lib.location_lookup.check_cache_or_fetch_s3',
            return_value=s3_locations)
     @patch('lib.nypl_core.sierra_location_by_code',
            return_value={'label': 'label anyway'})
     def test_fetch_locations_code_not_in_s3(self, MockNyplCore, MockS3,
-                                            MockRefinery):
+                                            MockRefinery, MockPrefetch):
         fields = ['url']
         location_codes = ['xxx']
         assert fetch_locations(location_codes, fields) == \
@@ -124,3 +152,259 @@ class TestLocationLogic:
                     'label': 'label anyway'
                 }]
         }
+        # url only requests never need Drupal data
+        MockPrefetch.assert_not_called()
+
+    def stubbed_s3(self):
+        client = boto3.client('s3', region_name='us-east-1')
+        return (client, Stubber(client))
+
+    def s3_response(self, mapping, etag):
+        body = json.dumps(mapping).encode()
+        return {'Body': StreamingBody(io.BytesIO(body), len(body)),
+                'ETag': etag}
+
+    def test_check_cache_or_fetch_s3(self):
+        lib.location_lookup.S3_CACHE.clear()
+        (client, stubber) = self.stubbed_s3()
+        updated_locations = dict(s3_locations, **{'pa*': 'lpa.com'})
+        stubber.add_response('get_object', self.s3_response(s3_locations, '"v1"'),
+                             {'Bucket': 'bucket', 'Key': 'file'})
+        # an unchanged object answers 304 without a body
+        stubber.add_client_error('get_object', service_error_code='304',
+                                 http_status_code=304,
+                                 expected_params={'Bucket': 'bucket', 'Key': 'file',
+                                                  'IfNoneMatch': '"v1"'})
+        stubber.add_response('get_object', self.s3_response(updated_locations, '"v2"'),
+                             {'Bucket': 'bucket', 'Key': 'file', 'IfNoneMatch': '"v1"'})
+        with patch('lib.location_lookup.s3_client', return_value=client), stubber:
+            with freeze_time('2000-01-01 00:00:00'):
+                mapping = check_cache_or_fetch_s3()
+                assert mapping == s3_locations
+                assert check_cache_or_fetch_s3() is mapping
+            with freeze_time('2000-01-01 01:30:00'):
+                # the expired mapping is served while the refresh runs
+                assert check_cache_or_fetch_s3() is mapping
+                lib.location_lookup.S3_CACHE.join()
+                assert check_cache_or_fetch_s3() is mapping
+            with freeze_time('2000-01-01 03:00:00'):
+                assert check_cache_or_fetch_s3() is mapping
+                lib.location_lookup.S3_CACHE.join()
+                assert check_cache_or_fetch_s3() == updated_locations
+            stubber.assert_no_pending_responses()
+        lib.location_lookup.S3_CACHE.clear()
+
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_s3_failure_backs_off(self, MockNyplCore):
+        lib.location_lookup.S3_CACHE.clear()
+        lib.location_lookup.S3_FAILURES.clear()
+        codes = ['mab', 'sco', 'myq', 'lpa', 'mal']
+        try:
+            with patch('lib.location_lookup.fetch_s3', side_effect=RefineryApiError('S3 is down')) as MockFetch:
+                locations = fetch_locations(codes, ['url'])
+            # one S3 call, whose error every code reports
+            assert MockFetch.call_count == 1
+            assert failed_codes(locations) == codes
+            assert all(locations[code][0]['errors'] == [{'source': 's3', 'message': 'S3 is down'}]
+                       for code in codes)
+        finally:
+            lib.location_lookup.S3_FAILURES.clear()
+
+    @patch('lib.location_lookup.prefetch_location_data')
+    @patch('lib.location_lookup.build_location_info', return_value=[{'code': 'mab'}])
+    def test_fetch_locations_deduplicates_codes(self, MockBuild, MockPrefetch):
+        assert fetch_locations(['mab', 'mab', 'sco', 'mab'], ['hours']) == \
+            {'mab': [{'code': 'mab'}], 'sco': [{'code': 'mab'}]}
+        assert MockBuild.call_count == 2
+        MockPrefetch.assert_called_once_with(['mab', 'sco'])
+
+    @patch('lib.location_lookup.prefetch_location_data')
+    @patch('lib.location_lookup.get_location_data', return_value=location_data)
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value=s3_locations)
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_resolve_locations(self, MockNyplCore, MockS3, MockRefinery, MockPrefetch):
+        assert resolve_locations({'mab': ['hours'], 'sco': ['url'], 'myq': ['location', 'url']}) == {
+            'mab': [{'code': 'mab', 'label': 'label', 'hours': 'some hours'}],
+            'sco': [{'code': 'sco', 'label': 'label', 'url': 'schom.com'}],
+            'myq': [{'code': 'myq', 'label': 'label', 'location': 'a location', 'url': 'lpa.com'}]
+        }
+        # one prefetch, for the codes whose fields need Drupal
+        MockPrefetch.assert_called_once_with(['mab', 'myq'])
+        with pytest.raises(ParamError) as error:
+            resolve_locations({'mab': ['hours'], 'sco': ['parking']})
+        assert error.value.message == 'Unknown fields: parking'
+
+    @freeze_time('2023-12-19 12:00:00')
+    @patch('lib.location_lookup.RCAlerts.get_alerts',
+           return_value=ClosureIndex([closure_from_applies(closure) for closure in closures]))
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value={'rc*': 'recap.com', **s3_locations})
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_fetch_locations_closures(self, MockNyplCore, MockS3, MockClosures):
+        assert fetch_locations(['rc', 'rcma2', 'mab'], ['url', 'closures']) == {
+            'rc': [{'code': 'rc', 'label': 'ReCAP', 'url': 'recap.com', 'closures': closures}],
+            'rcma2': [{'code': 'rcma2', 'label': 'label', 'url': 'recap.com', 'closures': closures}],
+            # only ReCAP codes have closures
+            'mab': [{'code': 'mab', 'label': 'label', 'url': 'sasb.com'}]
+        }
+        MockClosures.side_effect = RCAlertsError('feed is down')
+        assert fetch_locations(['rc'], ['closures']) == {'rc': [{
+            'code': 'rc', 'label': 'ReCAP',
+            'errors': [{'source': 'rc_alerts', 'message': 'feed is down'}]}]}
+
+    @freeze_time('2023-12-19 12:00:00')
+    @patch('lib.location_lookup.prefetch_location_data')
+    @patch('lib.location_lookup.RCAlerts.get_alerts',
+           return_value=ClosureIndex([closure_from_applies(closure) for closure in closures]))
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value={'rc*': 'recap.com', **s3_locations})
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_fetch_locations_hours_with_closures(self, MockNyplCore, MockS3, MockClosures, MockPrefetch):
+        # Tuesday; ReCAP is closed through Wednesday
+        def hours(code, fields):
+            return {'hours': [
+                {'day': 'Tuesday', 'startTime': '2023-12-19T10:00:00-05:00',
+                 'endTime': '2023-12-19T18:00:00-05:00', 'today': True},
+                {'day': 'Wednesday', 'startTime': '2023-12-20T10:00:00-05:00',
+                 'endTime': '2023-12-20T18:00:00-05:00', 'nextBusinessDay': True},
+                {'day': 'Thursday', 'startTime': '2023-12-21T10:00:00-05:00',
+                 'endTime': '2023-12-21T18:00:00-05:00'}]}
+        with patch('lib.location_lookup.get_location_data', side_effect=hours):
+            locations = fetch_locations(['rcma2', 'mab'], ['hours'])
+        assert locations['rcma2'][0]['hours'] == [
+            {'day': 'Tuesday', 'startTime': None, 'endTime': None, 'today': True},
+            {'day': 'Wednesday', 'startTime': None, 'endTime': None},
+            {'day': 'Thursday', 'startTime': '2023-12-21T10:00:00-05:00',
+             'endTime': '2023-12-21T18:00:00-05:00', 'nextBusinessDay': True}]
+        # other locations' hours are left alone
+        assert locations['mab'][0]['hours'] == hours('mab', ['hours'])['hours']
+
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value=s3_locations)
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_url_never_touches_drupal(self, MockNyplCore, MockS3, requests_mock):
+        lib.location_api.CACHE.clear()
+        with patch('lib.location_lookup.get_location_data',
+                   wraps=lib.location_lookup.get_location_data) as MockDrupal:
+            assert fetch_locations(['mab', 'sco'], ['url']) == {
+                'mab': [{'code': 'mab', 'label': 'label', 'url': 'sasb.com'}],
+                'sco': [{'code': 'sco', 'label': 'label', 'url': 'schom.com'}]
+            }
+            MockDrupal.assert_not_called()
+        # requests_mock fails any unregistered request, so none were made
+        assert requests_mock.call_count == 0
+
+    @patch('lib.location_lookup.prefetch_location_data')
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value=s3_locations)
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_label_only_skips_drupal(self, MockNyplCore, MockS3, MockPrefetch):
+        # the DFE still reads code, which comes from the S3 mapping
+        assert fetch_locations(['mab', 'xxx'], ['label']) == {
+            'mab': [{'code': 'mab', 'label': 'label'}],
+            'xxx': [{'code': None, 'label': 'label'}]
+        }
+        MockPrefetch.assert_not_called()
+        with freeze_time('2024-01-01 12:00:00'):
+            lib.location_lookup.S3_CACHE.set('locations', {'data': s3_locations}, notify=False)
+            try:
+                assert expires_at(['mab'], ['label']) == time.time() + lib.location_lookup.S3_CACHE_TTL
+            finally:
+                lib.location_lookup.S3_CACHE.clear()
+
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value=s3_locations)
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_address_still_accepted(self, MockNyplCore, MockS3, requests_mock):
+        # address is accepted and, as it always has been, adds nothing
+        assert fetch_locations(['mab'], ['address']) == {'mab': [{'code': 'mab', 'label': 'label'}]}
+        assert requests_mock.call_count == 0
+
+    @patch('lib.location_lookup.prefetch_location_data')
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value=s3_locations)
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_fetch_locations_isolates_failures(self, MockNyplCore, MockS3, MockPrefetch):
+        def drupal(code, fields):
+            if code == 'sco':
+                raise RefineryApiError('Drupal is down')
+            return location_data
+        with patch('lib.location_lookup.get_location_data', side_effect=drupal):
+            locations = fetch_locations(['mab', 'sco'], ['url', 'hours'])
+        assert locations['mab'] == [{'code': 'mab', 'label': 'label', 'url': 'sasb.com',
+                                     'hours': 'some hours'}]
+        # the failed code keeps the fields its other sources provided
+        assert locations['sco'] == [{
+            'code': 'sco', 'label': 'label', 'url': 'schom.com',
+            'errors': [{'source': 'drupal', 'message': 'Drupal is down'}]
+        }]
+        assert failed_codes(locations) == ['sco']
+
+    @patch('lib.http_client.time.sleep')
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           return_value=s3_locations)
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_fetch_locations_preload_failure(self, MockNyplCore, MockS3, mock_sleep,
+                                             monkeypatch, requests_mock):
+        monkeypatch.setenv('DRUPAL_PRELOAD', 'true')
+        lib.location_api.CACHE.clear()
+        lib.location_api.PRELOAD['loaded_at'] = None
+        requests_mock.get(os.environ['DRUPAL_API_BASE_URL'], status_code=503)
+        try:
+            locations = fetch_locations(['mab', 'sco'], ['url', 'hours'])
+        finally:
+            lib.location_api.PRELOAD_FAILURES.clear()
+        # one failed catalog load, with its retries, for both codes
+        assert requests_mock.call_count == lib.http_client.MAX_RETRIES + 1
+        # no catalog to serve from: each code reports it rather than the request failing
+        for code in ['mab', 'sco']:
+            assert locations[code][0]['url'] is not None
+            assert [error['source'] for error in locations[code][0]['errors']] == ['drupal']
+        assert failed_codes(locations) == ['mab', 'sco']
+
+    @patch('lib.location_lookup.check_cache_or_fetch_s3',
+           side_effect=Exception('S3 is down'))
+    @patch('lib.nypl_core.sierra_location_by_code',
+           return_value={'label': 'label'})
+    def test_build_location_info_s3_failure(self, MockNyplCore, MockS3):
+        assert build_location_info('mab', ['url']) == [{
+            'code': None, 'label': 'label', 'url': None,
+            'errors': [{'source': 's3', 'message': 'S3 is down'}]
+        }]
+
+    @freeze_time('2024-01-01 23:30:00')
+    def test_expires_at(self):
+        now = datetime.now().timestamp()
+        lib.location_lookup.S3_CACHE.set('locations', {'data': s3_locations}, fetched_at=now - 600,
+                                         notify=False)
+        lib.location_api.CACHE.set('ma', None, fetched_at=now - 2400, notify=False)
+        lib.location_api.CACHE.set('sc', None, fetched_at=now - 900, notify=False)
+        try:
+            # the S3 mapping is refreshed first
+            assert expires_at(['sco'], ['url']) == now + 3000
+            # then the oldest Drupal entry the response used
+            assert expires_at(['mab', 'sco'], ['location']) == now + 1200
+            # hours expire at midnight
+            with patch('lib.location_lookup.hours_expires_at', return_value=now + 1800):
+                assert expires_at(['sco'], ['hours']) == now + 1800
+            # nothing cached for Drupal yet, so nothing can be cached downstream
+            assert expires_at(['lpa'], ['location']) == 0
+        finally:
+            lib.location_lookup.S3_CACHE.clear()
+            lib.location_api.CACHE.clear()
+
+    def test_fetch_locations_unknown_fields(self, requests_mock):
+        with pytest.raises(ParamError) as error:
+            fetch_locations(['mab'], ['url', 'parking', 'wifi'])
+        assert error.value.message == 'Unknown fields: parking,wifi'
+        assert requests_mock.call_count == 0
@@ -1,9 +1,15 @@
+import base64
+import gzip
 import json
 import os
 import pytest
+import time
+from freezegun import freeze_time
 from unittest.mock import patch
 
-from main import parse_params, load_swagger_docs, handler
+import lib.metrics
+import main
+from main import parse_batch_body, parse_params, load_swagger_docs, handler
 from test.unit.test_helpers import TestHelpers
 from lib.errors import ParamError
 
@@ -34,6 +40,63 @@ class TestMain:
             parse_params({'fields': 'abc'})
         with pytest.raises(ParamError):
             parse_params({'fields': 'abc', 'location_codes': None})
+        with pytest.raises(ParamError) as error:
+            parse_params({'fields': 'url,parking', 'location_codes': 'abc'})
+        assert error.value.message == 'Unknown fields: parking'
+        # label and the long documented address are known fields
+        assert parse_params({'fields': 'label,address', 'location_codes': 'abc'}) == (
+            ['abc'], ['label', 'address'])
+
+    def test_parse_batch_body(self):
+        body = {'fields': 'url,hours',
+                'locations': {'mab': ['location'], 'sco': None, 'myq': 'hours,location'}}
+        assert parse_batch_body({'body': json.dumps(body)}) == \
+            {'mab': ['location'], 'sco': ['url', 'hours'], 'myq': ['hours', 'location']}
+        encoded = base64.b64encode(json.dumps({'locations': ['mab', 'sco', 'mab']}).encode())
+        assert parse_batch_body({'body': encoded, 'isBase64Encoded': True}) == \
+            {'mab': ['url'], 'sco': ['url']}
+
+    def test_parse_batch_body_error(self):
+        for (body, message) in [
+                (None, 'Invalid JSON body'),
+                ('{"locations": ', 'Invalid JSON body'),
+                ('["mab"]', 'Batch body must be a JSON object'),
+                ('{"locations": []}', 'No location codes provided'),
+                ('{"locations": [1]}', 'Invalid location code: 1'),
+                ('{"locations": ["mab", ["sco"]]}', 'Invalid location code: ["sco"]'),
+                ('{"locations": [{"mab": null}]}', 'Invalid location code: {"mab": null}'),
+                ('{"locations": {"mab": [1]}}', 'Invalid fields: [1]'),
+                ('{"locations": ["mab"], "fields": ["parking"]}', 'Unknown fields: parking')]:
+            with pytest.raises(ParamError) as error:
+                parse_batch_body({'body': body})
+            assert error.value.message.startswith(message)
+        with patch('main.MAX_BATCH_CODES', 2), pytest.raises(ParamError) as error:
+            parse_batch_body({'body': '{"locations": ["a", "b", "c"]}'})
+        assert error.value.message == 'At most 2 location codes per batch'
+
+    @patch('main.load_env_file')
+    @patch('main.resolve_locations', return_value={
+        'mab': [{'code': 'mab', 'label': 'label'}],
+        'sco': [{'code': 'sco', 'label': 'label',
+                 'errors': [{'source': 'drupal', 'message': 'Drupal is down'}]}]})
+    def test_handler_batch(self, MockResolve, MockLoadEnvFile):
+        os.environ['ENVIRONMENT'] = 'qa'
+        event = {'path': '/api/v0.1/locations/batch', 'httpMethod': 'POST',
+                 'body': json.dumps({'locations': {'mab': ['hours'], 'sco': None}})}
+        try:
+            response = handler(event, {})
+            assert response['statusCode'] == 200
+            assert json.loads(response['body']) == MockResolve.return_value
+            assert response['headers']['X-Failed-Location-Codes'] == 'sco'
+            assert response['headers']['Cache-Control'] == 'no-store'
+            MockResolve.assert_called_once_with({'mab': ['hours'], 'sco': ['url']})
+            assert handler(dict(event, body='nope'), {})['statusCode'] == 400
+            # other methods and paths are still not implemented
+            assert handler(dict(event, path='/api/v0.1/locations'), {})['statusCode'] == 501
+            assert handler(dict(event, httpMethod='PUT'), {})['statusCode'] == 501
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
 
     def test_load_swagger_docs(self):
         swagger_response = load_swagger_docs()
@@ -55,3 +118,204 @@ class TestMain:
             'httpMethod': 'GET',
             'queryStringParameters': {'location_codes': None}}, {}) \
             .get('statusCode') == 400
+        response = handler({
+            'path': 'api/locations',
+            'httpMethod': 'GET',
+            'queryStringParameters': {'location_codes': 'mal', 'fields': 'parking'}}, {})
+        assert response['statusCode'] == 400
+        assert json.loads(response['body']) == 'Unknown fields: parking'
+
+    @patch('main.load_env_file')
+    @patch('main.fetch_locations', return_value={
+        'mab': [{'code': 'mab', 'label': 'label'}],
+        'sco': [{'code': 'sco', 'label': 'label',
+                 'errors': [{'source': 'drupal', 'message': 'Drupal is down'}]}]})
+    def test_handler_partial_response(self, MockFetch, MockLoadEnvFile):
+        os.environ['ENVIRONMENT'] = 'qa'
+        event = {'path': 'api/locations', 'httpMethod': 'GET',
+                 'queryStringParameters': {'location_codes': 'mab,sco', 'fields': 'hours'}}
+        try:
+            response = handler(event, {})
+            assert response['statusCode'] == 200
+            assert response['headers']['X-Partial-Response'] == 'true'
+            assert response['headers']['X-Failed-Location-Codes'] == 'sco'
+            assert response['headers']['Cache-Control'] == 'no-store'
+            MockFetch.return_value = {'mab': [{'code': 'mab', 'label': 'label'}]}
+            assert 'X-Partial-Response' not in handler(event, {})['headers']
+            # an unexpected error still names the requested codes
+            MockFetch.side_effect = Exception('unexpected')
+            response = handler(event, {})
+            assert response['statusCode'] == 500
+            assert json.loads(response['body']) == 'Failed to fetch locations mab,sco by code'
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
+
+    @patch('main.load_env_file')
+    @patch('main.expires_at', return_value=0)
+    @patch('main.fetch_locations')
+    def test_handler_metrics_record(self, MockFetch, MockExpiresAt, MockLoadEnvFile, capsys):
+        def fetch(location_codes, fields):
+            with lib.metrics.span('nypl_core'):
+                lib.metrics.increment('drupal.cache.hits')
+            with lib.metrics.span('nypl_core'):
+                lib.metrics.increment('drupal.cache.hits')
+            lib.metrics.record_latency('http.drupal', 0.25)
+            lib.metrics.record_latency('http.drupal', 0.0125)
+            return {'mab': [{'code': 'mab', 'label': 'label'}]}
+        MockFetch.side_effect = fetch
+        os.environ['ENVIRONMENT'] = 'qa'
+        lib.metrics.reset()
+        lib.metrics.increment('drupal.cache.hits')
+        event = {'resource': '/api/v0.1/locations', 'path': '/api/v0.1/locations', 'httpMethod': 'GET',
+                 'queryStringParameters': {'location_codes': 'mab'}}
+        try:
+            capsys.readouterr()
+            assert handler(event, {})['statusCode'] == 200
+            record = json.loads(capsys.readouterr().out)
+            assert record['Route'] == 'GET /locations'
+            assert record['StatusCode'] == 200
+            # only what this request counted, with repeated stages summed
+            assert record['drupal.cache.hits'] == 2
+            assert {'total', 'parse', 'nypl_core', 'serialize'} <= set(record)
+            assert record['total'] >= record['nypl_core']
+            metrics = record['_aws']['CloudWatchMetrics'][0]
+            assert metrics['Dimensions'] == [['Route']]
+            assert {'Name': 'drupal.cache.hits', 'Unit': 'Count'} in metrics['Metrics']
+            assert {'Name': 'parse', 'Unit': 'Milliseconds'} in metrics['Metrics']
+            # every upstream call, for CloudWatch to compute percentiles over
+            assert record['http.drupal'] == [250.0, 12.5]
+            assert {'Name': 'http.drupal', 'Unit': 'Milliseconds'} in metrics['Metrics']
+            assert lib.metrics.snapshot()['counters']['drupal.cache.hits'] == 3
+            # unknown paths share one label rather than adding dimension values
+            for path in ['/api/v0.1/nowhere', '/random/abc123']:
+                assert handler(dict(event, path=path, resource='/{proxy+}'), {})['statusCode'] == 404
+                assert json.loads(capsys.readouterr().out)['Route'] == 'unmatched'
+            handler(dict(event, httpMethod='DELETE'), {})
+            assert json.loads(capsys.readouterr().out)['Route'] == 'unmatched'
+            # warm-up pings are not requests
+            handler({'warmup': True}, {})
+            assert capsys.readouterr().out == ''
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
+
+    @patch('main.load_env_file')
+    @patch('main.expires_at')
+    @patch('main.fetch_locations', return_value={'mab': [{'code': 'mab', 'label': 'label'}]})
+    def test_handler_etag(self, MockFetch, MockExpiresAt, MockLoadEnvFile):
+        os.environ['ENVIRONMENT'] = 'qa'
+        event = {'path': 'api/locations', 'httpMethod': 'GET',
+                 'queryStringParameters': {'location_codes': 'mab', 'fields': 'hours'}}
+        try:
+            with freeze_time('2024-01-01 12:00:00'):
+                MockExpiresAt.return_value = time.time() + 600
+                response = handler(event, {})
+                assert response['statusCode'] == 200
+                assert response['headers']['Cache-Control'] == 'public, max-age=600'
+                etag = response['headers']['ETag']
+                # identical content, identical tag
+                assert handler(event, {})['headers']['ETag'] == etag
+                not_modified = handler(dict(event, headers={'if-none-match': f'"other", W/{etag}'}), {})
+                assert not_modified == {
+                    'statusCode': 304, 'body': '', 'isBase64Encoded': False,
+                    'headers': {'ETag': etag, 'Cache-Control': 'public, max-age=600',
+                                'Vary': 'Accept-Encoding'}}
+                MockFetch.return_value = {'mab': [{'code': 'mab', 'label': 'new label'}]}
+                changed = handler(dict(event, headers={'If-None-Match': etag}), {})
+                assert changed['statusCode'] == 200
+                assert changed['headers']['ETag'] != etag
+                # data already due for a refresh is not cached
+                MockExpiresAt.return_value = time.time() - 5
+                assert handler(event, {})['headers']['Cache-Control'] == 'public, max-age=0'
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
+
+    @patch('main.load_env_file')
+    @patch('main.expires_at', return_value=0)
+    @patch('main.fetch_locations')
+    def test_handler_compressed_response(self, MockFetch, MockExpiresAt, MockLoadEnvFile):
+        os.environ['ENVIRONMENT'] = 'qa'
+        locations = {f'ma{i}': [{'code': f'ma{i}', 'label': 'Stephen A. Schwarzman Building'}]
+                     for i in range(100)}
+        MockFetch.return_value = locations
+        event = {'path': 'api/locations', 'httpMethod': 'GET',
+                 'queryStringParameters': {'location_codes': 'ma', 'fields': 'url'}}
+        try:
+            plain = handler(event, {})
+            assert plain['isBase64Encoded'] is False
+            assert json.loads(plain['body']) == locations
+            # without RESPONSE_COMPRESSION bodies are never compressed
+            assert handler(dict(event, headers={'Accept-Encoding': 'gzip'}), {})['body'] == plain['body']
+            os.environ['RESPONSE_COMPRESSION'] = 'true'
+            compressed = handler(dict(event, headers={'Accept-Encoding': 'deflate, gzip;q=0.8'}), {})
+            assert compressed['isBase64Encoded'] is True
+            assert compressed['headers']['Content-Encoding'] == 'gzip'
+            assert compressed['headers']['Vary'] == 'Accept-Encoding'
+            assert json.loads(gzip.decompress(base64.b64decode(compressed['body']))) == locations
+            assert len(compressed['body']) < len(plain['body'])
+            # the gzip representation has a tag of its own
+            assert compressed['headers']['ETag'] != plain['headers']['ETag']
+            assert handler(dict(event, headers={'Accept-Encoding': 'gzip',
+                                                'If-None-Match': compressed['headers']['ETag']}),
+                           {})['statusCode'] == 304
+            assert handler(dict(event, headers={'If-None-Match': compressed['headers']['ETag']}),
+                           {})['statusCode'] == 200
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
+            os.environ.pop('RESPONSE_COMPRESSION', None)
+
+    @patch('main.load_env_file')
+    def test_swagger_docs_compressed(self, MockLoadEnvFile):
+        os.environ['ENVIRONMENT'] = 'qa'
+        os.environ['RESPONSE_COMPRESSION'] = 'true'
+        event = {'path': '/docs/locations', 'httpMethod': 'GET',
+                 'headers': {'accept-encoding': 'gzip'}}
+        try:
+            compressed = handler(event, {})
+            assert compressed['headers']['Content-Encoding'] == 'gzip'
+            assert json.loads(gzip.decompress(base64.b64decode(compressed['body'])))['swagger'] == '2.0'
+            # the cached docs response is left as it was
+            assert main.STARTUP['swagger_response']['isBase64Encoded'] is False
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
+            del os.environ['RESPONSE_COMPRESSION']
+
+    @patch('main.load_config')
+    @patch('main.prewarm', return_value={'s3': {'size': 1, 'seconds': 0.1}})
+    def test_handler_warmup_and_schedule(self, MockPrewarm, MockLoadConfig):
+        # a warm-up ping does no work at all
+        assert handler({'warmup': True}, {})['statusCode'] == 200
+        MockLoadConfig.assert_not_called()
+        MockPrewarm.assert_not_called()
+        with open('events/prewarm.json') as event_file:
+            event = json.load(event_file)
+        assert handler(event, {}) == {'s3': {'size': 1, 'seconds': 0.1}}
+        MockLoadConfig.assert_called_once()
+        MockPrewarm.assert_called_once()
+
+    @patch('main.load_env_file')
+    def test_config_loaded_once_per_container(self, MockLoadEnvFile):
+        main.STARTUP['environment'] = None
+        os.environ['ENVIRONMENT'] = 'qa'
+        event = {'path': '/docs/locations', 'httpMethod': 'GET'}
+        try:
+            assert handler(event, {})['statusCode'] == 200
+            assert handler(event, {})['statusCode'] == 200
+            MockLoadEnvFile.assert_called_once_with('qa', 'config/{}.yaml')
+            # an opt-in reload signal reads the config again
+            handler(dict(event, reloadConfig=True), {})
+            assert MockLoadEnvFile.call_count == 2
+        finally:
+            main.STARTUP['environment'] = None
+            del os.environ['ENVIRONMENT']
+
+    def test_swagger_docs_serialized_once(self):
+        main.STARTUP['swagger_response'] = None
+        first = load_swagger_docs()
+        with patch('builtins.open') as mock_open:
+            assert load_swagger_docs() == first
+            mock_open.assert_not_called()
@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+from freezegun import freeze_time
+from unittest.mock import patch
+
+import lib.http_client
+import lib.nypl_core
+from lib.nypl_core import (NyplCoreObjectsError, sierra_location_by_code,
+                           reduce_nypl_core_objects)
+from test.unit.test_helpers import TestHelpers
+
+by_sierra_location = {
+    'mal': {'code': 'mal', 'label': 'Schwarzman Building - Main Reading Room 315',
+            'collectionTypes': ['Research'], 'sierraDeliveryLocations': []},
+    'mab': {'code': 'mab', 'label': 'Schwarzman Building - Main Reading Room 315'},
+    'xxx': {'code': 'xxx'}
+}
+
+
+class TestNyplCore:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+        TestHelpers.tear_down()
+
+    def setup_method(self):
+        lib.nypl_core.CACHE.clear()
+        lib.nypl_core.FAILURES.clear()
+
+    def teardown_method(self):
+        lib.nypl_core.CACHE.clear()
+        lib.nypl_core.FAILURES.clear()
+
+    @patch('lib.http_client.time.sleep')
+    def test_failed_load_backs_off(self, mock_sleep, requests_mock):
+        requests_mock.get('https://example.com/by_sierra_location.json', status_code=503)
+        with freeze_time('2024-01-01 12:00:00') as frozen_time:
+            for code in ['mal', 'mab', 'xxx', 'sc', 'pa']:
+                with pytest.raises(NyplCoreObjectsError):
+                    sierra_location_by_code(code)
+            # one failed download, with its retries, for all five codes
+            assert requests_mock.call_count == lib.http_client.MAX_RETRIES + 1
+            frozen_time.tick(lib.nypl_core.NYPL_CORE_FAILURE_BACKOFF + 1)
+            requests_mock.get('https://example.com/by_sierra_location.json', json=by_sierra_location)
+            assert sierra_location_by_code('mab') == {'label': 'Schwarzman Building - Main Reading Room 315'}
+            assert 'by_sierra_location.json' not in lib.nypl_core.FAILURES
+
+    def test_reduce_nypl_core_objects(self):
+        labels = reduce_nypl_core_objects('by_sierra_location.json', by_sierra_location.items())
+        assert labels == {
+            'mal': 'Schwarzman Building - Main Reading Room 315',
+            'mab': 'Schwarzman Building - Main Reading Room 315',
+            'xxx': None
+        }
+        # labels shared by several locations are stored once
+        assert labels['mal'] is labels['mab']
+
+    def test_sierra_location_by_code(self, requests_mock):
+        requests_mock.get('https://example.com/by_sierra_location.json',
+                          json=by_sierra_location)
+        assert sierra_location_by_code('mal') == \
+            {'label': 'Schwarzman Building - Main Reading Room 315'}
+        assert sierra_location_by_code('xxx') == {'label': None}
+        assert sierra_location_by_code('zzz') is None
+        # the file is fetched once and kept for the life of the container
+        assert requests_mock.call_count == 1
+
+    def test_concurrent_first_lookups_fetch_once(self, requests_mock):
+        def slow_response(request, context):
+            time.sleep(0.05)
+            return by_sierra_location
+        requests_mock.get('https://example.com/by_sierra_location.json',
+                          json=slow_response)
+        threads = [threading.Thread(target=sierra_location_by_code, args=('mal',))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert requests_mock.call_count == 1
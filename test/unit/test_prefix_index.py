@@ -0,0 +1,31 @@
+from lib.prefix_index import PrefixIndex
+
+
+class TestPrefixIndex:
+
+    def test_match(self):
+        index = PrefixIndex({'ma*': 'sasb.com', 'sc*': 'schom.com'})
+        assert index.match('mab') == 'sasb.com'
+        assert index.match('ma') == 'sasb.com'
+        assert index.match('sco') == 'schom.com'
+        assert len(index) == 2
+
+    def test_no_match(self):
+        index = PrefixIndex({'ma*': 'sasb.com'})
+        # a pattern only matches from the start of the code
+        assert index.match('xma99') is None
+        assert index.match('m') is None
+        assert index.match('') is None
+
+    def test_longest_prefix_wins(self):
+        # insertion order must not matter
+        for mapping in [{'ma*': 'sasb.com', 'mal*': 'mal.com'},
+                        {'mal*': 'mal.com', 'ma*': 'sasb.com'}]:
+            index = PrefixIndex(mapping)
+            assert index.match('mal92') == 'mal.com'
+            assert index.match('mab') == 'sasb.com'
+
+    def test_wildcard_matches_everything(self):
+        index = PrefixIndex({'*': 'nypl.org', 'ma*': 'sasb.com'})
+        assert index.match('xxx') == 'nypl.org'
+        assert index.match('mab') == 'sasb.com'
@@ -0,0 +1,41 @@
+from unittest.mock import patch
+
+import lib.metrics
+from lib.errors import RefineryApiError
+from lib.prewarm import prewarm
+from test.unit.test_helpers import TestHelpers
+
+
+class TestPrewarm:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+        TestHelpers.tear_down()
+
+    def test_prewarm(self):
+        lib.metrics.reset()
+
+        def drupal_down():
+            raise RefineryApiError('Drupal is down')
+
+        with patch.dict('lib.prewarm.SOURCES', {
+                'nypl_core': lambda: {'mal': 'label', 'mab': 'label'},
+                's3': lambda: {'ma*': 'sasb.com'},
+                'drupal': drupal_down,
+                'rc_alerts': lambda: []}):
+            reports = prewarm()
+        assert {source: {key: value for (key, value) in report.items() if key != 'seconds'}
+                for (source, report) in reports.items()} == {
+            'nypl_core': {'size': 2},
+            's3': {'size': 1},
+            'drupal': {'error': 'Drupal is down'},
+            'rc_alerts': {'size': 0}
+        }
+        assert all(report['seconds'] >= 0 for report in reports.values())
+        timings = lib.metrics.snapshot()['timings']
+        assert all(timings[f'prewarm.{source}']['count'] == 1 for source in reports)
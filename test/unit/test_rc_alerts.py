@@ -0,0 +1,94 @@
+from datetime import datetime
+from freezegun import freeze_time
+
+import pytest
+from unittest.mock import patch
+
+import lib.http_client
+import lib.rc_alerts
+from lib.rc_alerts import RCAlerts, RCAlertsError, is_recap_code
+from test.unit.test_helpers import TestHelpers
+
+
+def local(*args):
+    return datetime(*args).astimezone()
+
+
+class TestRCAlerts:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+        TestHelpers.tear_down()
+
+    def setup_method(self):
+        lib.rc_alerts.CACHE.clear()
+        lib.rc_alerts.FAILURES.clear()
+
+    def teardown_method(self):
+        lib.rc_alerts.CACHE.clear()
+        lib.rc_alerts.FAILURES.clear()
+
+    def test_is_recap_code(self):
+        assert is_recap_code('rc')
+        assert is_recap_code('rcma2')
+        assert not is_recap_code('mab')
+
+    def test_parse_alerts(self):
+        with open('data/princeton-closures.csv') as closures_file:
+            text = closures_file.read()
+        (closure,) = RCAlerts.parse_alerts(text + '\n\n2023-12-24,\nnot a date,2023-12-25\n')
+        # whole days, through the end of end_date
+        assert closure.start == local(2023, 12, 18)
+        assert closure.end == local(2023, 12, 21)
+
+    def test_get_alerts_cached(self, requests_mock):
+        feed = requests_mock.get(
+            'https://www.fake_rc_alerts.com',
+            text='start_date,end_date\n2023-12-22,2023-12-26\n2023-12-18,2023-12-20\n2023-12-18,2023-12-20\n')
+        index = RCAlerts.get_alerts()
+        assert [closure.start for closure in index.closures] == [local(2023, 12, 18), local(2023, 12, 22)]
+        assert RCAlerts.get_alerts() is index
+        assert feed.call_count == 1
+
+    @freeze_time('2023-12-19 12:00:00')
+    def test_current_closures(self, requests_mock):
+        requests_mock.get(
+            'https://www.fake_rc_alerts.com',
+            text='start_date,end_date\n2023-12-18,2023-12-20\n2023-12-26,2023-12-27\n2023-12-01,2023-12-02\n')
+        # only closures overlapping the seven days from today
+        assert RCAlerts.current_closures() == [{'applies': {
+            'start': local(2023, 12, 18).isoformat(),
+            'end': local(2023, 12, 21).isoformat()}}]
+
+    def test_refresh_alerts(self, requests_mock):
+        feed = requests_mock.get('https://www.fake_rc_alerts.com',
+                                 text='start_date,end_date\n2023-12-18,2023-12-20\n')
+        RCAlerts.get_alerts()
+        # refreshed whatever its age
+        assert len(RCAlerts.refresh_alerts()) == 1
+        assert feed.call_count == 2
+        assert RCAlerts.get_alerts() is lib.rc_alerts.CACHE.peek('closures')
+
+    def test_get_alerts_error(self, requests_mock):
+        requests_mock.get('https://www.fake_rc_alerts.com', status_code=404)
+        with pytest.raises(RCAlertsError) as error:
+            RCAlerts.get_alerts()
+        assert 'Failed to retrieve ReCAP closures' in error.value.message
+
+    @patch('lib.http_client.time.sleep')
+    def test_get_alerts_error_backs_off(self, mock_sleep, requests_mock):
+        feed = requests_mock.get('https://www.fake_rc_alerts.com', status_code=503)
+        with freeze_time('2023-12-19 12:00:00') as frozen_time:
+            for _ in ['rc', 'rcma2', 'rcpm2', 'rcph2', 'rcpt2']:
+                with pytest.raises(RCAlertsError):
+                    RCAlerts.get_alerts()
+            # one failed fetch, with its retries, for all five codes
+            assert feed.call_count == lib.http_client.MAX_RETRIES + 1
+            frozen_time.tick(lib.rc_alerts.RC_ALERTS_FAILURE_BACKOFF)
+            requests_mock.get('https://www.fake_rc_alerts.com', text='start_date,end_date\n')
+            assert len(RCAlerts.get_alerts()) == 0
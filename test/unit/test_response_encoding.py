@@ -0,0 +1,73 @@
+import base64
+import gzip
+import json
+import os
+
+from unittest.mock import patch
+
+from lib.response_encoding import (MIN_COMPRESS_SIZE, dumps, encode_response,
+                                   negotiate_encoding)
+
+
+class FakeBrotli:
+    @staticmethod
+    def compress(data, quality):
+        return b'br:' + data
+
+
+class TestResponseEncoding:
+
+    def setup_method(self):
+        os.environ['RESPONSE_COMPRESSION'] = 'true'
+
+    def teardown_method(self):
+        del os.environ['RESPONSE_COMPRESSION']
+
+    def test_dumps_is_compact(self):
+        body = {'ma': [{'code': 'ma', 'label': 'Café'}]}
+        assert dumps(body) == '{"ma":[{"code":"ma","label":"Café"}]}'
+        assert json.loads(dumps(body)) == body
+
+    @patch('lib.response_encoding.brotli_module', return_value=None)
+    def test_negotiate_encoding(self, MockBrotli):
+        assert negotiate_encoding(None) is None
+        assert negotiate_encoding('') is None
+        assert negotiate_encoding('gzip, deflate, br') == 'gzip'
+        assert negotiate_encoding('GZIP;q=0.5') == 'gzip'
+        assert negotiate_encoding('gzip;q=0') is None
+        assert negotiate_encoding('deflate, identity') is None
+        assert negotiate_encoding('*') == 'gzip'
+        assert negotiate_encoding('*, gzip;q=0') is None
+        # compression is off unless enabled
+        del os.environ['RESPONSE_COMPRESSION']
+        assert negotiate_encoding('gzip') is None
+        os.environ['RESPONSE_COMPRESSION'] = 'false'
+        assert negotiate_encoding('gzip') is None
+
+    @patch('lib.response_encoding.brotli_module', return_value=FakeBrotli)
+    def test_negotiate_encoding_with_brotli(self, MockBrotli):
+        assert negotiate_encoding('gzip, deflate, br') == 'br'
+        assert negotiate_encoding('gzip, br;q=0.5') == 'gzip'
+        assert negotiate_encoding('br;q=0') is None
+
+    def test_encode_response(self):
+        body = dumps({'codes': ['map99'] * MIN_COMPRESS_SIZE})
+        response = {'statusCode': 200, 'body': body, 'isBase64Encoded': False,
+                    'headers': {'Content-type': 'application/json'}}
+        encoded = encode_response(response, 'gzip')
+        assert encoded['isBase64Encoded'] is True
+        assert encoded['headers'] == {'Content-type': 'application/json', 'Vary': 'Accept-Encoding',
+                                      'Content-Encoding': 'gzip'}
+        assert gzip.decompress(base64.b64decode(encoded['body'])).decode() == body
+        # deterministic, so the same body always gets the same bytes
+        assert encode_response(response, 'gzip') == encoded
+        assert response['body'] == body
+        assert response['headers'] == {'Content-type': 'application/json'}
+        with patch('lib.response_encoding.brotli_module', return_value=FakeBrotli):
+            assert base64.b64decode(encode_response(response, 'br')['body']) == b'br:' + body.encode()
+
+    def test_encode_response_small_body(self):
+        response = {'statusCode': 200, 'body': '"ok"', 'isBase64Encoded': False,
+                    'headers': {'Content-type': 'application/json'}}
+        assert encode_response(response, 'gzip') == \
+            dict(response, headers={'Content-type': 'application/json', 'Vary': 'Accept-Encoding'})
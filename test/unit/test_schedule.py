@@ -0,0 +1,102 @@
+import json
+import pytest
+from datetime import datetime
+
+from lib.schedule import (ScheduleError, compile_schedule,
+                          minutes_from_hours_string, schedule_week)
+
+regular_hours = [
+    {'day': 'Monday', 'hours': '10 AM–6 PM'},
+    {'day': 'Tuesday', 'hours': '10 AM–8 PM'},
+    {'day': 'Wednesday', 'hours': '10 AM–8 PM'},
+    {'day': 'Thursday', 'hours': '10:30 AM–6 PM'},
+    {'day': 'Friday', 'hours': '10 AM–6 PM'},
+    {'day': 'Saturday', 'hours': '10 AM–6 PM'},
+    {'day': 'Sunday', 'hours': 'Closed'}
+]
+
+
+class TestSchedule:
+
+    def test_minutes_from_hours_string(self):
+        assert minutes_from_hours_string('10 AM') == 600
+        assert minutes_from_hours_string('6:17 PM') == 1097
+        assert minutes_from_hours_string('12 AM') == 0
+        assert minutes_from_hours_string('12 PM') == 720
+
+    def day_of_week(self, day, hours):
+        # the week of a schedule holding only this day, as of a saturday
+        schedule = compile_schedule({'regular_hours': [{'day': day, 'hours': hours}]})
+        return schedule_week(schedule, datetime(2000, 1, 1).astimezone())[0]
+
+    def test_schedule_week_day(self):
+        parsed = self.day_of_week('Monday', '10 AM–6 PM')
+        assert parsed['day'] == 'Monday'
+        assert parsed['startTime'] == '2000-01-03T10:00:00-05:00'
+        assert parsed['endTime'] == '2000-01-03T18:00:00-05:00'
+        assert 'today' not in parsed
+
+    def test_schedule_week_day_with_minutes(self):
+        parsed = self.day_of_week('Monday', '10:23 AM–6:17 PM')
+        assert parsed['startTime'] == '2000-01-03T10:23:00-05:00'
+        assert parsed['endTime'] == '2000-01-03T18:17:00-05:00'
+
+    def test_schedule_week_today(self):
+        parsed = self.day_of_week('Saturday', '10 AM–6 PM')
+        assert parsed['startTime'] == '2000-01-01T10:00:00-05:00'
+        assert parsed['endTime'] == '2000-01-01T18:00:00-05:00'
+        assert parsed['today']
+
+    def test_schedule_week_midnight(self):
+        parsed = self.day_of_week('Saturday', '12 AM–12 PM')
+        assert parsed['startTime'] == '2000-01-01T00:00:00-05:00'
+        assert parsed['endTime'] == '2000-01-01T12:00:00-05:00'
+        assert parsed['today']
+
+    def test_schedule_week_noon(self):
+        parsed = self.day_of_week('Saturday', '12 PM–8 PM')
+        assert parsed['startTime'] == '2000-01-01T12:00:00-05:00'
+        assert parsed['endTime'] == '2000-01-01T20:00:00-05:00'
+        assert parsed['today']
+
+    def test_compile_schedule(self):
+        schedule = compile_schedule({'regular_hours': regular_hours})
+        assert schedule.days[3] == ('Thursday', 3, 630, 1080)
+        assert schedule.days[6] == ('Sunday', 6, None, None)
+        # Saturday and Sunday both lead to Monday
+        assert schedule.next_open == (1, 2, 3, 4, 5, 0, 0)
+
+    def test_compile_schedule_prefers_upcoming_hours(self):
+        upcoming_hours = [dict(day, hours='Closed') for day in regular_hours]
+        schedule = compile_schedule({'regular_hours': regular_hours,
+                                     'upcoming_hours': upcoming_hours})
+        assert all(day.opens is None for day in schedule.days)
+        assert schedule.next_open == (None,) * 7
+
+    @pytest.mark.parametrize('hours', [
+        'Noon–6 PM', '10 AM', '10 AM–6', None])
+    def test_compile_schedule_errors(self, hours):
+        with pytest.raises(ScheduleError):
+            compile_schedule({'regular_hours': [{'day': 'Monday', 'hours': hours}]})
+        with pytest.raises(ScheduleError):
+            compile_schedule({'regular_hours': [{'day': 'Someday', 'hours': '10 AM–6 PM'}]})
+
+    def test_schedule_week(self):
+        schedule = compile_schedule({'regular_hours': regular_hours})
+        current_date = datetime(2000, 1, 1).astimezone()  # this is a saturday
+        week = schedule_week(schedule, current_date)
+        assert week[0] == {'day': 'Monday',
+                           'startTime': '2000-01-03T10:00:00-05:00',
+                           'endTime': '2000-01-03T18:00:00-05:00',
+                           'nextBusinessDay': True}
+        assert week[5] == {'day': 'Saturday',
+                           'startTime': '2000-01-01T10:00:00-05:00',
+                           'endTime': '2000-01-01T18:00:00-05:00',
+                           'today': True}
+        assert week[6] == {'day': 'Sunday', 'startTime': None, 'endTime': None}
+
+    def test_schedule_week_after_json_round_trip(self):
+        schedule = compile_schedule({'regular_hours': regular_hours})
+        current_date = datetime(2000, 1, 1).astimezone()
+        assert schedule_week(json.loads(json.dumps(schedule)), current_date) == \
+            schedule_week(schedule, current_date)
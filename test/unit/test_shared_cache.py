@@ -0,0 +1,170 @@
+import os
+import sqlite3
+from freezegun import freeze_time
+from unittest.mock import patch
+
+import pytest
+
+import lib.metrics
+import lib.shared_cache
+from lib.shared_cache import (MemoryBackend, SharedCache, SQLiteBackend,
+                              shared_backend)
+from lib.ttl_cache import TTLCache
+from test.unit.test_helpers import TestHelpers
+
+
+class TestSharedCache:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.tear_down()
+
+    def setup_method(self):
+        lib.shared_cache.BACKENDS.clear()
+        os.environ['SHARED_CACHE_BACKEND'] = 'memory'
+
+    def teardown_method(self):
+        lib.shared_cache.BACKENDS.clear()
+        os.environ.pop('SHARED_CACHE_BACKEND', None)
+        os.environ.pop('SHARED_CACHE_PATH', None)
+
+    @pytest.fixture(params=['memory', 'sqlite'])
+    def backend(self, request, tmp_path):
+        if request.param == 'memory':
+            return MemoryBackend()
+        return SQLiteBackend(str(tmp_path / 'shared' / 'cache.sqlite'))
+
+    def test_backend(self, backend):
+        with freeze_time('2024-01-01 12:00:00') as frozen_time:
+            now = lib.shared_cache.time.time()
+            schedule = [[['Monday', 0, 600, 1080]], [None]]
+            backend.set_many({'v1:drupal:ma': ({'schedule': schedule}, now - 10), 'v1:drupal:xx': (None, now)}, 60)
+            assert backend.get_many(['v1:drupal:ma', 'v1:drupal:xx', 'v1:drupal:sc']) == {
+                'v1:drupal:ma': ({'schedule': schedule}, now - 10),
+                'v1:drupal:xx': (None, now)
+            }
+            # entries are forgotten once their TTL from fetch time has passed
+            frozen_time.tick(51)
+            assert list(backend.get_many(['v1:drupal:ma', 'v1:drupal:xx'])) == ['v1:drupal:xx']
+            backend.clear()
+            assert backend.get_many(['v1:drupal:xx']) == {}
+
+    def test_sqlite_backend_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / 'cache.sqlite')
+        SQLiteBackend(path).set_many({f'key{i}': (i, 1e10) for i in range(1200)}, 60)
+        # a second connection, as another process would open, sees every entry
+        assert len(SQLiteBackend(path).get_many([f'key{i}' for i in range(1200)])) == 1200
+
+    def test_shared_backend_selection(self, tmp_path):
+        assert isinstance(shared_backend(), MemoryBackend)
+        assert shared_backend() is shared_backend()
+        os.environ['SHARED_CACHE_BACKEND'] = 'sqlite'
+        os.environ['SHARED_CACHE_PATH'] = str(tmp_path / 'cache.sqlite')
+        assert isinstance(shared_backend(), SQLiteBackend)
+        os.environ['SHARED_CACHE_BACKEND'] = 'redis'
+        assert shared_backend() is None
+        del os.environ['SHARED_CACHE_BACKEND']
+        assert shared_backend() is None
+        assert SharedCache('drupal', 60).get('ma') is None
+
+    def test_versioned_keys(self):
+        SharedCache('drupal', 60).set('ma', {'code': 'ma'})
+        assert SharedCache('drupal', 60).get('ma')[0] == {'code': 'ma'}
+        assert SharedCache('s3', 60).get('ma') is None
+        with patch('lib.shared_cache.SHARED_CACHE_VERSION', 2):
+            assert SharedCache('drupal', 60).get('ma') is None
+
+    def test_backend_errors_are_misses(self):
+        lib.metrics.reset()
+        shared = SharedCache('drupal', 60)
+        with patch.object(MemoryBackend, 'get_many', side_effect=sqlite3.OperationalError('locked')):
+            assert shared.get('ma') is None
+        shared.set('ma', object())
+        assert lib.metrics.snapshot()['counters']['drupal.shared_cache.errors'] == 2
+
+    def test_ttl_caches_share_fetches(self):
+        # two containers' caches over one shared tier
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            return {'code': key}
+        first = TTLCache('drupal', 60, shared=SharedCache('drupal', 60))
+        second = TTLCache('drupal', 60, shared=SharedCache('drupal', 60))
+        with freeze_time('2024-01-01 12:00:00') as frozen_time:
+            assert first.get('ma', load) == {'code': 'ma'}
+            frozen_time.tick(30)
+            assert second.get('ma', load) == {'code': 'ma'}
+            assert calls == ['ma']
+            # the entry keeps the time it was fetched upstream
+            assert second.fetched_at('ma') == first.fetched_at('ma')
+            frozen_time.tick(31)
+            assert second.get('ma', load) == {'code': 'ma'}
+            second.join()
+            assert calls == ['ma', 'ma']
+
+    def test_load_shared(self):
+        cache = TTLCache('drupal', 60, shared=SharedCache('drupal', 60))
+        TTLCache('drupal', 60, shared=SharedCache('drupal', 60)).update({'ma': {'code': 'ma'}, 'xx': None},
+                                                                        share=True)
+        assert cache.load_shared(['ma', 'sc', 'xx']) == ['sc']
+        assert cache.peek('ma') == {'code': 'ma'}
+        assert 'xx' in cache
+        assert TTLCache('test', 60).load_shared(['ma']) == ['ma']
+
+    def test_leases(self, backend):
+        assert backend.acquire_many(['v1:drupal:ma', 'v1:drupal:sc'], 10) == ['v1:drupal:ma', 'v1:drupal:sc']
+        assert backend.acquire_many(['v1:drupal:ma', 'v1:drupal:lpa'], 10) == ['v1:drupal:lpa']
+        backend.release_many(['v1:drupal:ma'])
+        assert backend.acquire_many(['v1:drupal:ma'], 10) == ['v1:drupal:ma']
+
+    def test_load_waits_for_leased_fetch(self):
+        # another container holds the lease and stores the value while this one waits
+        calls = []
+        shared = SharedCache('drupal', 60)
+        assert shared.acquire_many(['ma']) == ['ma']
+
+        def sleep(seconds):
+            SharedCache('drupal', 60).set('ma', {'code': 'ma'})
+        with patch('lib.shared_cache.time.sleep', side_effect=sleep):
+            value, _ = shared.load('ma', calls.append, lib.shared_cache.time.time())
+        assert value == {'code': 'ma'}
+        assert calls == []
+
+    def test_load_fetches_after_lease_wait(self):
+        shared = SharedCache('drupal', 60)
+        with patch('lib.shared_cache.time.sleep'):
+            assert shared.load('ma', lambda key: {'code': key}, 1e10) == ({'code': 'ma'}, 1e10)
+        # the lease is given up once fetched
+        assert shared.acquire_many(['ma']) == ['ma']
+
+    def test_load_keeps_other_containers_lease(self):
+        # container A holds the lease while B gives up waiting and fetches
+        holder = SharedCache('drupal', 60)
+        assert holder.acquire_many(['ma']) == ['ma']
+        with patch('lib.shared_cache.LEASE_WAIT', 0), patch('lib.shared_cache.time.sleep'):
+            assert SharedCache('drupal', 60).load('ma', lambda key: {'code': key}, 1e10) == \
+                ({'code': 'ma'}, 1e10)
+        # A's lease is still in place, so a third caller does not fetch as well
+        assert SharedCache('drupal', 60).acquire_many(['ma']) == []
+        holder.release_many(['ma'])
+        assert SharedCache('drupal', 60).acquire_many(['ma']) == ['ma']
+
+    def test_wait_many_shares_one_deadline(self):
+        shared = SharedCache('drupal', 60)
+        polls = []
+
+        def sleep(seconds):
+            polls.append(seconds)
+            if len(polls) == 2:
+                SharedCache('drupal', 60).set_many({'ma': 1, 'sc': 2})
+        with patch('lib.shared_cache.LEASE_WAIT', 0.2), \
+                patch('lib.shared_cache.time.sleep', side_effect=sleep):
+            found = shared.wait_many(['ma', 'sc', 'lpa'], lib.shared_cache.time.time())
+        assert {key: value for (key, (value, _)) in found.items()} == {'ma': 1, 'sc': 2}
+        # entries fetched too long before the wait started do not count
+        with patch('lib.shared_cache.LEASE_WAIT', 0.05), patch('lib.shared_cache.time.sleep'):
+            assert shared.wait_many(['ma'], lib.shared_cache.time.time() + 120) == {}
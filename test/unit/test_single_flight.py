@@ -0,0 +1,55 @@
+import pytest
+import threading
+import time
+
+from lib.single_flight import SingleFlight
+
+
+class TestSingleFlight:
+
+    def run_concurrently(self, count, target):
+        results = [None] * count
+
+        def run(index):
+            try:
+                results[index] = target()
+            except Exception as e:
+                results[index] = e
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_one_result(self):
+        flights = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'mapping'
+        results = self.run_concurrently(10, lambda: flights.do('s3', fetch))
+        assert results == ['mapping'] * 10
+        assert len(calls) == 1
+
+    def test_concurrent_calls_share_one_error(self):
+        flights = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            raise KeyError('s3')
+        results = self.run_concurrently(5, lambda: flights.do('s3', fetch))
+        assert all(isinstance(result, KeyError) for result in results)
+        assert len(calls) == 1
+
+    def test_sequential_calls_run_again(self):
+        flights = SingleFlight()
+        assert flights.do('s3', lambda: 1) == 1
+        assert flights.do('s3', lambda: 2) == 2
+        with pytest.raises(ZeroDivisionError):
+            flights.do('s3', lambda: 1 / 0)
+        assert flights.do('s3', lambda: 3) == 3
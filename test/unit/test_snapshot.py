@@ -0,0 +1,115 @@
+import os
+import time
+
+import lib.nypl_core
+import lib.snapshot
+from lib.snapshot import (flush_snapshots, read_snapshot, write_snapshot,
+                          persist_cache, restore_cache)
+from lib.ttl_cache import TTLCache
+from test.unit.test_helpers import TestHelpers
+
+
+class TestSnapshot:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_env_vars()
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.clear_env_vars()
+        TestHelpers.tear_down()
+
+    def setup_method(self):
+        lib.snapshot.RESTORED.clear()
+        lib.snapshot.LAST_WRITTEN.clear()
+        os.environ.pop('SNAPSHOT_DIR', None)
+
+    def teardown_method(self):
+        for timer in lib.snapshot.PENDING.values():
+            timer.cancel()
+        lib.snapshot.PENDING.clear()
+        lib.snapshot.RESTORED.clear()
+        lib.snapshot.LAST_WRITTEN.clear()
+        os.environ.pop('SNAPSHOT_DIR', None)
+
+    def test_disabled_without_snapshot_dir(self):
+        assert not write_snapshot('s3', {'ma*': 'sasb.com'})
+        assert read_snapshot('s3') is None
+
+    def test_round_trip(self, tmp_path):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        assert read_snapshot('s3') is None
+        assert write_snapshot('s3', {'ma*': 'sasb.com'})
+        (data, written_at) = read_snapshot('s3')
+        assert data == {'ma*': 'sasb.com'}
+        assert time.time() - written_at < 60
+
+    def test_ignores_other_versions(self, tmp_path):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        write_snapshot('s3', {'ma*': 'sasb.com'})
+        lib.snapshot.SNAPSHOT_VERSION += 1
+        try:
+            assert read_snapshot('s3') is None
+        finally:
+            lib.snapshot.SNAPSHOT_VERSION -= 1
+
+    def test_ignores_corrupt_snapshot(self, tmp_path):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        with open(tmp_path / 's3.snapshot', 'w') as snapshot_file:
+            snapshot_file.write('{"version": 1, "name": "s3"}\n{"ma*": ')
+        assert read_snapshot('s3') is None
+
+    def test_unwritable_snapshot_leaves_no_temp_file(self, tmp_path):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        assert not write_snapshot('s3', {'ma*': object()})
+        assert os.listdir(tmp_path) == []
+
+    def test_persist_cache_debounced(self, tmp_path):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        cache = TTLCache('drupal', 60)
+        cache.set('ma', {'changed': 'today'})
+        assert persist_cache('drupal', cache)
+        # updates within the interval are written together, once
+        for code in ('sc', 'lpa', 'xx'):
+            cache.set(code, None)
+            assert not persist_cache('drupal', cache)
+        assert len(lib.snapshot.PENDING) == 1
+        assert [entry[0] for entry in read_snapshot('drupal')[0]] == ['ma']
+        flush_snapshots()
+        assert lib.snapshot.PENDING == {}
+        assert [entry[0] for entry in read_snapshot('drupal')[0]] == ['ma', 'sc', 'lpa', 'xx']
+
+    def test_persist_and_restore_cache(self, tmp_path):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        cache = TTLCache('drupal', 60, on_update=lambda c: persist_cache('drupal', c))
+        cache.set('ma', {'changed': 'today'}, fetched_at=1000)
+        cache.set('xx', None)
+        flush_snapshots()
+        restored = TTLCache('drupal', 60)
+        assert restore_cache('drupal', restored)
+        assert restored.peek('ma') == {'changed': 'today'}
+        assert 'xx' in restored
+        # entries keep their original fetch times so they revalidate
+        assert restored.fetched_at('ma') == 1000
+        assert not restored.is_fresh('ma')
+        # only the first call in a container reads the snapshot
+        assert not restore_cache('drupal', TTLCache('drupal', 60))
+
+    def test_nypl_core_served_from_snapshot(self, tmp_path, requests_mock):
+        os.environ['SNAPSHOT_DIR'] = str(tmp_path)
+        lib.nypl_core.CACHE.clear()
+        write_snapshot('nypl-core-by_sierra_location', {'mal': 'old'})
+        requests_mock.get('https://example.com/by_sierra_location.json',
+                          json={'mal': {'label': 'new'}})
+        try:
+            assert lib.nypl_core.sierra_location_by_code('mal') == {'label': 'old'}
+            # the background revalidation replaces the cache and snapshot
+            for _ in range(100):
+                if requests_mock.called and \
+                        read_snapshot('nypl-core-by_sierra_location')[0]['mal'] == 'new':
+                    break
+                time.sleep(0.01)
+            assert lib.nypl_core.sierra_location_by_code('mal') == {'label': 'new'}
+        finally:
+            lib.nypl_core.CACHE.clear()
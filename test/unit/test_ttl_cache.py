@@ -0,0 +1,143 @@
+import pytest
+import threading
+import time
+from freezegun import freeze_time
+
+from lib.failure_backoff import FailureBackoff
+from lib.ttl_cache import TTLCache
+from test.unit.test_helpers import TestHelpers
+
+
+class TestTTLCache:
+    @classmethod
+    def setup_class(cls):
+        TestHelpers.set_up()
+
+    @classmethod
+    def teardown_class(cls):
+        TestHelpers.tear_down()
+
+    def loader(self, values):
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            value = values[key]
+            if isinstance(value, Exception):
+                raise value
+            return value
+        return (load, calls)
+
+    def test_hit_and_miss(self):
+        cache = TTLCache('test', 60)
+        (load, calls) = self.loader({'ma': 'sasb', 'xx': None})
+        assert cache.get('ma', load) == 'sasb'
+        assert cache.get('ma', load) == 'sasb'
+        # lookups that found nothing are cached too
+        assert cache.get('xx', load) is None
+        assert cache.get('xx', load) is None
+        assert calls == ['ma', 'xx']
+        assert cache.stats() == {'hits': 2, 'misses': 2, 'stale': 0,
+                                 'errors': 0, 'size': 2}
+
+    def test_ttl_is_per_key_from_fetch_time(self):
+        cache = TTLCache('test', 60)
+        with freeze_time('2000-01-01 00:00:00'):
+            cache.set('ma', 'old ma')
+        with freeze_time('2000-01-01 00:00:50'):
+            cache.set('sc', 'old sc')
+        with freeze_time('2000-01-01 00:01:30'):
+            assert not cache.is_fresh('ma')
+            assert cache.is_fresh('sc')
+
+    def test_stale_while_revalidate(self):
+        cache = TTLCache('test', 60)
+        (load, calls) = self.loader({'ma': 'new ma'})
+        with freeze_time('2000-01-01 00:00:00'):
+            cache.set('ma', 'old ma')
+        with freeze_time('2000-01-01 00:02:00'):
+            # the last good value is served while one refresh runs
+            assert cache.get('ma', load) == 'old ma'
+            cache.join()
+            assert cache.get('ma', load) == 'new ma'
+        assert calls == ['ma']
+        assert cache.stale == 1
+
+    def test_serves_stale_on_error(self):
+        cache = TTLCache('test', 60, stale_ttl=120)
+        (load, calls) = self.loader({'ma': Exception('Drupal is down')})
+        with freeze_time('2000-01-01 00:00:00'):
+            cache.set('ma', 'old ma')
+        with freeze_time('2000-01-01 00:01:30'):
+            assert cache.get('ma', load) == 'old ma'
+            cache.join()
+        with freeze_time('2000-01-01 00:05:00'):
+            # past stale_ttl the refresh is synchronous but still falls back
+            assert cache.get('ma', load) == 'old ma'
+        assert calls == ['ma', 'ma']
+        assert cache.errors == 2
+
+    def test_miss_raises_loader_error(self):
+        cache = TTLCache('test', 60)
+        (load, calls) = self.loader({'ma': KeyError('ma')})
+        with pytest.raises(KeyError):
+            cache.get('ma', load)
+        assert 'ma' not in cache
+
+    def test_backoff_skips_failed_loader(self):
+        cache = TTLCache('test', 60, backoff=FailureBackoff(30))
+        (load, calls) = self.loader({'ma': KeyError('ma')})
+        with freeze_time('2000-01-01 00:00:00') as frozen_time:
+            for _ in range(3):
+                with pytest.raises(KeyError):
+                    cache.get('ma', load)
+            assert calls == ['ma']
+            frozen_time.tick(30)
+            with pytest.raises(KeyError):
+                cache.get('ma', load)
+        assert calls == ['ma', 'ma']
+
+    def test_lru_eviction(self):
+        cache = TTLCache('test', 60, maxsize=2)
+        (load, calls) = self.loader({'ma': 1, 'sc': 2, 'lpa': 3})
+        cache.get('ma', load)
+        cache.get('sc', load)
+        cache.get('ma', load)
+        cache.get('lpa', load)
+        assert sorted(cache) == ['lpa', 'ma']
+
+    def test_concurrent_expiry_loads_once(self):
+        cache = TTLCache('test', 60, stale_ttl=60)
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            time.sleep(0.05)
+            return 'new ' + key
+        with freeze_time('2000-01-01 00:00:00'):
+            cache.set('ma', 'old ma')
+        with freeze_time('2000-01-01 00:05:00'):
+            # past stale_ttl every caller needs the refreshed value
+            threads = [threading.Thread(target=cache.get, args=('ma', load)) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert cache.get('ma', load) == 'new ma'
+        assert calls == ['ma']
+
+    def test_concurrent_misses_load_once(self):
+        cache = TTLCache('test', 60)
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            time.sleep(0.05)
+            return key.upper()
+        threads = [threading.Thread(target=cache.get, args=('ma', load)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert calls == ['ma']
+        assert cache.misses == 10